@@ -0,0 +1,131 @@
+"""
+Registro de los clientes de servicios externos (OpenAI, Cohere, Cloudinary y el índice vectorial).
+
+Cada cliente se crea la primera vez que se usa, no al importar los módulos: arrancar la API o un
+worker no abre conexiones ni falla si un servicio no responde. Los clientes de OpenAI y Cohere
+comparten un mismo pool de conexiones HTTP con keep-alive (y otro para sus variantes async), así
+que pipeline.py y rag_service.py reutilizan las conexiones TLS ya abiertas.
+
+`warm_up()` crea por adelantado los clientes indicados (la API lo llama al arrancar, ver app/main.py)
+para que la primera petición no pague su inicialización.
+"""
+import threading
+
+import cloudinary
+import cloudinary.uploader
+import cohere
+import httpx
+import openai
+
+from app.core.config import settings
+from app.services.tokenizer import count_tokens
+from app.services.vector_store import VectorStore, get_vector_store
+
+_clients = {}
+_lock = threading.RLock() # Reentrante: la creación de un cliente pide a su vez el pool HTTP
+
+
+def _get(name: str, factory):
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(settings.HTTP_TIMEOUT_SECONDS, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS)
+
+
+def http_client() -> httpx.Client:
+    """Pool HTTP compartido por los clientes síncronos."""
+    return _get("http", lambda: httpx.Client(limits=_http_limits(), timeout=_http_timeout()))
+
+
+def async_http_client() -> httpx.AsyncClient:
+    """Pool HTTP compartido por los clientes async."""
+    return _get("async_http", lambda: httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout()))
+
+
+def openai_client() -> openai.OpenAI:
+    # La librería de OpenAI lee la variable de entorno OPENAI_API_KEY automáticamente.
+    return _get("openai", lambda: openai.OpenAI(http_client=http_client()))
+
+
+def async_openai_client() -> openai.AsyncOpenAI:
+    return _get("async_openai", lambda: openai.AsyncOpenAI(http_client=async_http_client()))
+
+
+def cohere_client() -> cohere.Client:
+    return _get("cohere", lambda: cohere.Client(settings.COHERE_API_KEY, httpx_client=http_client()))
+
+
+def async_cohere_client() -> cohere.AsyncClient:
+    return _get("async_cohere", lambda: cohere.AsyncClient(settings.COHERE_API_KEY, httpx_client=async_http_client()))
+
+
+def _configure_cloudinary():
+    cloudinary.config(
+        cloud_name=settings.CLOUDINARY_CLOUD_NAME,
+        api_key=settings.CLOUDINARY_API_KEY,
+        api_secret=settings.CLOUDINARY_API_SECRET,
+    )
+    return cloudinary.uploader
+
+
+def cloudinary_uploader():
+    """Módulo `cloudinary.uploader`, con la cuenta configurada la primera vez."""
+    return _get("cloudinary", _configure_cloudinary)
+
+
+def vector_store() -> VectorStore:
+    """Índice vectorial configurado (Pinecone o local)."""
+    return get_vector_store()
+
+
+def _load_tokenizer():
+    count_tokens("")
+
+
+WARM_UP = {
+    "openai": openai_client,
+    "cohere": cohere_client,
+    "cloudinary": cloudinary_uploader,
+    "vector_store": vector_store,
+    "tokenizer": _load_tokenizer,
+}
+
+
+def warm_up(*names: str):
+    """
+    Crea los clientes indicados (todos los de WARM_UP si no se indica ninguno). Un servicio que
+    no responde no impide arrancar: el error se registra y el cliente se volverá a intentar crear al usarlo.
+    """
+    for name in names or WARM_UP:
+        try:
+            WARM_UP[name]()
+        except Exception as e:
+            print(f"CLIENTS: No se pudo inicializar '{name}': {e}")
+
+
+async def close_clients():
+    """Cierra los pools HTTP compartidos (al apagar la API)."""
+    with _lock:
+        sync_client = _clients.pop("http", None)
+        async_client = _clients.pop("async_http", None)
+        for name in ("openai", "async_openai", "cohere", "async_cohere"):
+            _clients.pop(name, None)
+    if sync_client is not None:
+        sync_client.close()
+    if async_client is not None:
+        await async_client.aclose()
@@ -10,6 +10,175 @@ class Settings(BaseSettings):
     CLOUDINARY_API_SECRET: str
     COHERE_API_KEY: str
 
+    # --- Clientes de servicios externos (ver app/core/clients.py) ---
+    # Pool HTTP con keep-alive compartido por los clientes de OpenAI y Cohere.
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_KEEPALIVE_EXPIRY_SECONDS: float = 60.0
+    HTTP_TIMEOUT_SECONDS: float = 60.0
+    HTTP_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    # Crear los clientes al arrancar la API y los workers, en lugar de en la primera petición.
+    CLIENTS_WARM_UP: bool = True
+
+    # --- Índice vectorial (ver app/services/vector_store.py) ---
+    # "pinecone" o "local" (matriz memory-mapped en disco, sin dependencias externas).
+    VECTOR_STORE_BACKEND: str = "pinecone"
+    PINECONE_INDEX_NAME: str = "vigilancia-dev-index"
+    LOCAL_VECTOR_STORE_DIR: str = "data/vector_store"
+    # Precisión de la matriz local: "float32", "float16" (mitad de memoria) o "int8" (un cuarto, cuantizado por fila).
+    LOCAL_VECTOR_STORE_DTYPE: str = "float32"
+    # Fracción de filas borradas a partir de la cual se compacta la matriz local.
+    LOCAL_VECTOR_STORE_COMPACT_RATIO: float = 0.25
+    # Segundos entre comprobaciones de las escrituras de otros procesos en el almacén local al consultar.
+    LOCAL_VECTOR_STORE_REFRESH_SECONDS: float = 0.5
+    # Chunks (texto y ubicación) que se mantienen en el LRU en memoria delante de la tabla de chunks.
+    CHUNK_STORE_CACHE_ITEMS: int = 20000
+
+    # --- Versiones del índice (ver app/services/index_versions.py) ---
+    # Chunking y modelo de embeddings del índice original (namespace "default") y, por defecto, de las versiones nuevas.
+    CHUNK_SIZE: int = 1000
+    CHUNK_OVERLAP: int = 200
+    EMBEDDING_MODEL: str = "text-embedding-3-small"
+    # Cada cuánto (s) la API y los workers vuelven a leer la versión activa y las versiones en construcción.
+    INDEX_VERSION_CHECK_SECONDS: float = 5.0
+    # Ritmo máximo de la reconstrucción de una versión, para no competir con la ingesta ni con las consultas.
+    INDEX_REBUILD_DOCUMENTS_PER_MINUTE: int = 60
+
+    # --- Recuperación (RAG) ---
+    # Número máximo de búsquedas simultáneas en Pinecone por consulta expandida.
+    RAG_SEARCH_CONCURRENCY: int = 4
+    # Tiempo máximo (segundos) que esperamos por cada búsqueda antes de descartarla.
+    RAG_SEARCH_TIMEOUT_SECONDS: float = 5.0
+    # Modo de recuperación por defecto (se puede indicar por consulta):
+    #   "dense": expansión con LLM + búsqueda vectorial.
+    #   "hybrid": expansión con LLM + búsqueda vectorial y BM25 fusionadas con RRF.
+    #   "hybrid_fast": vectorial + BM25 solo con la consulta original, sin la llamada de expansión al LLM.
+    RAG_RETRIEVAL_MODE: str = "hybrid"
+    # Constante k de Reciprocal Rank Fusion y número de candidatos fusionados que pasan al re-ranking.
+    RRF_K: int = 60
+    RAG_RERANK_CANDIDATES: int = 40
+    # Chunks que pasan del re-ranking al contexto y presupuesto (tokens) del contexto del prompt.
+    # Los chunks solapados del mismo documento se fusionan (ver app/services/context_builder.py).
+    RAG_CONTEXT_CHUNKS: int = 8
+    RAG_CONTEXT_MAX_TOKENS: int = 3000
+    # /query/batch: consultas como máximo por petición y consultas que se re-rankean y generan a la vez.
+    RAG_BATCH_MAX_QUERIES: int = 500
+    RAG_BATCH_CONCURRENCY: int = 8
+    # Filtros de /query/ que no están en los vectores (editor, palabras clave) se resuelven a IDs de
+    # documento; como máximo tantos como admite un `$in` de Pinecone.
+    RAG_FILTER_MAX_DOCUMENT_IDS: int = 10000
+
+    # --- Nivel de calidad / presupuesto de latencia de /query/ (ver QueryPlan en rag_service.py) ---
+    # "fast", "balanced" o "deep"; se usa cuando la petición no indica nivel ni presupuesto.
+    RAG_QUALITY_TIER: str = "balanced"
+    # Si la petición solo indica presupuesto (ms), hasta estos límites se usa "fast" / "balanced"; por encima, "deep".
+    RAG_FAST_BUDGET_MS: int = 2000
+    RAG_BALANCED_BUDGET_MS: int = 5000
+    # Similitud coseno del mejor resultado a partir de la cual la primera búsqueda se considera concluyente.
+    RAG_EXPANSION_SKIP_SCORE: float = 0.6
+    # Diferencia de similitud entre el último chunk del contexto y el siguiente para omitir el re-ranking (nivel "fast").
+    RAG_RERANK_SKIP_MARGIN: float = 0.05
+    # Coste estimado (ms) de cada etapa opcional; si el presupuesto restante no alcanza, se omite.
+    RAG_EXPANSION_COST_MS: float = 1500
+    RAG_RERANK_COST_MS: float = 500
+
+    # --- Índice léxico BM25 (ver app/services/lexical_index.py) ---
+    LEXICAL_INDEX_PATH: str = "data/lexical_index.sqlite3"
+    BM25_K1: float = 1.2
+    BM25_B: float = 0.75
+
+    # --- Caché de embeddings ---
+    # Nivel persistente (SQLite) compartido por la ingesta y las consultas.
+    EMBEDDING_CACHE_PATH: str = "data/embedding_cache.sqlite3"
+    # Número de embeddings que se mantienen en el LRU en memoria de cada proceso.
+    EMBEDDING_CACHE_MEMORY_ITEMS: int = 10000
+    # Tamaño máximo (bytes) del nivel persistente antes de desalojar las entradas más antiguas.
+    EMBEDDING_CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    # Segundos entre escrituras de la fecha de último uso de las entradas leídas (también se escriben con cada put).
+    EMBEDDING_CACHE_TOUCH_FLUSH_SECONDS: float = 60.0
+
+    # --- Caché de respuestas de /query/ ---
+    ANSWER_CACHE_MAX_ITEMS: int = 1000
+    ANSWER_CACHE_TTL_SECONDS: float = 3600
+    # Reutilizar respuestas de consultas casi idénticas (similitud coseno de sus embeddings).
+    ANSWER_CACHE_SEMANTIC: bool = True
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    # Cada cuántos segundos se comprueba en la base de datos si otra ingesta cambió el corpus.
+    ANSWER_CACHE_VERSION_CHECK_SECONDS: float = 5.0
+
+    # --- Cola de ingesta (ver app/worker.py) ---
+    # Directorio donde se guardan los PDF subidos hasta que su trabajo de ingesta termina.
+    UPLOAD_DIR: str = "data/uploads"
+    # Tamaño máximo de cada archivo subido (también de cada PDF dentro de un ZIP); por encima se responde 413.
+    UPLOAD_MAX_BYTES: int = 256 * 1024 * 1024
+    # Los archivos se copian a UPLOAD_DIR por bloques de este tamaño, sin cargarlos enteros en memoria.
+    UPLOAD_SPOOL_CHUNK_BYTES: int = 1024 * 1024
+    # Número de procesos worker que consumen la cola.
+    INGESTION_WORKERS: int = 2
+    INGESTION_MAX_ATTEMPTS: int = 3
+    # Retraso base (segundos) antes de reintentar un trabajo fallido; se duplica en cada intento.
+    INGESTION_RETRY_BASE_SECONDS: float = 30.0
+    INGESTION_POLL_SECONDS: float = 2.0
+    # Un trabajo 'running' sin heartbeat durante este tiempo se considera huérfano y se reencola.
+    INGESTION_LEASE_SECONDS: float = 300.0
+    # Reintentos por etapa de red dentro del pipeline (Cloudinary, OpenAI, Pinecone).
+    STAGE_RETRY_ATTEMPTS: int = 3
+    STAGE_RETRY_BASE_SECONDS: float = 1.0
+
+    # --- Extracción de texto de los PDF (ver app/services/pdf_extraction.py) ---
+    # Procesos de cada worker que extraen en paralelo rangos de páginas; 0 reparte los núcleos entre
+    # los INGESTION_WORKERS y 1 extrae en el propio hilo del pipeline. Nunca más que núcleos: con uno
+    # solo, el pool es más lento que extraer en el hilo.
+    PDF_EXTRACTION_PROCESSES: int = 0
+    # Solo los PDF con al menos estas páginas se reparten entre procesos. Medido con benchmarks/chunking.py:
+    # ~2,4 ms por página en serie frente a ~50 ms fijos más un ~20 % por página en el pool (abrir el PDF en
+    # cada proceso, pasar el texto); con 2 procesos compensa desde unas 60 páginas, y se deja margen
+    # porque la extracción compite con las demás etapas del pipeline.
+    PDF_PARALLEL_MIN_PAGES: int = 200
+    PDF_EXTRACTION_PAGES_PER_TASK: int = 32
+
+    # --- Listado de documentos (/documents/) ---
+    # Tamaño máximo de página; el listado pagina por cursor (cabecera X-Next-Cursor).
+    DOCUMENTS_PAGE_MAX_LIMIT: int = 500
+
+    # --- Estado de la ingesta en la API (ver app/services/status_cache.py) ---
+    # Cada cuántos segundos la API lee de la base de datos los cambios de estado (uno solo para todos los clientes).
+    STATUS_POLL_SECONDS: float = 1.0
+    STATUS_CACHE_MAX_ITEMS: int = 50000
+    # IDs como máximo por petición a /documents/status y /documents/status/stream.
+    STATUS_MAX_IDS: int = 1000
+
+    # --- Embeddings (ver app/services/embedding_batcher.py) ---
+    # Límites por petición a la API de embeddings.
+    EMBEDDING_REQUEST_MAX_TOKENS: int = 100000
+    EMBEDDING_REQUEST_MAX_INPUTS: int = 2048
+    # Peticiones de embeddings simultáneas por llamada al batcher.
+    EMBEDDING_CONCURRENCY: int = 4
+    # Presupuesto por minuto compartido por todo el proceso (ajustar al tier de la cuenta de OpenAI).
+    EMBEDDING_RPM_LIMIT: int = 3000
+    EMBEDDING_TPM_LIMIT: int = 1000000
+    # Reintentos ante 429/5xx/errores de conexión, con backoff exponencial y jitter.
+    EMBEDDING_MAX_RETRIES: int = 6
+    EMBEDDING_RETRY_BASE_SECONDS: float = 1.0
+
+    # --- Pipeline de ingesta por lotes ---
+    # Tokens máximos de cada lote de chunks; cada lote se embebe y se sube a Pinecone como una unidad.
+    EMBEDDING_BATCH_MAX_TOKENS: int = 50000
+    # Lotes que se embeben/suben en paralelo en cada proceso mientras se preparan los siguientes.
+    INGESTION_UPSERT_CONCURRENCY: int = 2
+    # Lotes en vuelo como máximo por documento (acota la memoria usada por chunks y embeddings pendientes).
+    INGESTION_MAX_BATCHES_IN_FLIGHT: int = 4
+    # Tiempo máximo (segundos) que un lote incompleto espera a combinarse con los de otros documentos.
+    INGESTION_SHARED_BATCH_LINGER_SECONDS: float = 0.2
+
+    # --- Subida masiva (ver /upload-documents/batch) ---
+    # Número máximo de PDF por lote (contando los que vienen dentro de archivos ZIP).
+    BATCH_UPLOAD_MAX_FILES: int = 1000
+    # Tamaño total máximo (bytes, sin comprimir) de los PDF de un lote; los ZIP se dejan de extraer al superarlo.
+    BATCH_UPLOAD_MAX_TOTAL_BYTES: int = 5 * 1024 * 1024 * 1024
+    # Documentos de un mismo lote que cada proceso worker ingiere a la vez.
+    INGESTION_BATCH_PARALLEL_DOCUMENTS: int = 4
+
     # Le decimos a Pydantic que cargue desde .env y que ignore cualquier variable extra que encuentre.
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
@@ -1,6 +1,14 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import func, insert, cast
+from sqlalchemy.dialects.postgresql import array
+from datetime import datetime, timedelta, timezone
 from app.models.document import Document
-from typing import List, Optional
+from app.models.ingestion_job import IngestionJob
+from app.models.document_chunk import DocumentChunk
+from app.models.ingestion_batch import IngestionBatch
+from app.models.index_version import IndexVersion
+from typing import Dict, List, Optional, Sequence
+import json
 
 def create_document(db: Session, document_data: dict) -> Document:
     db_document = Document(**document_data)
@@ -16,15 +24,554 @@ def get_document_status(db: Session, document_id: int) -> Optional[str]:
         return None
     return document.status
 
-def get_documents(db: Session, skip: int = 0, limit: int = 100) -> List[Document]:
-    """Recupera una lista de documentos, con paginación."""
-    return db.query(Document).order_by(Document.id.desc()).offset(skip).limit(limit).all()
+def get_document_statuses(db: Session, document_ids: List[int]) -> list:
+    """Estado, etapa y fecha del último cambio de varios documentos, en una sola consulta."""
+    if not document_ids:
+        return []
+    return (
+        db.query(Document.id, Document.status, Document.ingestion_stage, Document.status_updated_at)
+        .filter(Document.id.in_(set(document_ids)))
+        .all()
+    )
+
+def get_document_status_changes(db: Session, since: datetime) -> list:
+    """Documentos cuyo estado o etapa cambió desde `since` (una consulta sobre un índice)."""
+    return (
+        db.query(Document.id, Document.status, Document.ingestion_stage, Document.status_updated_at)
+        .filter(Document.status_updated_at >= since)
+        .order_by(Document.status_updated_at)
+        .all()
+    )
+
+def update_document_stage(db: Session, document_id: int, stage: str):
+    """Registra la etapa del pipeline en la que está un documento en proceso."""
+    db.query(Document).filter(Document.id == document_id, Document.status == 'processing').update(
+        {"ingestion_stage": stage, "status_updated_at": _utcnow()}, synchronize_session=False
+    )
+    db.commit()
+
+def get_document(db: Session, document_id: int) -> Optional[Document]:
+    return db.query(Document).filter(Document.id == document_id).first()
+
+def get_document_by_content_hash(db: Session, content_hash: str) -> Optional[Document]:
+    """Busca un documento ya subido (y no fallido) con el mismo contenido."""
+    return (
+        db.query(Document)
+        .filter(Document.content_hash == content_hash, Document.status != 'failed')
+        .order_by(Document.id)
+        .first()
+    )
+
+def get_documents_by_content_hashes(db: Session, content_hashes: List[str]) -> Dict[str, Document]:
+    """Versión por lotes de `get_document_by_content_hash`: {hash: documento} en una sola consulta."""
+    if not content_hashes:
+        return {}
+    found = {}
+    for document in (
+        db.query(Document)
+        .filter(Document.content_hash.in_(set(content_hashes)), Document.status != 'failed')
+        .order_by(Document.id)
+    ):
+        found.setdefault(document.content_hash, document)
+    return found
+
+# Columnas del listado de documentos; las pesadas solo se leen si se piden (ver `get_documents`).
+DOCUMENT_LIST_COLUMNS = (
+    Document.id, Document.title, Document.filename, Document.source_url, Document.publisher,
+    Document.publication_year, Document.language, Document.preview_image_url, Document.status, Document.ingestion_stages,
+)
+DOCUMENT_HEAVY_COLUMNS = {"summary": Document.summary, "keywords": Document.keywords}
+
+def _document_filters(status: Optional[str] = None, publisher: Optional[str] = None, language: Optional[str] = None,
+                      year_from: Optional[int] = None, year_to: Optional[int] = None, keyword: Optional[str] = None,
+                      keywords: Optional[Sequence[str]] = None, document_ids: Optional[Sequence[int]] = None) -> list:
+    conditions = []
+    if document_ids is not None:
+        conditions.append(Document.id.in_(list(document_ids)))
+    if status is not None:
+        conditions.append(Document.status == status)
+    if publisher is not None:
+        conditions.append(Document.publisher == publisher)
+    if language is not None:
+        conditions.append(Document.language == language)
+    if year_from is not None:
+        conditions.append(Document.publication_year >= year_from)
+    if year_to is not None:
+        conditions.append(Document.publication_year <= year_to)
+    if keyword is not None:
+        # keywords @> ARRAY[...]: a diferencia de ANY(keywords), usa el índice GIN
+        conditions.append(Document.keywords.op("@>")(cast(array([keyword]), Document.keywords.type)))
+    if keywords:
+        # keywords && ARRAY[...]: documentos con al menos una de las palabras clave (también usa el índice GIN)
+        conditions.append(Document.keywords.op("&&")(cast(array(list(keywords)), Document.keywords.type)))
+    return conditions
+
+def get_documents(db: Session, limit: int = 100, before_id: Optional[int] = None, include: Sequence[str] = (), **filters) -> list:
+    """
+    Página de documentos, del más reciente al más antiguo, con paginación por cursor: `before_id`
+    es el ID del último documento de la página anterior, así cada página cuesta lo mismo por
+    profunda que sea. Solo se leen las columnas del listado más las de `include` ("summary", "keywords").
+    Filtros: status, publisher, language, year_from, year_to, keyword.
+    """
+    columns = list(DOCUMENT_LIST_COLUMNS) + [DOCUMENT_HEAVY_COLUMNS[field] for field in include]
+    query = db.query(*columns).filter(*_document_filters(**filters))
+    if before_id is not None:
+        query = query.filter(Document.id < before_id)
+    return query.order_by(Document.id.desc()).limit(limit).all()
+
+def get_document_ids(db: Session, limit: Optional[int] = None, **filters) -> List[int]:
+    """
+    IDs de los documentos que cumplen los filtros de `_document_filters` (sin leer ninguna otra
+    columna), hasta `limit`. Lo usa el filtrado de las consultas RAG (ver query_filters.py).
+    """
+    query = db.query(Document.id).filter(*_document_filters(**filters)).order_by(Document.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return [document_id for (document_id,) in query]
+
+def estimate_document_count(db: Session, **filters) -> int:
+    """
+    Número aproximado de documentos que cumplen los filtros. En PostgreSQL se toma la estimación
+    del planificador (EXPLAIN) en lugar de un COUNT(*), que recorrería todas las filas.
+    """
+    query = db.query(Document.id).filter(*_document_filters(**filters))
+    dialect = db.get_bind().dialect
+    if dialect.name != "postgresql":
+        return query.count()
+    compiled = query.statement.compile(dialect=dialect)
+    plan = db.connection().exec_driver_sql("EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
 
 def update_document_processing_results(db: Session, document_id: int, results: dict) -> Document:
     db_document = db.query(Document).filter(Document.id == document_id).first()
     if db_document:
         for key, value in results.items():
             setattr(db_document, key, value)
+        if "status" in results:
+            db_document.ingestion_stage = None
+            db_document.status_updated_at = _utcnow()
         db.commit()
         db.refresh(db_document)
-    return db_document
\ No newline at end of file
+    return db_document
+
+# --- Cola de trabajos de ingesta ---
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def create_document_with_ingestion_job(db: Session, document_data: dict, file_path: str, max_attempts: int = 3) -> Document:
+    """
+    Crea el documento y su trabajo de ingesta en una sola transacción, de modo que nunca
+    exista un documento en 'processing' sin un trabajo que lo vaya a procesar.
+    """
+    db_document = Document(**document_data, ingestion_stage='queued', status_updated_at=_utcnow())
+    db.add(db_document)
+    db.flush()  # Necesitamos el id del documento para el trabajo
+    db.add(IngestionJob(
+        document_id=db_document.id,
+        file_path=file_path,
+        user_metadata=document_data,
+        max_attempts=max_attempts,
+        next_run_at=_utcnow(),
+    ))
+    db.commit()
+    db.refresh(db_document)
+    return db_document
+
+def create_ingestion_batch(db: Session, documents: List[tuple], duplicates: List[dict], rejected: List[dict], max_attempts: int = 3):
+    """
+    Crea un lote de subida masiva: el lote, todos sus documentos (un único INSERT con RETURNING)
+    y sus trabajos de ingesta (otro INSERT), en una sola transacción.
+    `documents` es una lista de (metadatos del documento, ruta del PDF guardado).
+    Devuelve (lote, ids de los documentos en el mismo orden).
+    """
+    batch = IngestionBatch(total_documents=len(documents), duplicate_documents=duplicates, rejected_files=rejected)
+    db.add(batch)
+    db.flush()
+    document_ids = []
+    if documents:
+        document_ids = list(db.scalars(
+            insert(Document).returning(Document.id, sort_by_parameter_order=True),
+            [
+                {**document_data, "status": 'processing', "ingestion_stage": 'queued', "status_updated_at": _utcnow(), "batch_id": batch.id}
+                for document_data, _ in documents
+            ],
+        ))
+        now = _utcnow()
+        db.execute(insert(IngestionJob), [
+            {
+                "document_id": document_id,
+                "file_path": file_path,
+                "user_metadata": document_data,
+                "batch_id": batch.id,
+                "status": 'queued',
+                "attempts": 0,
+                "max_attempts": max_attempts,
+                "next_run_at": now,
+            }
+            for document_id, (document_data, file_path) in zip(document_ids, documents)
+        ])
+    db.commit()
+    db.refresh(batch)
+    return batch, document_ids
+
+def get_ingestion_batch(db: Session, batch_id: int) -> Optional[IngestionBatch]:
+    return db.query(IngestionBatch).filter(IngestionBatch.id == batch_id).first()
+
+def get_ingestion_batch_progress(db: Session, batch_id: int) -> Dict[str, int]:
+    """Número de documentos del lote por estado ('processing', 'completed', 'failed')."""
+    rows = db.query(Document.status, func.count(Document.id)).filter(Document.batch_id == batch_id).group_by(Document.status)
+    return {status: count for status, count in rows}
+
+def get_failed_batch_document_ids(db: Session, batch_id: int) -> List[int]:
+    rows = db.query(Document.id).filter(Document.batch_id == batch_id, Document.status == 'failed').order_by(Document.id)
+    return [r.id for r in rows]
+
+def requeue_document_ingestion(db: Session, document: Document, file_path: str, content_hash: str, max_attempts: int = 3) -> Document:
+    """Marca un documento existente para re-ingesta con un nuevo PDF y encola su trabajo en la misma transacción."""
+    document.status = 'processing'
+    document.ingestion_stage = 'queued'
+    document.status_updated_at = _utcnow()
+    document.content_hash = content_hash
+    db.add(IngestionJob(
+        document_id=document.id,
+        file_path=file_path,
+        user_metadata={
+            "filename": document.filename,
+            "title": document.title,
+            "source_url": document.source_url,
+            "publisher": document.publisher,
+            "publication_year": document.publication_year,
+            "language": document.language,
+        },
+        max_attempts=max_attempts,
+        next_run_at=_utcnow(),
+    ))
+    db.commit()
+    db.refresh(document)
+    return document
+
+def delete_document(db: Session, document_id: int):
+    """
+    Elimina un documento con sus trabajos de ingesta y sus chunks de todas las versiones del índice.
+    Los vectores se borran antes (ver `delete_document_vectors` en pipeline.py).
+    """
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id).delete(synchronize_session=False)
+    db.query(IngestionJob).filter(IngestionJob.document_id == document_id).delete(synchronize_session=False)
+    db.query(Document).filter(Document.id == document_id).delete(synchronize_session=False)
+    db.commit()
+
+def claim_next_ingestion_job(db: Session) -> Optional[IngestionJob]:
+    """
+    Toma el siguiente trabajo pendiente y lo marca como 'running'.
+    En PostgreSQL usa FOR UPDATE SKIP LOCKED para que varios workers no tomen el mismo trabajo.
+    """
+    jobs = claim_next_ingestion_jobs(db, batch_limit=1)
+    return jobs[0] if jobs else None
+
+def claim_next_ingestion_jobs(db: Session, batch_limit: int) -> List[IngestionJob]:
+    """
+    Como `claim_next_ingestion_job`, pero si el trabajo pertenece a un lote de subida masiva toma
+    además otros pendientes del mismo lote (hasta `batch_limit` en total), para que el worker
+    procese varios documentos del lote a la vez y sus embeddings y subidas se agrupen.
+    """
+    now = _utcnow()
+    job = (
+        db.query(IngestionJob)
+        .filter(IngestionJob.status == 'queued', IngestionJob.next_run_at <= now, IngestionJob.attempts < IngestionJob.max_attempts)
+        .order_by(IngestionJob.next_run_at, IngestionJob.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if job is None:
+        db.rollback()
+        return []
+    jobs = [job]
+    if job.batch_id is not None and batch_limit > 1:
+        jobs += (
+            db.query(IngestionJob)
+            .filter(
+                IngestionJob.batch_id == job.batch_id,
+                IngestionJob.id != job.id,
+                IngestionJob.status == 'queued',
+                IngestionJob.next_run_at <= now,
+                IngestionJob.attempts < IngestionJob.max_attempts,
+            )
+            .order_by(IngestionJob.next_run_at, IngestionJob.id)
+            .limit(batch_limit - 1)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+    for job in jobs:
+        job.status = 'running'
+        job.attempts += 1
+        job.heartbeat_at = now
+    db.commit()
+    for job in jobs:
+        db.refresh(job)
+    return jobs
+
+def touch_ingestion_job(db: Session, job_id: int):
+    """Renueva el heartbeat de un trabajo en curso."""
+    db.query(IngestionJob).filter(IngestionJob.id == job_id).update({"heartbeat_at": _utcnow()})
+    db.commit()
+
+def complete_ingestion_job(db: Session, job_id: int):
+    db.query(IngestionJob).filter(IngestionJob.id == job_id).update({"status": 'completed', "finished_at": _utcnow(), "last_error": None})
+    db.commit()
+
+def fail_ingestion_job(db: Session, job_id: int, error: str, retry_in_seconds: Optional[float] = None):
+    """
+    Marca el trabajo (y su documento, si sigue en 'processing') como fallido o, si se indica un
+    retraso, lo devuelve a la cola para reintentarlo.
+    """
+    if retry_in_seconds is None:
+        values = {"status": 'failed', "finished_at": _utcnow(), "last_error": error}
+        document_values = {"status": 'failed', "ingestion_stage": None, "status_updated_at": _utcnow()}
+    else:
+        values = {"status": 'queued', "next_run_at": _utcnow() + timedelta(seconds=retry_in_seconds), "last_error": error}
+        document_values = {"ingestion_stage": 'retrying', "status_updated_at": _utcnow()}
+    db.query(IngestionJob).filter(IngestionJob.id == job_id).update(values)
+    document_id = db.query(IngestionJob.document_id).filter(IngestionJob.id == job_id).scalar_subquery()
+    db.query(Document).filter(Document.id == document_id, Document.status == 'processing').update(document_values, synchronize_session=False)
+    db.commit()
+
+def recover_orphaned_ingestion_jobs(db: Session, lease_seconds: float) -> int:
+    """
+    Devuelve a la cola los trabajos 'running' cuyo worker dejó de dar señales (reinicio o caída),
+    y marca como 'failed' los documentos atascados en 'processing' que no tienen ningún trabajo pendiente.
+    Los trabajos huérfanos o en cola que ya agotaron sus intentos (p. ej. un PDF que tumba al
+    worker en cada intento) se marcan como fallidos en lugar de reencolarse.
+    """
+    cutoff = _utcnow() - timedelta(seconds=lease_seconds)
+    orphaned = (IngestionJob.status == 'running') & (IngestionJob.heartbeat_at < cutoff)
+    out_of_attempts = IngestionJob.attempts >= IngestionJob.max_attempts
+    exhausted = (
+        db.query(IngestionJob)
+        .filter(orphaned, out_of_attempts)
+        .update({"status": 'failed', "finished_at": _utcnow(), "last_error": "El worker dejó de responder en el último intento."}, synchronize_session=False)
+    )
+    exhausted += (
+        db.query(IngestionJob)
+        .filter(IngestionJob.status == 'queued', out_of_attempts)
+        .update({"status": 'failed', "finished_at": _utcnow()}, synchronize_session=False)
+    )
+    recovered = (
+        db.query(IngestionJob)
+        .filter(orphaned)
+        .update({"status": 'queued', "next_run_at": _utcnow()}, synchronize_session=False)
+    )
+    active_jobs = db.query(IngestionJob.document_id).filter(IngestionJob.status.in_(['queued', 'running']))
+    stranded = (
+        db.query(Document)
+        .filter(Document.status == 'processing', ~Document.id.in_(active_jobs))
+        .update({"status": 'failed', "ingestion_stage": None, "status_updated_at": _utcnow()}, synchronize_session=False)
+    )
+    db.commit()
+    return recovered + exhausted + stranded
+
+def count_completed_ingestion_jobs(db: Session) -> int:
+    """Marcador barato de la versión del corpus: crece cada vez que se completa una ingesta."""
+    return db.query(func.count(IngestionJob.id)).filter(IngestionJob.status == 'completed').scalar() or 0
+
+# --- Chunks indexados ---
+
+def get_documents_by_ids(db: Session, document_ids: List[int]) -> List[Document]:
+    if not document_ids:
+        return []
+    return db.query(Document).filter(Document.id.in_(document_ids)).all()
+
+def _chunk_version_filter(index_version_id: Optional[int]):
+    if index_version_id is None:
+        return DocumentChunk.index_version_id.is_(None)
+    return DocumentChunk.index_version_id == index_version_id
+
+def get_document_chunk_hashes(db: Session, document_id: int, index_version_id: Optional[int] = None) -> Dict[str, str]:
+    """
+    Devuelve {hash del chunk: id del vector} para los chunks ya indexados del documento en la
+    versión del índice indicada (None: el índice original).
+    Los chunks sin texto en la tabla (ingeridos con el texto en los metadatos del vector) no cuentan:
+    se vuelven a subir con los metadatos reducidos y su texto queda registrado.
+    """
+    rows = (
+        db.query(DocumentChunk.chunk_hash, DocumentChunk.vector_id)
+        .filter(
+            DocumentChunk.document_id == document_id,
+            _chunk_version_filter(index_version_id),
+            DocumentChunk.text.isnot(None),
+        )
+        .all()
+    )
+    return {row.chunk_hash: row.vector_id for row in rows}
+
+def get_document_chunks(db: Session, document_id: int, index_version_id: Optional[int] = None) -> List[DocumentChunk]:
+    """Chunks del documento en una versión del índice, en orden de aparición."""
+    return (
+        db.query(DocumentChunk)
+        .filter(DocumentChunk.document_id == document_id, _chunk_version_filter(index_version_id))
+        .order_by(DocumentChunk.chunk_index)
+        .all()
+    )
+
+def get_document_vector_ids(db: Session, document_id: int, index_version_id: Optional[int] = None) -> List[str]:
+    """IDs de los vectores del documento en una versión del índice, sin consultar el índice vectorial."""
+    rows = db.query(DocumentChunk.vector_id).filter(DocumentChunk.document_id == document_id, _chunk_version_filter(index_version_id))
+    return [vector_id for (vector_id,) in rows]
+
+def delete_document_chunks(db: Session, document_id: int, index_version_id: Optional[int] = None):
+    db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id, _chunk_version_filter(index_version_id)).delete(synchronize_session=False)
+    db.commit()
+
+def get_chunks_by_vector_ids(db: Session, vector_ids: List[str]) -> List[DocumentChunk]:
+    if not vector_ids:
+        return []
+    return db.query(DocumentChunk).filter(DocumentChunk.vector_id.in_(vector_ids)).all()
+
+def store_document_chunks(db: Session, document_id: int, chunk_rows: List[dict], index_version_id: Optional[int] = None):
+    """Inserta (o completa, si ya existían sin texto) los chunks recién indexados de un documento."""
+    if not chunk_rows:
+        return
+    existing = {c.vector_id: c for c in get_chunks_by_vector_ids(db, [r["vector_id"] for r in chunk_rows])}
+    new_rows = []
+    for row in chunk_rows:
+        current = existing.get(row["vector_id"])
+        if current is None:
+            new_rows.append({**row, "document_id": document_id, "index_version_id": index_version_id})
+        else:
+            for field, value in row.items():
+                setattr(current, field, value)
+    if new_rows:
+        db.bulk_insert_mappings(DocumentChunk, new_rows)
+    db.commit()
+
+def sync_document_chunks(db: Session, document_id: int, chunk_records: List[dict], index_version_id: Optional[int] = None) -> List[str]:
+    """
+    Deja la tabla de chunks del documento (en la versión del índice indicada) igual a `chunk_records`
+    (dicts con vector_id, chunk_index, chunk_hash y la ubicación en el PDF): inserta los que falten,
+    actualiza la posición de los conservados y borra los obsoletos. El texto lo registra
+    `store_document_chunks` al indexar.
+    Devuelve los ids de vector obsoletos, que deben eliminarse también del índice vectorial.
+    """
+    existing = {
+        c.vector_id: c
+        for c in db.query(DocumentChunk).filter(DocumentChunk.document_id == document_id, _chunk_version_filter(index_version_id))
+    }
+    wanted = {r["vector_id"] for r in chunk_records}
+    new_rows = []
+    for record in chunk_records:
+        current = existing.get(record["vector_id"])
+        if current is None:
+            new_rows.append({**record, "document_id": document_id, "index_version_id": index_version_id})
+            continue
+        for field, value in record.items():
+            if getattr(current, field) != value:
+                setattr(current, field, value)
+    stale_ids = [vector_id for vector_id in existing if vector_id not in wanted]
+    if new_rows:
+        db.bulk_insert_mappings(DocumentChunk, new_rows)
+    if stale_ids:
+        db.query(DocumentChunk).filter(DocumentChunk.vector_id.in_(stale_ids)).delete(synchronize_session=False)
+    db.commit()
+    return stale_ids
+
+# --- Versiones del índice ---
+
+LIVE_INDEX_STATUSES = ('queued', 'building', 'ready', 'active') # Versiones en las que escribe la ingesta
+
+def create_index_version(db: Session, chunk_size: int, chunk_overlap: int, embedding_model: str, activate_when_ready: bool = False) -> IndexVersion:
+    version = IndexVersion(chunk_size=chunk_size, chunk_overlap=chunk_overlap, embedding_model=embedding_model, activate_when_ready=activate_when_ready)
+    db.add(version)
+    db.flush()
+    version.namespace = f"v{version.id}"
+    db.commit()
+    db.refresh(version)
+    return version
+
+def get_index_version(db: Session, version_id: int) -> Optional[IndexVersion]:
+    return db.query(IndexVersion).filter(IndexVersion.id == version_id).first()
+
+def get_index_versions(db: Session) -> List[IndexVersion]:
+    return db.query(IndexVersion).order_by(IndexVersion.id.desc()).all()
+
+def get_live_index_versions(db: Session) -> List[IndexVersion]:
+    """La versión activa (si hay) y las que se están construyendo o esperan a activarse."""
+    return db.query(IndexVersion).filter(IndexVersion.status.in_(LIVE_INDEX_STATUSES)).order_by(IndexVersion.id).all()
+
+def get_active_index_version_id(db: Session) -> Optional[int]:
+    return db.query(IndexVersion.id).filter(IndexVersion.status == 'active').scalar()
+
+def claim_index_build(db: Session, lease_seconds: float) -> Optional[IndexVersion]:
+    """
+    Toma una versión pendiente de construir, o una en construcción cuyo worker dejó de dar señales
+    (se reanuda desde `last_document_id`), y la marca como 'building'.
+    """
+    now = _utcnow()
+    version = (
+        db.query(IndexVersion)
+        .filter(
+            (IndexVersion.status == 'queued')
+            | ((IndexVersion.status == 'building') & (IndexVersion.heartbeat_at < now - timedelta(seconds=lease_seconds)))
+        )
+        .order_by(IndexVersion.id)
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if version is None:
+        db.rollback()
+        return None
+    if version.status == 'queued':
+        version.started_at = now
+    version.status = 'building'
+    version.heartbeat_at = now
+    db.commit()
+    db.refresh(version)
+    return version
+
+def update_index_build_progress(db: Session, version_id: int, **progress):
+    """Guarda el avance de la construcción (documents_total, documents_done, documents_failed, last_document_id) y renueva el heartbeat."""
+    db.query(IndexVersion).filter(IndexVersion.id == version_id).update({**progress, "heartbeat_at": _utcnow()}, synchronize_session=False)
+    db.commit()
+
+def finish_index_build(db: Session, version_id: int, status: str, error: Optional[str] = None):
+    db.query(IndexVersion).filter(IndexVersion.id == version_id, IndexVersion.status == 'building').update(
+        {"status": status, "last_error": error, "finished_at": _utcnow()}, synchronize_session=False
+    )
+    db.commit()
+
+def activate_index_version(db: Session, version_id: int) -> bool:
+    """
+    Activa una versión 'ready' y retira la que estaba activa, en una sola transacción: las consultas
+    pasan de una a otra sin ver nunca un estado intermedio. Devuelve False si la versión no estaba lista.
+    """
+    version = db.query(IndexVersion).filter(IndexVersion.id == version_id).with_for_update().first()
+    if version is None or version.status != 'ready':
+        db.rollback()
+        return False
+    db.query(IndexVersion).filter(IndexVersion.status == 'active').update({"status": 'retired'}, synchronize_session=False)
+    version.status = 'active'
+    version.activated_at = _utcnow()
+    db.commit()
+    return True
+
+def delete_index_version(db: Session, version_id: int):
+    """Elimina una versión (no activa) y sus chunks."""
+    db.query(DocumentChunk).filter(DocumentChunk.index_version_id == version_id).delete(synchronize_session=False)
+    db.query(IndexVersion).filter(IndexVersion.id == version_id).delete(synchronize_session=False)
+    db.commit()
+
+def get_documents_to_reindex(db: Session, after_id: Optional[int] = None, limit: int = 100, updated_since: Optional[datetime] = None) -> list:
+    """
+    Documentos completados (id, año, idioma) en orden de ID a partir de `after_id`, para reconstruir
+    una versión del índice; con `updated_since`, solo los que cambiaron desde entonces.
+    """
+    query = db.query(Document.id, Document.publication_year, Document.language).filter(Document.status == 'completed')
+    if after_id is not None:
+        query = query.filter(Document.id > after_id)
+    if updated_since is not None:
+        query = query.filter(Document.status_updated_at >= updated_since)
+    return query.order_by(Document.id).limit(limit).all()
+
+def count_documents_to_reindex(db: Session) -> int:
+    return db.query(func.count(Document.id)).filter(Document.status == 'completed').scalar() or 0
@@ -0,0 +1,68 @@
+"""
+Preparación del esquema al arrancar la API o el worker.
+
+`create_all` crea las tablas que faltan, pero no toca las que ya existen: en una base creada con una
+versión anterior, "Repositori_Oficial" no tendría las columnas ni los índices que se le han ido
+añadiendo (content_hash, batch_id, ingestion_stage, status_updated_at, ingestion_stages y los índices
+del listado). `upgrade_schema` los añade de forma idempotente a partir del modelo, así que puede
+ejecutarse en cada arranque, y a la vez desde la API y el worker. Lo mismo con "document_chunks"
+(repeats). Solo se añaden columnas que admiten NULL: las filas existentes quedan sin valor, como los
+documentos subidos antes de cada cambio.
+
+También puede ejecutarse a mano antes de desplegar:
+
+    python -m app.db.migrations
+"""
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn, CreateIndex
+
+from app.db.base_class import Base
+# Todos los modelos, para que `create_all` los conozca aunque se ejecute este módulo solo
+from app.models import document_chunk, index_version, ingestion_batch, ingestion_job  # noqa: F401
+from app.models.document import Document
+
+# Tablas anteriores a alguna de sus columnas; el resto las crea `create_all` ya completas
+UPGRADED_TABLES = (Document.__table__, document_chunk.DocumentChunk.__table__)
+
+
+def _add_column_sql(column, dialect) -> str:
+    definition = str(CreateColumn(column).compile(dialect=dialect))
+    for foreign_key in column.foreign_keys:
+        target = foreign_key.column
+        definition += f" REFERENCES {dialect.identifier_preparer.format_table(target.table)} ({dialect.identifier_preparer.quote(target.name)})"
+    # PostgreSQL admite IF NOT EXISTS: evita el error si la API y el worker migran a la vez
+    if_not_exists = "IF NOT EXISTS " if dialect.name == "postgresql" else ""
+    return f"ALTER TABLE {dialect.identifier_preparer.format_table(column.table)} ADD COLUMN {if_not_exists}{definition}"
+
+
+def upgrade_schema(engine):
+    """Añade a las tablas existentes las columnas e índices del modelo que les falten."""
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in UPGRADED_TABLES:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    print(f"MIGRATIONS: La columna obligatoria {table.name}.{column.name} no existe y no se puede añadir automáticamente.")
+                    continue
+                connection.exec_driver_sql(_add_column_sql(column, engine.dialect))
+                print(f"MIGRATIONS: Columna {table.name}.{column.name} añadida.")
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+def init_db(engine):
+    """Crea las tablas que faltan y actualiza las existentes (ver `upgrade_schema`)."""
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+
+
+if __name__ == "__main__":
+    from app.db.session import engine
+
+    init_db(engine)
+    print("MIGRATIONS: Esquema actualizado.")
@@ -1,25 +1,52 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, BackgroundTasks, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from typing import Optional, List
+from contextlib import asynccontextmanager
+import asyncio
 from sqlalchemy.orm import Session
 
-from app.services.pipeline import process_pdf_pipeline
-from app.services.rag_service import perform_rag_query
-from app.schemas.document import DocumentResponse, LanguageEnum, DocumentStatusResponse, QueryRequest, QueryResponse
-from app.db.crud import create_document, update_document_processing_results, get_document_status, get_documents
+from app.core.config import settings
+from app.core.clients import warm_up, close_clients
+from app.services.rag_service import perform_rag_query, stream_rag_query, perform_rag_batch
+from app.services.metrics import render_metrics
+from app.services.batch_upload import BatchLimits, BatchUploadError, parse_manifest, manifest_metadata, expand_upload_all
+from app.services.uploads import SpooledUpload, UploadTooLargeError, spool_fileobj, remove_upload
+from app.services.status_cache import status_cache, sse_event
+from app.services.answer_cache import answer_cache
+from app.services.index_versions import activate_version, drop_version
+from app.schemas.document import (
+    DocumentResponse, LanguageEnum, DocumentStatusResponse, DocumentStatusesResponse, QueryRequest, QueryResponse,
+    BatchQueryRequest, BatchQueryResponse,
+    BatchUploadResponse, BatchStatusResponse, IndexVersionCreate, IndexVersionResponse,
+)
+from app.db.crud import (
+    create_document_with_ingestion_job, get_documents, estimate_document_count, DOCUMENT_HEAVY_COLUMNS, get_document, get_document_by_content_hash,
+    requeue_document_ingestion, get_documents_by_content_hashes, create_ingestion_batch, get_ingestion_batch,
+    get_ingestion_batch_progress, get_failed_batch_document_ids, delete_document, create_index_version, get_index_version,
+    get_index_versions,
+)
 from app.db.session import get_db, engine
 from app.models.document import Document
-from app.db.base_class import Base
+from app.db.migrations import init_db
 
 
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Las tablas y los clientes externos se preparan al arrancar el servidor, no al importar el módulo.
+    await run_in_threadpool(init_db, engine)
+    if settings.CLIENTS_WARM_UP:
+        await run_in_threadpool(warm_up)
+    yield
+    await close_clients()
 
 app = FastAPI(
     title="Sistema RAG de Vigilancia e Inteligencia",
     description="API para procesar documentos y alimentar la base de conocimiento.",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 # Montar directorio estático y configurar plantillas
@@ -31,9 +58,19 @@ async def read_root(request: Request):
     """Sirve la página principal de la interfaz de usuario."""
     return templates.TemplateResponse("index.html", {"request": request})
 
+async def _spool_upload(file: UploadFile) -> SpooledUpload:
+    """
+    Copia el archivo subido a UPLOAD_DIR por bloques, en un hilo para no bloquear el event loop;
+    el worker lo leerá desde ahí (y sobrevive a reinicios). Responde 413 si supera UPLOAD_MAX_BYTES.
+    """
+    try:
+        return await run_in_threadpool(spool_fileobj, file.file)
+    except UploadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
 @app.post("/upload-document/", response_model=DocumentResponse, status_code=202)
 async def upload_document(
-    background_tasks: BackgroundTasks,
+    response: Response,
     file: UploadFile = File(..., description="El archivo PDF a analizar."),
     title: Optional[str] = Form(None, description="Título del documento."),
     source_url: Optional[str] = Form(None, description="URL de origen del documento."),
@@ -45,7 +82,16 @@ async def upload_document(
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="El archivo debe ser un PDF.")
     
-    file_bytes = await file.read()
+    # 1. Guardar el PDF en disco (por bloques, calculando su hash)
+    spooled = await _spool_upload(file)
+    content_hash = spooled.content_hash
+
+    # Si el mismo PDF ya se subió (y no falló), devolvemos ese documento sin volver a procesarlo
+    existing_document = get_document_by_content_hash(db=db, content_hash=content_hash)
+    if existing_document is not None:
+        remove_upload(spooled.path)
+        response.status_code = 200
+        return existing_document
     
     metadata = {
         "filename": file.filename, 
@@ -53,30 +99,270 @@ async def upload_document(
         "source_url": source_url, 
         "publisher": publisher, 
         "publication_year": publication_year, 
-        "language": language.value # Usamos .value para obtener el string "es", "en", etc.
+        "language": language.value, # Usamos .value para obtener el string "es", "en", etc.
+        "content_hash": content_hash
     }
     
-    # 1. Crear la entrada inicial en la base de datos
-    db_document = create_document(db=db, document_data=metadata)
-    
-    # 2. Añadir la tarea de procesamiento pesado al fondo
-    background_tasks.add_task(process_pdf_pipeline, file_bytes=file_bytes, document_id=db_document.id, user_metadata=metadata)
+    # 2. Crear el documento y su trabajo de ingesta; los workers (`python -m app.worker`) lo procesarán
+    db_document = create_document_with_ingestion_job(
+        db=db, document_data=metadata, file_path=spooled.path, max_attempts=settings.INGESTION_MAX_ATTEMPTS
+    )
+    status_cache.mark_queued([db_document.id])
 
     # 3. Devolver la respuesta inmediatamente
     return db_document
 
+@app.post("/upload-documents/batch", response_model=BatchUploadResponse, status_code=202)
+async def upload_documents_batch(
+    files: List[UploadFile] = File(..., description="PDF y/o archivos ZIP con PDF."),
+    manifest: Optional[UploadFile] = File(None, description="Manifiesto CSV o JSON con los metadatos de cada archivo (columna/clave 'filename')."),
+    publisher: Optional[str] = Form(None, description="Entidad que publica, para los archivos que no la indiquen en el manifiesto."),
+    language: LanguageEnum = Form(LanguageEnum.spanish, description="Idioma, para los archivos que no lo indiquen en el manifiesto."),
+    db: Session = Depends(get_db)
+):
+    """
+    Sube muchos documentos de una vez. Todos los documentos y sus trabajos de ingesta se crean
+    en una sola transacción y los workers los procesan juntos, compartiendo los lotes de
+    embeddings y de subida al índice. El progreso se consulta en `/batches/{batch_id}`.
+    Los PDF ya subidos (mismo contenido) no se vuelven a procesar y se informan como duplicados.
+    """
+    try:
+        manifest_entries = parse_manifest(manifest.filename or "", await manifest.read()) if manifest is not None else {}
+    except BatchUploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    accepted = {} # content_hash -> (nombre, PDF guardado en disco)
+    rejected = []
+    limits = BatchLimits()
+    try:
+        for upload in files:
+            try:
+                spooled = await _spool_upload(upload)
+            except HTTPException as e:
+                rejected.append({"filename": upload.filename, "reason": e.detail})
+                continue
+            try:
+                expanded = await run_in_threadpool(expand_upload_all, upload.filename or "", spooled, limits)
+            except BatchUploadError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            for filename, pdf, reason in expanded:
+                if pdf is None:
+                    rejected.append({"filename": filename, "reason": reason})
+                elif pdf.content_hash in accepted:
+                    remove_upload(pdf.path)
+                    rejected.append({"filename": filename, "reason": f"Mismo contenido que '{accepted[pdf.content_hash][0]}' en este lote."})
+                else:
+                    accepted[pdf.content_hash] = (filename, pdf)
+
+        existing = get_documents_by_content_hashes(db, list(accepted))
+        duplicates = []
+        documents = []
+        for content_hash, (filename, pdf) in accepted.items():
+            if content_hash in existing:
+                remove_upload(pdf.path)
+                duplicates.append({"filename": filename, "document_id": existing[content_hash].id})
+                continue
+            metadata = {
+                "filename": filename,
+                "title": None,
+                "source_url": None,
+                "publisher": publisher,
+                "publication_year": None,
+                "language": language.value,
+                **manifest_metadata(manifest_entries, filename),
+                "content_hash": content_hash,
+            }
+            documents.append((metadata, pdf.path))
+
+        batch, document_ids = create_ingestion_batch(
+            db=db, documents=documents, duplicates=duplicates, rejected=rejected, max_attempts=settings.INGESTION_MAX_ATTEMPTS
+        )
+        status_cache.mark_queued(document_ids)
+    except BaseException:
+        # El lote no se creó: los PDF guardados no los procesará ningún trabajo
+        for _, pdf in accepted.values():
+            remove_upload(pdf.path)
+        raise
+    return {
+        "batch_id": batch.id,
+        "total_documents": len(document_ids),
+        "document_ids": document_ids,
+        "duplicates": duplicates,
+        "rejected": rejected,
+    }
+
+@app.get("/batches/{batch_id}", response_model=BatchStatusResponse)
+def read_batch_status(batch_id: int, db: Session = Depends(get_db)):
+    """Progreso agregado de un lote de subida masiva."""
+    batch = get_ingestion_batch(db=db, batch_id=batch_id)
+    if batch is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    counts = get_ingestion_batch_progress(db=db, batch_id=batch_id)
+    completed, failed = counts.get("completed", 0), counts.get("failed", 0)
+    processing = batch.total_documents - completed - failed
+    return {
+        "batch_id": batch.id,
+        "status": "processing" if processing > 0 else "completed",
+        "total_documents": batch.total_documents,
+        "processing": processing,
+        "completed": completed,
+        "failed": failed,
+        "progress": round((completed + failed) / batch.total_documents, 4) if batch.total_documents else 1.0,
+        "failed_document_ids": get_failed_batch_document_ids(db=db, batch_id=batch_id) if failed else [],
+        "duplicates": batch.duplicate_documents or [],
+        "rejected": batch.rejected_files or [],
+    }
+
+@app.post("/documents/{document_id}/reingest", response_model=DocumentResponse, status_code=202)
+async def reingest_document(
+    document_id: int,
+    response: Response,
+    file: UploadFile = File(..., description="La nueva versión del PDF."),
+    db: Session = Depends(get_db)
+):
+    """
+    Re-ingesta un documento existente con una versión revisada del PDF.
+    Solo se embeben y suben los chunks que cambiaron; los obsoletos se eliminan del índice.
+    """
+    if file.content_type != "application/pdf":
+        raise HTTPException(status_code=400, detail="El archivo debe ser un PDF.")
+    db_document = get_document(db=db, document_id=document_id)
+    if db_document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if db_document.status == 'processing':
+        raise HTTPException(status_code=409, detail="El documento se está procesando; inténtelo cuando termine.")
+
+    spooled = await _spool_upload(file)
+    if db_document.content_hash == spooled.content_hash and db_document.status != 'failed':
+        # Mismo contenido: no hay nada que re-ingestar
+        remove_upload(spooled.path)
+        response.status_code = 200
+        return db_document
+
+    db_document = requeue_document_ingestion(
+        db=db, document=db_document, file_path=spooled.path, content_hash=spooled.content_hash, max_attempts=settings.INGESTION_MAX_ATTEMPTS
+    )
+    status_cache.mark_queued([db_document.id])
+    return db_document
+
+@app.delete("/documents/{document_id}", status_code=204)
+def remove_document(document_id: int, db: Session = Depends(get_db)):
+    """
+    Elimina un documento: sus vectores y chunks de todas las versiones vivas del índice (por ID,
+    sin recorrer el índice), sus trabajos de ingesta y el propio documento.
+    """
+    # Import diferido: el pipeline carga PyMuPDF y el splitter, que la API no necesita para nada más.
+    from app.services.pipeline import delete_document_vectors
+
+    db_document = get_document(db=db, document_id=document_id)
+    if db_document is None:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if db_document.status == 'processing':
+        raise HTTPException(status_code=409, detail="El documento se está procesando; inténtelo cuando termine.")
+    delete_document_vectors(document_id)
+    delete_document(db=db, document_id=document_id)
+    status_cache.forget(document_id)
+    answer_cache.invalidate()
+    return Response(status_code=204)
+
+def _parse_document_ids(ids: Optional[str]) -> Optional[List[int]]:
+    """Convierte "1,2,3" en [1, 2, 3]; None si no se indicaron IDs."""
+    if not ids:
+        return None
+    try:
+        document_ids = [int(i) for i in ids.split(",") if i.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids debe ser una lista de enteros separados por comas.")
+    if len(document_ids) > settings.STATUS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"Se admiten como máximo {settings.STATUS_MAX_IDS} ids por petición.")
+    return document_ids
+
+@app.get("/documents/status", response_model=DocumentStatusesResponse)
+def read_document_statuses(ids: str = Query(..., description="IDs de documento separados por comas.")):
+    """Estado de varios documentos en una sola petición, servido desde la caché de estados."""
+    document_ids = _parse_document_ids(ids) or []
+    statuses = status_cache.get_many(document_ids)
+    return {
+        "documents": [statuses[i] for i in document_ids if i in statuses],
+        "missing": [i for i in document_ids if i not in statuses],
+    }
+
+@app.get("/documents/status/stream")
+async def stream_document_statuses(request: Request, ids: Optional[str] = Query(None, description="IDs a seguir, separados por comas; todos si se omite.")):
+    """
+    Server-Sent Events con los cambios de estado y de etapa de la ingesta (evento `status`).
+    Si se indican IDs, primero se envía su estado actual. Cada 15 s sin cambios se envía un
+    comentario para mantener viva la conexión.
+    """
+    document_ids = _parse_document_ids(ids)
+    queue = status_cache.subscribe(document_ids)  # Antes de leer el estado actual, para no perder cambios
+
+    async def events():
+        try:
+            if document_ids:
+                current = await run_in_threadpool(status_cache.get_many, document_ids)
+                for document_id in document_ids:
+                    if document_id in current:
+                        yield sse_event("status", current[document_id])
+            while not await request.is_disconnected():
+                try:
+                    entry = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event("status", entry)
+        finally:
+            status_cache.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/documents/{document_id}/status", response_model=DocumentStatusResponse)
-def read_document_status(document_id: int, db: Session = Depends(get_db)):
-    """Endpoint para hacer polling y obtener el estado de un documento."""
-    status = get_document_status(db=db, document_id=document_id)
+def read_document_status(document_id: int):
+    """Endpoint para hacer polling y obtener el estado de un documento (servido desde la caché de estados)."""
+    status = status_cache.get_many([document_id]).get(document_id)
     if status is None:
         raise HTTPException(status_code=404, detail="Document not found")
-    return {"status": status}
+    return status
 
-@app.get("/documents/", response_model=List[DocumentResponse])
-def read_documents(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    """Recupera una lista de todos los documentos procesados."""
-    documents = get_documents(db, skip=skip, limit=limit)
+@app.get("/documents/", response_model=List[DocumentResponse], response_model_exclude_unset=True)
+def read_documents(
+    response: Response,
+    limit: int = Query(100, ge=1, le=settings.DOCUMENTS_PAGE_MAX_LIMIT),
+    cursor: Optional[int] = Query(None, description="Cabecera X-Next-Cursor de la página anterior."),
+    include: Optional[str] = Query(None, description="Columnas pesadas a incluir, separadas por comas: summary, keywords."),
+    status: Optional[str] = None,
+    publisher: Optional[str] = None,
+    language: Optional[LanguageEnum] = None,
+    year_from: Optional[int] = None,
+    year_to: Optional[int] = None,
+    keyword: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Lista los documentos, del más reciente al más antiguo, por páginas de `limit`.
+    Si hay más páginas, la cabecera X-Next-Cursor trae el `cursor` de la siguiente. En la primera
+    página, X-Total-Estimate da el número (aproximado) de documentos que cumplen los filtros.
+    Summary y keywords solo se devuelven si se piden en `include`.
+    """
+    fields = [field.strip() for field in include.split(",") if field.strip()] if include else []
+    unknown = [field for field in fields if field not in DOCUMENT_HEAVY_COLUMNS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Columnas no admitidas en include: {', '.join(unknown)}")
+    filters = {
+        "status": status, "publisher": publisher, "language": language.value if language else None,
+        "year_from": year_from, "year_to": year_to, "keyword": keyword,
+    }
+    rows = get_documents(db, limit=limit + 1, before_id=cursor, include=fields, **filters)
+    documents = rows[:limit]
+    if len(rows) > limit:
+        response.headers["X-Next-Cursor"] = str(documents[-1].id)
+    if cursor is None:
+        total = len(documents) if len(rows) <= limit else max(estimate_document_count(db, **filters), len(rows))
+        response.headers["X-Total-Estimate"] = str(total)
     return documents
 
 @app.get("/library", response_class=HTMLResponse)
@@ -89,10 +375,102 @@ async def read_query_page(request: Request):
     """Sirve la página de consulta RAG."""
     return templates.TemplateResponse("query.html", {"request": request})
 
+def _query_options(query_request: QueryRequest) -> dict:
+    """Opciones de recuperación de la petición, como argumentos de `perform_rag_query`/`stream_rag_query`."""
+    return {
+        "retrieval_mode": query_request.retrieval_mode.value if query_request.retrieval_mode else None,
+        "quality_tier": query_request.quality_tier.value if query_request.quality_tier else None,
+        "latency_budget_ms": query_request.latency_budget_ms,
+        "include_timings": query_request.include_timings,
+        "filters": query_request.filters.model_dump(mode="json", exclude_none=True) if query_request.filters else None,
+    }
+
 @app.post("/query/", response_model=QueryResponse)
 def handle_query(query_request: QueryRequest):
     """Maneja una consulta RAG del usuario."""
     try:
-        return perform_rag_query(query=query_request.query)
+        return perform_rag_query(query=query_request.query, **_query_options(query_request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al procesar la consulta: {e}")
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+def handle_query_batch(batch_request: BatchQueryRequest):
+    """
+    Responde varias consultas en una petición (evaluaciones, informes), compartiendo las llamadas
+    de expansión, embeddings y búsqueda. Con `generate=false` solo devuelve las fuentes y el contexto.
+    """
+    if not batch_request.queries:
+        raise HTTPException(status_code=400, detail="Indique al menos una consulta.")
+    if len(batch_request.queries) > settings.RAG_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"Se admiten como máximo {settings.RAG_BATCH_MAX_QUERIES} consultas por petición.")
+    try:
+        results = perform_rag_batch(batch_request.queries, generate=batch_request.generate, **_query_options(batch_request))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al procesar la consulta: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error al procesar las consultas: {e}")
+    return {"results": results}
+
+@app.post("/query/stream")
+def handle_query_stream(query_request: QueryRequest):
+    """
+    Variante en streaming (Server-Sent Events) de `/query/`: envía las fuentes tras el re-ranking
+    y después la respuesta token a token a medida que el LLM la genera.
+    """
+    return StreamingResponse(
+        stream_rag_query(query=query_request.query, **_query_options(query_request)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- Versiones del índice (ver app/services/index_versions.py) ---
+
+@app.post("/index/versions", response_model=IndexVersionResponse, status_code=202)
+def create_index_version_endpoint(version_request: IndexVersionCreate, db: Session = Depends(get_db)):
+    """
+    Encola la construcción de una versión nueva del índice con otro chunking y/o modelo de embeddings.
+    Un worker la construye en segundo plano mientras las consultas siguen usando la versión activa;
+    con `activate_when_ready` se activa al terminar, si no, con POST /index/versions/{id}/activate.
+    """
+    chunk_size = version_request.chunk_size or settings.CHUNK_SIZE
+    chunk_overlap = version_request.chunk_overlap if version_request.chunk_overlap is not None else settings.CHUNK_OVERLAP
+    if chunk_size <= 0 or chunk_overlap < 0 or chunk_overlap >= chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_size debe ser positivo y chunk_overlap, menor que chunk_size.")
+    return create_index_version(
+        db=db,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        embedding_model=version_request.embedding_model or settings.EMBEDDING_MODEL,
+        activate_when_ready=version_request.activate_when_ready,
+    )
+
+@app.get("/index/versions", response_model=List[IndexVersionResponse])
+def read_index_versions(db: Session = Depends(get_db)):
+    return get_index_versions(db=db)
+
+@app.post("/index/versions/{version_id}/activate", response_model=IndexVersionResponse)
+def activate_index_version_endpoint(version_id: int, db: Session = Depends(get_db)):
+    """Pasa las consultas a una versión ya construida ('ready'); la activa hasta ahora queda retirada."""
+    if get_index_version(db=db, version_id=version_id) is None:
+        raise HTTPException(status_code=404, detail="Index version not found")
+    if not activate_version(version_id):
+        raise HTTPException(status_code=409, detail="Solo se puede activar una versión construida ('ready').")
+    db.expire_all()
+    return get_index_version(db=db, version_id=version_id)
+
+@app.delete("/index/versions/{version_id}", status_code=204)
+def delete_index_version_endpoint(version_id: int, db: Session = Depends(get_db)):
+    """Elimina una versión que no está activa ni en construcción, con su namespace, su índice BM25 y sus chunks."""
+    if get_index_version(db=db, version_id=version_id) is None:
+        raise HTTPException(status_code=404, detail="Index version not found")
+    if not drop_version(version_id):
+        raise HTTPException(status_code=409, detail="No se puede eliminar la versión activa ni una en construcción.")
+    return Response(status_code=204)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Métricas en formato Prometheus (duración por etapa de consultas e ingesta, tokens, cachés)."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
\ No newline at end of file
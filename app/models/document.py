@@ -1,8 +1,16 @@
-from sqlalchemy import Column, Integer, String, Text, ARRAY
+from sqlalchemy import Column, Integer, String, Text, ARRAY, ForeignKey, DateTime, Index, JSON
 from app.db.base_class import Base
 
 class Document(Base):
     __tablename__ = "Repositori_Oficial"
+    __table_args__ = (
+        # Filtros del listado de /documents/, que pagina por id descendente
+        Index("ix_repositori_oficial_status_id", "status", "id"),
+        Index("ix_repositori_oficial_publisher_id", "publisher", "id"),
+        Index("ix_repositori_oficial_year_id", "publication_year", "id"),
+        Index("ix_repositori_oficial_language_id", "language", "id"),
+        Index("ix_repositori_oficial_keywords", "keywords", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True, nullable=True)
@@ -14,4 +22,9 @@ class Document(Base):
     summary = Column(Text, nullable=True)
     keywords = Column(ARRAY(String), nullable=True) # Cambiado a ARRAY(String) para coincidir con el schema
     preview_image_url = Column(Text, nullable=True)
-    status = Column(String(50), default='processing', nullable=False)
\ No newline at end of file
+    status = Column(String(50), default='processing', nullable=False)
+    content_hash = Column(String(64), index=True, nullable=True) # sha256 del PDF, para detectar subidas duplicadas
+    batch_id = Column(Integer, ForeignKey("ingestion_batches.id"), index=True, nullable=True) # Lote de subida masiva, si lo hubo
+    ingestion_stage = Column(String(30), nullable=True) # Etapa en curso mientras status es 'processing' (queued, open, preview, index...)
+    status_updated_at = Column(DateTime(timezone=True), index=True, nullable=True) # Último cambio de status o etapa (ver status_cache.py)
+    ingestion_stages = Column(JSON, nullable=True) # Resultado de cada etapa de la última ingesta: {"preview": "completed", "summary": "failed", ...}
\ No newline at end of file
@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, JSON
+from app.db.base_class import Base
+
+class DocumentChunk(Base):
+    """
+    Chunk indexado de un documento. Guarda el texto y su ubicación en el PDF: el índice vectorial
+    solo almacena el ID y los campos filtrables, y el texto se recupera de aquí al responder.
+    También permite re-ingestas incrementales comparando hashes de contenido.
+    """
+    __tablename__ = "document_chunks"
+
+    vector_id = Column(String(100), primary_key=True) # ID del vector: doc_{document_id}_chunk_{hash[:16]} (doc_{document_id}_v{versión}_chunk_... en las versiones)
+    document_id = Column(Integer, ForeignKey("Repositori_Oficial.id"), nullable=False, index=True)
+    index_version_id = Column(Integer, ForeignKey("index_versions.id"), nullable=True, index=True) # NULL: índice original ("default")
+    chunk_index = Column(Integer, nullable=False)
+    chunk_hash = Column(String(64), nullable=False) # sha256 del texto del chunk
+    text = Column(Text, nullable=True) # NULL en chunks ingeridos cuando el texto vivía en los metadatos del vector
+    page_start = Column(Integer, nullable=True) # Páginas (desde 1) donde empieza y termina el chunk
+    page_end = Column(Integer, nullable=True)
+    char_start = Column(Integer, nullable=True) # Posición del chunk en el texto completo del documento
+    char_end = Column(Integer, nullable=True)
+    # Otras apariciones del mismo texto en el documento, que comparten vector:
+    # [[chunk_index, char_start, char_end, page_start, page_end], ...]; NULL si aparece una sola vez
+    repeats = Column(JSON, nullable=True)
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+class IndexVersion(Base):
+    """
+    Versión del índice de búsqueda: parámetros de chunking y modelo de embeddings, con su propio
+    namespace en el índice vectorial y su propio índice BM25. Se construye en segundo plano a partir
+    de los chunks guardados (ver app/services/index_builder.py) y, una vez lista, se activa sin
+    interrumpir las consultas. Sin ninguna versión activa se usa el índice original ("default").
+    """
+    __tablename__ = "index_versions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    namespace = Column(String(100), nullable=True, unique=True) # v{id}; se asigna al crearla
+    chunk_size = Column(Integer, nullable=False)
+    chunk_overlap = Column(Integer, nullable=False)
+    embedding_model = Column(String(100), nullable=False)
+    status = Column(String(20), default='queued', nullable=False, index=True) # queued | building | ready | active | retired | failed
+    activate_when_ready = Column(Boolean, default=False, nullable=False)
+    documents_total = Column(Integer, default=0, nullable=False)
+    documents_done = Column(Integer, default=0, nullable=False)
+    documents_failed = Column(Integer, default=0, nullable=False)
+    last_document_id = Column(Integer, nullable=True) # Cursor: una reconstrucción interrumpida se reanuda desde aquí
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True) # Lo renueva el worker que la construye
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    activated_at = Column(DateTime(timezone=True), nullable=True)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, DateTime, JSON
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+class IngestionBatch(Base):
+    """Lote de documentos subidos juntos (`/upload-documents/batch`); su progreso se calcula a partir de sus documentos."""
+    __tablename__ = "ingestion_batches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    total_documents = Column(Integer, nullable=False) # Documentos nuevos creados por el lote
+    duplicate_documents = Column(JSON, nullable=False, default=list) # [{filename, document_id}] ya existentes
+    rejected_files = Column(JSON, nullable=False, default=list) # [{filename, reason}] no aceptados
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
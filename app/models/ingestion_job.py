@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, JSON, ForeignKey
+from sqlalchemy.sql import func
+from app.db.base_class import Base
+
+class IngestionJob(Base):
+    """Trabajo de ingesta persistente: sobrevive a reinicios y lo consumen los workers (`python -m app.worker`)."""
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    document_id = Column(Integer, ForeignKey("Repositori_Oficial.id"), nullable=False, index=True)
+    file_path = Column(Text, nullable=False) # PDF guardado en disco hasta que el trabajo termina
+    user_metadata = Column(JSON, nullable=False)
+    batch_id = Column(Integer, ForeignKey("ingestion_batches.id"), nullable=True, index=True) # Los workers procesan juntos los trabajos de un mismo lote
+    status = Column(String(20), default='queued', nullable=False, index=True) # queued | running | completed | failed
+    attempts = Column(Integer, default=0, nullable=False)
+    max_attempts = Column(Integer, default=3, nullable=False)
+    next_run_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True) # Lo renueva el worker mientras procesa
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
+from datetime import datetime
 from enum import Enum
 
 class LanguageEnum(str, Enum):
@@ -30,6 +31,7 @@ class DocumentResponse(DocumentBase):
     keywords: Optional[List[str]] = None
     preview_image_url: Optional[str] = None
     status: str
+    ingestion_stages: Optional[Dict[str, str]] = None # Estado de cada etapa de la última ingesta
 
     class Config:
         from_attributes = True
@@ -37,10 +39,70 @@ class DocumentResponse(DocumentBase):
 # Schema para la respuesta del endpoint de status
 class DocumentStatusResponse(BaseModel):
     status: str
+    stage: Optional[str] = None # Etapa de la ingesta mientras status es 'processing'
+    updated_at: Optional[str] = None
+
+class DocumentStatusItem(DocumentStatusResponse):
+    id: int
+
+class DocumentStatusesResponse(BaseModel):
+    documents: List[DocumentStatusItem]
+    missing: List[int] # IDs solicitados que no existen
+
+# --- Schemas para la subida masiva ---
+class BatchDuplicate(BaseModel):
+    filename: str
+    document_id: int # Documento ya existente con el mismo contenido
+
+class BatchRejectedFile(BaseModel):
+    filename: str
+    reason: str
+
+class BatchUploadResponse(BaseModel):
+    batch_id: int
+    total_documents: int # Documentos nuevos que se van a ingerir
+    document_ids: List[int]
+    duplicates: List[BatchDuplicate]
+    rejected: List[BatchRejectedFile]
+
+class BatchStatusResponse(BaseModel):
+    batch_id: int
+    status: str # 'processing' mientras quede algún documento pendiente; después 'completed'
+    total_documents: int
+    processing: int
+    completed: int
+    failed: int
+    progress: float # Fracción de documentos terminados (completados o fallidos), de 0 a 1
+    failed_document_ids: List[int]
+    duplicates: List[BatchDuplicate]
+    rejected: List[BatchRejectedFile]
 
 # --- Schemas para la consulta RAG ---
+class RetrievalModeEnum(str, Enum):
+    dense = "dense"              # Expansión con LLM + búsqueda vectorial
+    hybrid = "hybrid"            # Expansión con LLM + vectorial + BM25 (RRF)
+    hybrid_fast = "hybrid_fast"  # Vectorial + BM25 sin expansión (una llamada al LLM menos)
+
+class QualityTierEnum(str, Enum):
+    fast = "fast"          # Sin expansión, top_k reducido, re-ranking solo si hace falta
+    balanced = "balanced"  # Expansión solo si la primera búsqueda no es concluyente
+    deep = "deep"          # Pipeline completo (investigación)
+
+class QueryFilters(BaseModel):
+    document_ids: Optional[List[int]] = None
+    publisher: Optional[str] = None
+    year_from: Optional[int] = None # Año de publicación, inclusive
+    year_to: Optional[int] = None
+    language: Optional[LanguageEnum] = None
+    keywords: Optional[List[str]] = None # Documentos con al menos una de las palabras clave
+
 class QueryRequest(BaseModel):
     query: str
+    retrieval_mode: Optional[RetrievalModeEnum] = None # Si no se indica, se usa RAG_RETRIEVAL_MODE
+    quality_tier: Optional[QualityTierEnum] = None # Si no se indica, se deduce del presupuesto o de RAG_QUALITY_TIER
+    latency_budget_ms: Optional[int] = None # Presupuesto de latencia; las etapas opcionales que no caben se omiten
+    include_timings: bool = False # Devuelve la duración (ms) de cada etapa en `timings`
+    filters: Optional[QueryFilters] = None # Restringe la búsqueda a los documentos que cumplen los filtros
 
 class Source(BaseModel):
     id: int
@@ -49,6 +111,63 @@ class Source(BaseModel):
     publication_year: Optional[str]
     source_url: Optional[str]
 
+class QueryPipelineInfo(BaseModel):
+    quality_tier: str
+    latency_budget_ms: Optional[int] = None
+    elapsed_ms: float
+    decisions: Dict[str, str] # Etapa -> decisión tomada (p. ej. "expansion": "omitida (...)")
+    context_tokens: Optional[int] = None # Tokens del contexto enviado al LLM (None si la respuesta vino de la caché)
+
 class QueryResponse(BaseModel):
     answer: str
-    sources: List[Source]
\ No newline at end of file
+    sources: List[Source]
+    pipeline: Optional[QueryPipelineInfo] = None
+    timings: Optional[Dict[str, float]] = None
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    retrieval_mode: Optional[RetrievalModeEnum] = None
+    quality_tier: Optional[QualityTierEnum] = None
+    latency_budget_ms: Optional[int] = None
+    include_timings: bool = False
+    filters: Optional[QueryFilters] = None # Se aplican a todas las consultas
+    generate: bool = True # False: solo recuperación (fuentes y contexto), sin llamar al LLM
+
+class BatchQueryResult(BaseModel):
+    query: str
+    answer: Optional[str] = None # None si generate=False o si la consulta falló
+    sources: List[Source] = []
+    context: Optional[str] = None # Solo con generate=False
+    pipeline: Optional[QueryPipelineInfo] = None
+    timings: Optional[Dict[str, float]] = None
+    error: Optional[str] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchQueryResult] # En el mismo orden que `queries`
+
+# --- Schemas para las versiones del índice ---
+class IndexVersionCreate(BaseModel):
+    chunk_size: Optional[int] = None # Si no se indica, CHUNK_SIZE
+    chunk_overlap: Optional[int] = None # Si no se indica, CHUNK_OVERLAP
+    embedding_model: Optional[str] = None # Si no se indica, EMBEDDING_MODEL
+    activate_when_ready: bool = False # Activarla en cuanto termine de construirse
+
+class IndexVersionResponse(BaseModel):
+    id: int
+    namespace: str
+    chunk_size: int
+    chunk_overlap: int
+    embedding_model: str
+    status: str # queued | building | ready | active | retired | failed
+    activate_when_ready: bool
+    documents_total: Optional[int] = None
+    documents_done: int
+    documents_failed: int
+    last_error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    activated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
\ No newline at end of file
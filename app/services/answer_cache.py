@@ -0,0 +1,139 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.crud import count_completed_ingestion_jobs, get_active_index_version_id
+from app.services.embedding_cache import normalize_text
+
+
+class AnswerCache:
+    """
+    Caché de respuestas RAG para `/query/`.
+    - Coincidencia exacta por consulta normalizada (minúsculas, espacios colapsados).
+    - Opcionalmente, coincidencia semántica: si el embedding de la consulta tiene una similitud
+      coseno mayor o igual al umbral con el de una consulta ya respondida, se reutiliza su respuesta.
+    Cada respuesta se guarda en un ámbito (`scope`: nivel de calidad, modo de recuperación y filtros)
+    y solo se reutiliza en ese mismo ámbito.
+    Las entradas caducan por TTL y se desalojan por LRU. Cada ingesta completada (o el cambio de la
+    versión activa del índice) incrementa la versión del corpus, lo que invalida todas las respuestas anteriores.
+    Como las ingestas se ejecutan en procesos worker, además de `invalidate()` local se consulta
+    periódicamente un marcador del corpus (`marker_source`) y se invalida cuando cambia.
+    """
+
+    def __init__(self, max_items: int, ttl_seconds: float, similarity_threshold: float, marker_source=None, marker_check_seconds: float = 5.0):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.marker_source = marker_source
+        self.marker_check_seconds = marker_check_seconds
+        self._marker = None
+        self._marker_checked_at = 0.0
+        self._entries = OrderedDict()  # (scope, consulta normalizada) -> (creado_en, respuesta, embedding normalizado o None)
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(query: str, scope: str = "") -> tuple:
+        return scope, normalize_text(query).lower()
+
+    def _purge_expired(self, now: float):
+        expired = [k for k, (created, _, _) in self._entries.items() if now - created > self.ttl_seconds]
+        for k in expired:
+            del self._entries[k]
+
+    def _check_corpus_marker(self):
+        """Invalida la caché si otro proceso completó una ingesta desde la última comprobación."""
+        now = time.time()
+        if self.marker_source is None or now - self._marker_checked_at < self.marker_check_seconds:
+            return
+        self._marker_checked_at = now
+        try:
+            marker = self.marker_source()
+        except Exception as e:
+            print(f"ANSWER CACHE: No se pudo leer el marcador del corpus: {e}")
+            return
+        if self._marker is not None and marker != self._marker:
+            self.invalidate()
+        self._marker = marker
+
+    def get(self, query: str, query_embedding: Optional[List[float]] = None, scope: str = "") -> Optional[dict]:
+        """Busca una respuesta exacta y, si se pasa el embedding, una semánticamente equivalente."""
+        self._check_corpus_marker()
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            key = self._key(query, scope)
+            entry = self._entries.get(key)
+            if entry is None and query_embedding is not None:
+                key = self._most_similar(query_embedding, scope)
+                entry = self._entries.get(key) if key is not None else None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def _most_similar(self, query_embedding: List[float], scope: str = "") -> Optional[tuple]:
+        candidates = [(k, emb) for k, (_, _, emb) in self._entries.items() if emb is not None and k[0] == scope]
+        if not candidates:
+            return None
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_vec /= (np.linalg.norm(query_vec) or 1.0)
+        similarities = np.vstack([emb for _, emb in candidates]) @ query_vec
+        best = int(np.argmax(similarities))
+        if similarities[best] >= self.similarity_threshold:
+            return candidates[best][0]
+        return None
+
+    def put(self, query: str, response: dict, query_embedding: Optional[List[float]] = None, version: Optional[int] = None, scope: str = ""):
+        """
+        Guarda una respuesta. Si se indica la versión del corpus con la que se calculó y desde
+        entonces se ha ingerido un documento nuevo, la respuesta se descarta por obsoleta.
+        """
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.asarray(query_embedding, dtype=np.float32)
+            embedding /= (np.linalg.norm(embedding) or 1.0)
+        with self._lock:
+            if version is not None and version != self.version:
+                return
+            key = self._key(query, scope)
+            self._entries[key] = (time.time(), copy.deepcopy(response), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        """Descarta todas las respuestas; se llama cuando el corpus cambia."""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "items": len(self._entries), "version": self.version}
+
+
+def _corpus_marker():
+    db = SessionLocal()
+    try:
+        return count_completed_ingestion_jobs(db), get_active_index_version_id(db)
+    finally:
+        db.close()
+
+
+answer_cache = AnswerCache(
+    max_items=settings.ANSWER_CACHE_MAX_ITEMS,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+    marker_source=_corpus_marker,
+    marker_check_seconds=settings.ANSWER_CACHE_VERSION_CHECK_SECONDS,
+)
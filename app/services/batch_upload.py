@@ -0,0 +1,190 @@
+"""
+Lectura de las subidas masivas (`/upload-documents/batch`): PDF sueltos y/o archivos ZIP con PDF,
+más un manifiesto opcional (CSV o JSON) con los metadatos de cada archivo.
+Los archivos se guardan en disco por bloques (ver app/services/uploads.py), también los extraídos de un ZIP.
+
+El manifiesto identifica cada PDF por su nombre de archivo (columna/clave `filename`, sin ruta)
+y admite los mismos campos que `/upload-document/`: title, source_url, publisher,
+publication_year y language. Ejemplo CSV:
+
+    filename,title,publisher,publication_year,language
+    informe_2023.pdf,Informe anual 2023,Ministerio X,2023,es
+
+En JSON, una lista de objetos con esas claves o un objeto {filename: {campos}}.
+"""
+import csv
+import io
+import json
+import os
+import zipfile
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.schemas.document import LanguageEnum
+from app.services.uploads import SpooledUpload, UploadTooLargeError, is_pdf, remove_upload, spool_fileobj
+
+MANIFEST_FIELDS = ("title", "source_url", "publisher", "publication_year", "language")
+_LANGUAGES = {language.value for language in LanguageEnum}
+
+
+class BatchUploadError(ValueError):
+    """Error del lote completo (manifiesto ilegible, demasiados archivos...)."""
+
+
+class BatchLimits:
+    """
+    Cuenta los PDF y los bytes (sin comprimir) de todo el lote a medida que se leen sus archivos,
+    para rechazarlo en cuanto supere BATCH_UPLOAD_MAX_FILES o BATCH_UPLOAD_MAX_TOTAL_BYTES, sin
+    terminar de extraer los ZIP.
+    """
+
+    def __init__(self, max_files: int = None, max_total_bytes: int = None):
+        self.max_files = settings.BATCH_UPLOAD_MAX_FILES if max_files is None else max_files
+        self.max_total_bytes = settings.BATCH_UPLOAD_MAX_TOTAL_BYTES if max_total_bytes is None else max_total_bytes
+        self.files = 0
+        self.total_bytes = 0
+
+    @property
+    def remaining_bytes(self) -> int:
+        return self.max_total_bytes - self.total_bytes
+
+    def add(self, size: int, files: int = 1):
+        self.files += files
+        self.total_bytes += size
+        if self.files > self.max_files:
+            raise BatchUploadError(f"El lote supera el máximo de {self.max_files} PDF.")
+        if self.total_bytes > self.max_total_bytes:
+            raise BatchUploadError(f"El lote supera el tamaño total máximo de {self.max_total_bytes / (1024 * 1024):g} MB.")
+
+
+def _manifest_key(filename: str) -> str:
+    return os.path.basename(filename.replace("\\", "/")).strip().lower()
+
+
+def _clean_entry(filename: str, entry: dict) -> dict:
+    metadata = {}
+    for field in MANIFEST_FIELDS:
+        value = entry.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ""):
+            continue
+        if field == "publication_year":
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise BatchUploadError(f"Manifiesto: publication_year inválido para '{filename}': {value!r}")
+        if field == "language" and value not in _LANGUAGES:
+            raise BatchUploadError(f"Manifiesto: idioma no soportado para '{filename}': {value!r}")
+        metadata[field] = value
+    return metadata
+
+
+def parse_manifest(filename: str, content: bytes) -> Dict[str, dict]:
+    """Devuelve {nombre de archivo normalizado: metadatos} a partir de un manifiesto CSV o JSON."""
+    try:
+        text = content.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise BatchUploadError("El manifiesto debe estar codificado en UTF-8.")
+
+    if filename.lower().endswith(".json"):
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise BatchUploadError(f"Manifiesto JSON inválido: {e}")
+        if isinstance(data, dict):
+            entries = [{**(value or {}), "filename": key} for key, value in data.items()]
+        elif isinstance(data, list):
+            entries = data
+        else:
+            raise BatchUploadError("El manifiesto JSON debe ser una lista de objetos o un objeto {filename: metadatos}.")
+    else:
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames or "filename" not in [f.strip() for f in reader.fieldnames]:
+            raise BatchUploadError("El manifiesto CSV debe tener una columna 'filename'.")
+        entries = [{(k or "").strip(): v for k, v in row.items()} for row in reader]
+
+    manifest = {}
+    for entry in entries:
+        if not isinstance(entry, dict) or not entry.get("filename"):
+            raise BatchUploadError("Cada entrada del manifiesto debe indicar 'filename'.")
+        manifest[_manifest_key(entry["filename"])] = _clean_entry(entry["filename"], entry)
+    return manifest
+
+
+def manifest_metadata(manifest: Dict[str, dict], filename: str) -> dict:
+    """Metadatos del manifiesto para un archivo (vacío si no figura)."""
+    return manifest.get(_manifest_key(filename), {})
+
+
+def expand_upload(filename: str, spooled: SpooledUpload, limits: BatchLimits) -> Iterator[Tuple[str, Optional[SpooledUpload], Optional[str]]]:
+    """
+    Emite los PDF de un archivo ya guardado en disco: el propio archivo si es un PDF o cada
+    archivo que contiene si es un ZIP (extraídos también por bloques, sin directorios ni metadatos
+    de macOS). Cada elemento es (nombre, PDF guardado, None) o (nombre, None, motivo del rechazo).
+    El ZIP y los archivos rechazados se borran del disco. Cada archivo se suma a `limits` antes de
+    extraerlo; si el lote los supera se lanza BatchUploadError.
+    """
+    if is_pdf(spooled.head):
+        try:
+            limits.add(spooled.size)
+        except BatchUploadError:
+            remove_upload(spooled.path)
+            raise
+        yield filename, spooled, None
+        return
+    try:
+        if not zipfile.is_zipfile(spooled.path):
+            yield filename, None, "El archivo no es un PDF ni un ZIP con PDF."
+            return
+        with zipfile.ZipFile(spooled.path) as archive:
+            for member in archive.infolist():
+                name = member.filename
+                if member.is_dir() or os.path.basename(name).startswith(".") or "__MACOSX/" in name:
+                    continue
+                name = os.path.basename(name)
+                if member.file_size > settings.UPLOAD_MAX_BYTES:
+                    yield name, None, "El archivo supera el tamaño máximo permitido."
+                    continue
+                counted = name.lower().endswith(".pdf")
+                limits.add(member.file_size, files=int(counted))
+                # file_size viene de la cabecera del ZIP y podría no ser fiable: los límites se aplican también al extraer
+                max_bytes = min(settings.UPLOAD_MAX_BYTES, limits.remaining_bytes + member.file_size)
+                try:
+                    with archive.open(member) as source:
+                        extracted = spool_fileobj(source, max_bytes=max_bytes)
+                except UploadTooLargeError:
+                    if max_bytes < settings.UPLOAD_MAX_BYTES:
+                        # Lo que no cabe es el total del lote, no el archivo
+                        limits.add(max_bytes + 1 - member.file_size, files=0)
+                    yield name, None, "El archivo supera el tamaño máximo permitido."
+                    continue
+                if not is_pdf(extracted.head):
+                    remove_upload(extracted.path)
+                    limits.add(extracted.size - member.file_size, files=0)
+                    yield name, None, "El archivo no es un PDF ni un ZIP con PDF."
+                    continue
+                try:
+                    limits.add(extracted.size - member.file_size, files=int(not counted))
+                except BatchUploadError:
+                    remove_upload(extracted.path)
+                    raise
+                yield name, extracted, None
+    except zipfile.BadZipFile as e:
+        yield filename, None, f"ZIP dañado: {e}"
+    finally:
+        remove_upload(spooled.path)
+
+
+def expand_upload_all(filename: str, spooled: SpooledUpload, limits: BatchLimits) -> List[Tuple[str, Optional[SpooledUpload], Optional[str]]]:
+    """Como `expand_upload`, en una lista; si el lote supera `limits` borra los PDF ya extraídos."""
+    expanded = []
+    try:
+        for item in expand_upload(filename, spooled, limits):
+            expanded.append(item)
+    except BatchUploadError:
+        for _, pdf, _ in expanded:
+            if pdf is not None:
+                remove_upload(pdf.path)
+        raise
+    return expanded
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Sequence
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.crud import get_chunks_by_vector_ids, get_documents_by_ids
+from app.services.metrics import record_cache
+
+
+class ChunkStore:
+    """
+    Recupera el texto y la ubicación de los chunks a partir de sus IDs de vector, con una sola
+    consulta a la tabla de chunks por llamada y un LRU en memoria delante.
+    Los IDs dependen del contenido, así que el texto de un ID nunca cambia y el LRU no necesita invalidación.
+    """
+
+    def __init__(self, max_items: int):
+        self.max_items = max_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, vector_ids: Sequence[str]) -> Dict[str, dict]:
+        """Devuelve {vector_id: chunk} para los IDs que tienen texto en la tabla de chunks."""
+        found = {}
+        with self._lock:
+            missing = []
+            for vector_id in dict.fromkeys(vector_ids):
+                if vector_id in self._memory:
+                    self._memory.move_to_end(vector_id)
+                    found[vector_id] = self._memory[vector_id]
+                else:
+                    missing.append(vector_id)
+            self.hits += len(found)
+            self.misses += len(missing)
+        record_cache("chunk_store", hits=len(found), misses=len(missing))
+        if not missing:
+            return found
+
+        db = SessionLocal()
+        try:
+            rows = get_chunks_by_vector_ids(db, missing)
+        finally:
+            db.close()
+        loaded = {
+            row.vector_id: {
+                "document_id": row.document_id,
+                "chunk_index": row.chunk_index,
+                "text": row.text,
+                "page_start": row.page_start,
+                "page_end": row.page_end,
+                "char_start": row.char_start,
+                "char_end": row.char_end,
+            }
+            for row in rows
+            if row.text is not None
+        }
+        with self._lock:
+            for vector_id, chunk in loaded.items():
+                self._memory[vector_id] = chunk
+                self._memory.move_to_end(vector_id)
+            while len(self._memory) > self.max_items:
+                self._memory.popitem(last=False)
+        found.update(loaded)
+        return found
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "memory_items": len(self._memory)}
+
+
+def get_document_citations(document_ids: Sequence[int]) -> Dict[int, dict]:
+    """Datos de cita (título, editor, año, URL) de los documentos, en una sola consulta."""
+    db = SessionLocal()
+    try:
+        documents = get_documents_by_ids(db, list(set(document_ids)))
+    finally:
+        db.close()
+    return {
+        d.id: {"title": d.title, "publisher": d.publisher, "publication_year": d.publication_year, "source_url": d.source_url}
+        for d in documents
+    }
+
+
+chunk_store = ChunkStore(max_items=settings.CHUNK_STORE_CACHE_ITEMS)
@@ -0,0 +1,93 @@
+"""
+Construcción del contexto del prompt a partir de los chunks seleccionados (ver `_retrieve_context`
+en rag_service.py).
+
+Los chunks se parten con solapamiento (CHUNK_OVERLAP, o el de la versión del índice), así que dos chunks
+consecutivos de un mismo documento repiten texto. Aquí los chunks de cada documento que se
+solapan o son contiguos se fusionan en un único pasaje usando su posición en el texto del
+documento (char_start/char_end); los pasajes idénticos (cabeceras, avisos legales repetidos en
+varios documentos) se incluyen una sola vez. Los pasajes se ordenan por la relevancia de su mejor
+chunk y se añaden hasta agotar el presupuesto de tokens.
+"""
+import hashlib
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from app.services.tokenizer import count_tokens, truncate_to_tokens
+from app.services.vector_store import VectorMatch
+
+PASSAGE_SEPARATOR = "\n\n"
+
+
+class Passage(NamedTuple):
+    document_id: Optional[int]
+    text: str
+    rank: int # Posición del chunk más relevante del pasaje (0 = el más relevante)
+    chunks: int # Chunks fusionados en el pasaje
+
+
+class PackedContext(NamedTuple):
+    text: str
+    passages: List[Passage] # Pasajes incluidos, por relevancia
+    tokens: int
+    chunks: int # Chunks seleccionados que llegaron al contexto
+    truncated: bool # Algún pasaje se recortó o se descartó por el presupuesto
+
+
+def _merge_document_chunks(document_id, chunks: List[Tuple[int, dict]]) -> List[Passage]:
+    """Fusiona los chunks (posición, metadatos) de un documento que se solapan o son contiguos."""
+    located = sorted((c for c in chunks if c[1].get("char_start") is not None and c[1].get("char_end") is not None), key=lambda c: c[1]["char_start"])
+    passages = [Passage(document_id, metadata.get("text", ""), rank, 1) for rank, metadata in chunks if metadata.get("char_start") is None or metadata.get("char_end") is None]
+
+    text, end, rank, count = None, None, None, 0
+    for chunk_rank, metadata in located:
+        chunk_start, chunk_end, chunk_text = metadata["char_start"], metadata["char_end"], metadata.get("text", "")
+        if text is not None and chunk_start <= end:
+            if chunk_end > end:
+                text += chunk_text[end - chunk_start:] # Solo la parte que no estaba ya en el pasaje
+                end = chunk_end
+            rank, count = min(rank, chunk_rank), count + 1
+            continue
+        if text is not None:
+            passages.append(Passage(document_id, text, rank, count))
+        text, end, rank, count = chunk_text, chunk_end, chunk_rank, 1
+    if text is not None:
+        passages.append(Passage(document_id, text, rank, count))
+    return passages
+
+
+def pack_context(matches: Sequence[VectorMatch], max_tokens: int, min_passage_tokens: int = 50) -> PackedContext:
+    """
+    Construye el contexto con los chunks de `matches`, ordenados de más a menos relevante, sin
+    superar `max_tokens`. Un pasaje que no cabe entero se recorta si quedan al menos
+    `min_passage_tokens` tokens; si no, se prueba con los siguientes (más cortos).
+    """
+    by_document = {}
+    for rank, match in enumerate(matches):
+        by_document.setdefault(match.metadata.get("document_id"), []).append((rank, match.metadata))
+    passages = sorted(
+        (passage for document_id, chunks in by_document.items() for passage in _merge_document_chunks(document_id, chunks)),
+        key=lambda passage: passage.rank,
+    )
+
+    separator_tokens = count_tokens(PASSAGE_SEPARATOR)
+    included, seen, tokens, chunks, truncated = [], set(), 0, 0, False
+    for passage in passages:
+        text = passage.text.strip()
+        fingerprint = hashlib.sha256(" ".join(text.split()).encode("utf-8")).digest()
+        if not text or fingerprint in seen:
+            continue
+        seen.add(fingerprint)
+        remaining = max_tokens - tokens - (separator_tokens if included else 0)
+        passage_tokens = count_tokens(text)
+        if passage_tokens > remaining:
+            truncated = True
+            if remaining < min_passage_tokens:
+                continue
+            text = truncate_to_tokens(text, remaining)
+            passage_tokens = count_tokens(text)
+            if passage_tokens > remaining: # Al recodificar el texto recortado puede sumar algún token
+                continue
+        included.append(passage._replace(text=text))
+        tokens += passage_tokens + (separator_tokens if len(included) > 1 else 0)
+        chunks += passage.chunks
+    return PackedContext(PASSAGE_SEPARATOR.join(p.text for p in included), included, tokens, chunks, truncated)
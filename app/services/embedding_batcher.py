@@ -0,0 +1,137 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Sequence
+
+from app.core.config import settings
+from app.services.tokenizer import count_tokens
+from app.services.metrics import record_usage
+from app.services.retry import is_transient_error
+
+
+class RateLimiter:
+    """
+    Limitador de peticiones y tokens por minuto (dos "token buckets" que se rellenan de forma continua).
+    Se comparte entre todos los batchers del proceso para respetar el presupuesto global de la cuenta.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+        self._updated = now
+
+    def acquire(self, tokens: int):
+        """Bloquea hasta que haya presupuesto para una petición de `tokens` tokens."""
+        # Una petición mayor que el presupuesto por minuto nunca cabría: se limita al máximo.
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                wait = max(
+                    (1 - self._requests) * 60 / self.rpm if self._requests < 1 else 0,
+                    (tokens - self._tokens) * 60 / self.tpm if self._tokens < tokens else 0,
+                )
+            time.sleep(min(max(wait, 0.01), 5.0))
+
+
+_shared_rate_limiter = RateLimiter(settings.EMBEDDING_RPM_LIMIT, settings.EMBEDDING_TPM_LIMIT)
+
+
+def _retry_after_seconds(error: Exception):
+    """Lee la cabecera Retry-After de la respuesta de OpenAI, si existe."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingBatcher:
+    """
+    Agrupa textos en peticiones de embeddings acotadas por tokens y por número de entradas,
+    las envía en paralelo respetando un presupuesto de peticiones/tokens por minuto, reintenta
+    los 429 y 5xx con backoff exponencial con jitter y devuelve los embeddings en el orden de entrada.
+    """
+
+    def __init__(
+        self,
+        client,
+        model: str = "text-embedding-3-small",
+        max_batch_tokens: int = None,
+        max_batch_inputs: int = None,
+        concurrency: int = None,
+        max_retries: int = None,
+        rate_limiter: RateLimiter = None,
+    ):
+        self.client = client
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens or settings.EMBEDDING_REQUEST_MAX_TOKENS
+        self.max_batch_inputs = max_batch_inputs or settings.EMBEDDING_REQUEST_MAX_INPUTS
+        self.concurrency = concurrency or settings.EMBEDDING_CONCURRENCY
+        self.max_retries = settings.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.rate_limiter = rate_limiter or _shared_rate_limiter
+
+    def _pack(self, texts: Sequence[str]):
+        """Devuelve una lista de lotes (índice inicial, textos, tokens) que respetan los límites."""
+        batches = []
+        start, current, current_tokens = 0, [], 0
+        for i, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens or len(current) >= self.max_batch_inputs):
+                batches.append((start, current, current_tokens))
+                start, current, current_tokens = i, [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append((start, current, current_tokens))
+        return batches
+
+    def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(tokens)
+            try:
+                response = self.client.embeddings.create(input=texts, model=self.model)
+                record_usage(self.model, getattr(response, "usage", None))
+                return [item.embedding for item in response.data]
+            except Exception as e:
+                if attempt == self.max_retries or not is_transient_error(e):
+                    raise
+                delay = _retry_after_seconds(e)
+                if delay is None:
+                    # "Full jitter": espera aleatoria hasta el tope exponencial.
+                    delay = random.uniform(0, min(60.0, settings.EMBEDDING_RETRY_BASE_SECONDS * 2 ** attempt))
+                print(f"EMBEDDINGS: Lote de {len(texts)} textos falló ({e.__class__.__name__}), reintento {attempt + 1}/{self.max_retries} en {delay:.1f}s.")
+                time.sleep(delay)
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = self._pack(texts)
+        results: List[List[float]] = [None] * len(texts)
+        if len(batches) == 1:
+            start, batch, tokens = batches[0]
+            results[start:start + len(batch)] = self._embed_batch(batch, tokens)
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches)), thread_name_prefix="embeddings") as executor:
+            futures = [(start, len(batch), executor.submit(self._embed_batch, batch, tokens)) for start, batch, tokens in batches]
+            for start, size, future in futures:
+                results[start:start + size] = future.result()
+        return results
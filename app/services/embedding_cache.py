@@ -0,0 +1,217 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+from app.core.config import settings
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.metrics import record_cache
+
+
+def normalize_text(text: str) -> str:
+    """Normaliza el texto para que variaciones triviales (espacios, Unicode) compartan entrada de caché."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def _cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings direccionada por contenido: la clave es (modelo, hash del texto normalizado).
+    Tiene dos niveles:
+      - Un LRU en memoria del proceso (acotado por número de entradas).
+      - Un nivel persistente en SQLite, compartido entre procesos, con los vectores en float32
+        y desalojo por tamaño (se eliminan primero las entradas usadas hace más tiempo).
+    El tamaño total del nivel persistente se lleva en la tabla `stats`, actualizado en la misma
+    transacción que cada inserción y desalojo. La fecha de último uso de las entradas leídas se
+    acumula en memoria y se escribe con el siguiente put, o como mucho cada `touch_flush_seconds`.
+    """
+
+    def __init__(self, path: str, memory_items: int, max_bytes: int, touch_flush_seconds: float = 60.0):
+        self.path = path
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.touch_flush_seconds = touch_flush_seconds
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._touched = {} # clave -> último uso aún no escrito en SQLite
+        self._touch_flushed_at = time.time()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " model TEXT NOT NULL,"
+                " vector BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_embeddings_last_used ON embeddings (last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            # Cachés creadas antes del contador: se calcula una vez a partir de las filas
+            conn.execute("INSERT OR IGNORE INTO stats (key, value) SELECT 'total_bytes', COALESCE(SUM(size), 0) FROM embeddings")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Devuelve el embedding cacheado para cada texto, o None si no está en caché."""
+        keys = [_cache_key(model, t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            now = time.time()
+            for i, key in enumerate(keys):
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    results[i] = self._memory[key]
+                    self._touched[key] = now
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                conn = self._get_conn()
+                found = {}
+                key_list = list(missing)
+                # SQLite limita el número de parámetros por sentencia, consultamos por bloques.
+                for start in range(0, len(key_list), 500):
+                    block = key_list[start:start + 500]
+                    placeholders = ",".join("?" * len(block))
+                    rows = conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", block
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array("f")
+                        vector.frombytes(blob)
+                        found[key] = vector.tolist()
+                for key, vector in found.items():
+                    self._remember(key, vector)
+                    self._touched[key] = now
+                    for i in missing[key]:
+                        results[i] = vector
+            if self._touched and now - self._touch_flushed_at >= self.touch_flush_seconds:
+                conn = self._get_conn()
+                self._flush_touches(conn)
+                conn.commit()
+
+            hits = sum(1 for r in results if r is not None)
+            self.hits += hits
+            self.misses += len(texts) - hits
+        record_cache("embedding", hits=hits, misses=len(texts) - hits)
+        return results
+
+    def put_many(self, model: str, texts: Sequence[str], embeddings: Sequence[List[float]]):
+        """Guarda los embeddings en ambos niveles y aplica el desalojo por tamaño."""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, embedding in zip(texts, embeddings):
+                key = _cache_key(model, text)
+                self._remember(key, list(embedding))
+                blob = array("f", embedding).tobytes()
+                rows.append((key, model, blob, len(blob), now))
+            if not rows:
+                return
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE") # El contador de bytes se actualiza a la vez que las filas
+            try:
+                rows = list({row[0]: row for row in rows}.values())
+                replaced = 0
+                for start in range(0, len(rows), 500):
+                    block = [row[0] for row in rows[start:start + 500]]
+                    placeholders = ",".join("?" * len(block))
+                    replaced += conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({placeholders})", block).fetchone()[0]
+                conn.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_used) VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute("UPDATE stats SET value = value + ? WHERE key = 'total_bytes'", (sum(row[3] for row in rows) - replaced,))
+                self._flush_touches(conn)
+                self._evict(conn)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _flush_touches(self, conn: sqlite3.Connection):
+        """Escribe las fechas de último uso acumuladas (en la transacción en curso)."""
+        if self._touched:
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(used, key) for key, used in self._touched.items()])
+            self._touched = {}
+        self._touch_flushed_at = time.time()
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT value FROM stats WHERE key = 'total_bytes'").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Liberamos hasta el 90% del límite para no desalojar en cada escritura.
+        to_free = total - int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC"):
+            victims.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        conn.execute("UPDATE stats SET value = value - ? WHERE key = 'total_bytes'", (freed,))
+        for (key,) in victims:
+            self._memory.pop(key, None)
+        print(f"EMBEDDING CACHE: Desalojadas {len(victims)} entradas ({freed} bytes).")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "memory_items": len(self._memory)}
+
+
+embedding_cache = EmbeddingCache(
+    path=settings.EMBEDDING_CACHE_PATH,
+    memory_items=settings.EMBEDDING_CACHE_MEMORY_ITEMS,
+    max_bytes=settings.EMBEDDING_CACHE_MAX_BYTES,
+    touch_flush_seconds=settings.EMBEDDING_CACHE_TOUCH_FLUSH_SECONDS,
+)
+
+
+def embed_texts(client, texts: Sequence[str], model: str = "text-embedding-3-small") -> List[List[float]]:
+    """
+    Genera embeddings para `texts` usando la caché: solo se envían a OpenAI los textos
+    que no están cacheados (y cada texto distinto una sola vez), a través del `EmbeddingBatcher`
+    (lotes por tokens, concurrencia, límites por minuto y reintentos). Conserva el orden de entrada.
+    """
+    if not texts:
+        return []
+    results = embedding_cache.get_many(model, texts)
+
+    pending = {}
+    for i, vector in enumerate(results):
+        if vector is None:
+            pending.setdefault(_cache_key(model, texts[i]), []).append(i)
+
+    if pending:
+        to_embed = [texts[indices[0]] for indices in pending.values()]
+        new_embeddings = EmbeddingBatcher(client, model=model).embed(to_embed)
+        embedding_cache.put_many(model, to_embed, new_embeddings)
+        for indices, embedding in zip(pending.values(), new_embeddings):
+            for i in indices:
+                results[i] = embedding
+
+    print(f"EMBEDDING CACHE: {len(texts) - len(pending)} reutilizados, {len(pending)} nuevos. Totales: {embedding_cache.stats()}")
+    return results
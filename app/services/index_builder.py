@@ -0,0 +1,164 @@
+"""
+Construcción en segundo plano de las versiones del índice (ver index_versions.py).
+
+Un worker toma una versión pendiente con `claim_index_build` y la construye documento a documento a
+partir de los chunks guardados de la versión activa (`reindex_document` en pipeline.py: los PDF se
+borran al terminar la ingesta), como mucho a INDEX_REBUILD_DOCUMENTS_PER_MINUTE documentos por minuto.
+El avance se guarda tras cada documento: si el worker cae, otro retoma la versión desde el último
+documento en cuanto caduca su heartbeat.
+Mientras se construye, la ingesta ya escribe también en la versión nueva. Al terminar se repasan los
+documentos completados desde poco antes del inicio (los que ingirió un proceso que aún no veía la
+versión) y la versión queda 'ready', o se activa si se pidió `activate_when_ready`.
+"""
+import threading
+import time
+from datetime import timedelta
+from typing import Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.crud import (
+    claim_index_build,
+    count_documents_to_reindex,
+    finish_index_build,
+    get_documents_to_reindex,
+    get_index_version,
+    update_index_build_progress,
+)
+from app.services.index_versions import activate_version, active_index, index_registry, index_spec
+
+PAGE_SIZE = 100
+
+
+def _heartbeat(version_id: int, done: threading.Event):
+    """Renueva el heartbeat de la construcción aunque un documento tarde más que el lease."""
+    interval = max(1.0, settings.INGESTION_LEASE_SECONDS / 4)
+    while not done.wait(interval):
+        db = SessionLocal()
+        try:
+            update_index_build_progress(db, version_id)
+        except Exception as e:
+            print(f"INDEX BUILD: No se pudo renovar el heartbeat de la versión {version_id}: {e}")
+        finally:
+            db.close()
+
+
+def build_index_version(version_id: int, stop: threading.Event) -> Optional[str]:
+    """
+    Construye la versión `version_id` (ya marcada como 'building'). Devuelve su estado final
+    ('ready', 'active' o 'failed'), o None si se detuvo antes de terminar (se reanudará).
+    """
+    # Import diferido: el pipeline inicializa los clientes externos.
+    from app.services.pipeline import reindex_document
+
+    done = threading.Event()
+    threading.Thread(target=_heartbeat, args=(version_id, done), daemon=True).start()
+    db = SessionLocal()
+    try:
+        version = get_index_version(db, version_id)
+        target = index_spec(version)
+        index_registry.refresh(force=True)
+        source = active_index()
+        interval = 60.0 / max(1, settings.INDEX_REBUILD_DOCUMENTS_PER_MINUTE)
+        documents_done, documents_failed = version.documents_done, version.documents_failed
+        print(f"INDEX BUILD: Construyendo '{target.namespace}' (chunk_size={target.chunk_size}, chunk_overlap={target.chunk_overlap}, {target.embedding_model}) desde '{source.namespace}'.")
+
+        def reindex(documents, counted: bool = True):
+            # Devuelve cada documento tras procesarlo, para guardar el avance. El repaso final
+            # (counted=False) no cuenta como documentos nuevos los que ya estaban hechos.
+            nonlocal documents_done, documents_failed
+            for document in documents:
+                if stop.is_set():
+                    return
+                started = time.monotonic()
+                try:
+                    reindex_document(document, source, target)
+                    documents_done += int(counted)
+                except Exception as e:
+                    documents_failed += 1
+                    print(f"INDEX BUILD: Error al reconstruir el documento {document.id} en '{target.namespace}': {e}")
+                yield document
+                stop.wait(max(0.0, interval - (time.monotonic() - started)))
+
+        # Pasada principal, por ID y reanudable desde last_document_id
+        update_index_build_progress(db, version_id, documents_total=count_documents_to_reindex(db))
+        cursor = version.last_document_id
+        while True:
+            documents = get_documents_to_reindex(db, after_id=cursor, limit=PAGE_SIZE)
+            if not documents:
+                break
+            for document in reindex(documents):
+                cursor = document.id
+                update_index_build_progress(db, version_id, documents_done=documents_done, documents_failed=documents_failed, last_document_id=cursor)
+            if stop.is_set():
+                return None
+
+        # Repaso: documentos ingeridos mientras algún proceso aún no veía la versión
+        since = version.started_at - timedelta(seconds=settings.INDEX_VERSION_CHECK_SECONDS)
+        cursor = None
+        while True:
+            documents = get_documents_to_reindex(db, after_id=cursor, limit=PAGE_SIZE, updated_since=since)
+            if not documents:
+                break
+            for document in reindex(documents, counted=False):
+                cursor = document.id
+            if stop.is_set():
+                return None
+        update_index_build_progress(db, version_id, documents_done=documents_done, documents_failed=documents_failed)
+
+        if documents_failed:
+            # La versión queda disponible, pero no se activa sola si le faltan documentos
+            finish_index_build(db, version_id, 'ready', error=f"{documents_failed} documentos no se pudieron reconstruir.")
+            print(f"INDEX BUILD: '{target.namespace}' lista con {documents_failed} documentos fallidos; no se activa automáticamente.")
+            return 'ready'
+        finish_index_build(db, version_id, 'ready')
+        if version.activate_when_ready and activate_version(version_id):
+            print(f"INDEX BUILD: '{target.namespace}' construida y activada ({documents_done} documentos).")
+            return 'active'
+        print(f"INDEX BUILD: '{target.namespace}' lista ({documents_done} documentos).")
+        return 'ready'
+    except Exception as e:
+        print(f"INDEX BUILD: La construcción de la versión {version_id} falló: {e}")
+        db.rollback()
+        finish_index_build(db, version_id, 'failed', error=str(e))
+        return 'failed'
+    finally:
+        done.set()
+        db.close()
+
+
+class IndexBuildRunner:
+    """
+    Construye desde un proceso worker, en un hilo aparte, como mucho una versión a la vez
+    (ver `run_worker_loop` en app/worker.py): `poll()` busca una versión pendiente cada `check_seconds`.
+    """
+
+    def __init__(self, stop: threading.Event, check_seconds: float, lease_seconds: float):
+        self.stop = stop
+        self.check_seconds = check_seconds
+        self.lease_seconds = lease_seconds
+        self._thread: Optional[threading.Thread] = None
+        self._checked_at = 0.0
+
+    def poll(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = time.monotonic()
+        db = SessionLocal()
+        try:
+            version = claim_index_build(db, self.lease_seconds)
+        except Exception as e:
+            print(f"INDEX BUILD: Error al consultar las versiones pendientes: {e}")
+            return
+        finally:
+            db.close()
+        if version is not None:
+            self._thread = threading.Thread(target=build_index_version, args=(version.id, self.stop), name=f"index-build-{version.id}")
+            self._thread.start()
+
+    def join(self):
+        """Espera a que la construcción en curso se detenga (guarda su avance antes de salir)."""
+        if self._thread is not None:
+            self._thread.join()
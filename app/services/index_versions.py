@@ -0,0 +1,157 @@
+"""
+Versiones del índice de búsqueda (ver el modelo `IndexVersion`).
+
+Cada versión fija el chunking y el modelo de embeddings y tiene su propio namespace en el índice
+vectorial, su propio índice BM25 y sus propias filas en la tabla de chunks (`index_version_id`),
+así que se puede construir una versión nueva mientras las consultas siguen usando la activa:
+  - Las consultas usan la versión activa (`active_index()`); sin ninguna, el índice original
+    (namespace "default", parámetros CHUNK_SIZE / CHUNK_OVERLAP / EMBEDDING_MODEL).
+  - La ingesta escribe en todas las versiones vivas (`live_indexes()`): la activa y las que se
+    están construyendo o esperan a activarse, para que ninguna se quede sin los documentos nuevos.
+Activar una versión es un único UPDATE en la base de datos; cada proceso lo ve en menos de
+INDEX_VERSION_CHECK_SECONDS (el que la activa, al instante).
+"""
+import os
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.core.clients import vector_store
+from app.db.crud import activate_index_version, delete_index_version, get_index_version, get_live_index_versions
+from app.services.answer_cache import answer_cache
+from app.services.lexical_index import BM25Index, lexical_index
+
+
+class IndexSpec(NamedTuple):
+    version_id: Optional[int] # None: índice original
+    namespace: str
+    chunk_size: int
+    chunk_overlap: int
+    embedding_model: str
+
+    def vector_id(self, document_id: int, chunk_hash: str) -> str:
+        # El ID depende del contenido: un chunk sin cambios conserva su vector entre re-ingestas.
+        # Empieza siempre por doc_{id}_, el prefijo con el que se listan los vectores de un documento.
+        if self.version_id is None:
+            return f"doc_{document_id}_chunk_{chunk_hash[:16]}"
+        return f"doc_{document_id}_v{self.version_id}_chunk_{chunk_hash[:16]}"
+
+
+DEFAULT_INDEX = IndexSpec(None, "default", settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, settings.EMBEDDING_MODEL)
+
+
+def index_spec(version) -> IndexSpec:
+    """`IndexSpec` de una fila de `IndexVersion`."""
+    return IndexSpec(version.id, version.namespace, version.chunk_size, version.chunk_overlap, version.embedding_model)
+
+
+class IndexRegistry:
+    """Versión activa y versiones vivas, releídas de la base de datos cada `check_seconds`."""
+
+    def __init__(self, check_seconds: float):
+        self.check_seconds = check_seconds
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._active = DEFAULT_INDEX
+        self._live = [DEFAULT_INDEX]
+        self._lexical: Dict[int, BM25Index] = {}
+
+    def refresh(self, force: bool = False):
+        if not force and time.monotonic() - self._checked_at < self.check_seconds:
+            return
+        self._checked_at = time.monotonic()
+        db = SessionLocal()
+        try:
+            versions = get_live_index_versions(db)
+        except Exception as e:
+            # Sin base de datos se sigue con lo último leído
+            print(f"INDEX VERSIONS: No se pudieron leer las versiones del índice: {e}")
+            return
+        finally:
+            db.close()
+        active = next((index_spec(v) for v in versions if v.status == 'active'), DEFAULT_INDEX)
+        live = [active] + [index_spec(v) for v in versions if v.status != 'active']
+        with self._lock:
+            self._active, self._live = active, live
+
+    def active(self) -> IndexSpec:
+        self.refresh()
+        return self._active
+
+    def live(self) -> List[IndexSpec]:
+        self.refresh()
+        return list(self._live)
+
+    def lexical(self, spec: IndexSpec) -> BM25Index:
+        """Índice BM25 de la versión: el original en LEXICAL_INDEX_PATH, las versiones junto a él con sufijo .v{id}."""
+        if spec.version_id is None:
+            return lexical_index
+        with self._lock:
+            index = self._lexical.get(spec.version_id)
+            if index is None:
+                root, extension = os.path.splitext(settings.LEXICAL_INDEX_PATH)
+                index = self._lexical[spec.version_id] = BM25Index(
+                    path=f"{root}.v{spec.version_id}{extension}", k1=settings.BM25_K1, b=settings.BM25_B
+                )
+            return index
+
+    def forget(self, version_id: int):
+        """Olvida el índice BM25 de una versión eliminada."""
+        with self._lock:
+            self._lexical.pop(version_id, None)
+
+
+index_registry = IndexRegistry(check_seconds=settings.INDEX_VERSION_CHECK_SECONDS)
+
+
+def active_index() -> IndexSpec:
+    """Versión que usan las consultas."""
+    return index_registry.active()
+
+
+def live_indexes() -> List[IndexSpec]:
+    """Versiones en las que escribe la ingesta (la activa primero)."""
+    return index_registry.live()
+
+
+def lexical_index_for(spec: IndexSpec) -> BM25Index:
+    return index_registry.lexical(spec)
+
+
+def activate_version(version_id: int) -> bool:
+    """
+    Activa una versión 'ready' (ver `activate_index_version`). Este proceso pasa a usarla al
+    instante; el resto, en su siguiente comprobación. Devuelve False si la versión no estaba lista.
+    """
+    db = SessionLocal()
+    try:
+        activated = activate_index_version(db, version_id)
+    finally:
+        db.close()
+    if activated:
+        index_registry.refresh(force=True)
+        answer_cache.invalidate() # Las respuestas guardadas salieron del índice anterior
+    return activated
+
+
+def drop_version(version_id: int) -> bool:
+    """
+    Elimina una versión que no está activa ni construyéndose: su namespace del índice vectorial,
+    su índice BM25 y sus chunks. Devuelve False si la versión no existe o no se puede eliminar.
+    """
+    db = SessionLocal()
+    try:
+        version = get_index_version(db, version_id)
+        if version is None or version.status in ('active', 'building'):
+            return False
+        spec = index_spec(version)
+        vector_store().delete_namespace(spec.namespace)
+        index_registry.lexical(spec).drop()
+        index_registry.forget(version_id)
+        delete_index_version(db, version_id)
+    finally:
+        db.close()
+    index_registry.refresh(force=True)
+    return True
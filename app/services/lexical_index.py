@@ -0,0 +1,230 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import Collection, List, Optional, Sequence, Tuple
+
+from app.core.config import settings
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Palabras vacías frecuentes (es/en): no aportan a BM25 y tienen las listas de postings más largas.
+_STOPWORDS = frozenset("""
+a al algo ante antes como con contra cual cuando de del desde donde durante e el ella ellas ellos en entre era es esa
+ese eso esta este esto fue ha han hay la las le les lo los mas me mi muy no nos o para pero por que se ser si sin sobre
+son su sus tambien te tiene un una uno unos unas y ya
+an and are as at be by for from has have in is it its of on or that the their this to was were which with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Minúsculas, sin tildes y sin palabras vacías. Los números y las siglas se conservan tal cual
+    (p. ej. "2030", "ods", "h2020"), que es justo lo que la búsqueda densa recupera peor.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in _TOKEN_RE.findall(text) if t not in _STOPWORDS and (len(t) > 1 or t.isdigit())]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 sobre los chunks, persistido en SQLite y compartido entre los workers
+    (que lo actualizan durante la ingesta) y la API (que lo consulta).
+    Se mantiene de forma incremental: añadir o eliminar un chunk actualiza sus postings, la
+    frecuencia documental de sus términos y las estadísticas globales (N, longitud media).
+    Los IDs de los chunks son los mismos que los de los vectores.
+    Las escrituras usan una conexión compartida protegida por un lock; las búsquedas, una conexión
+    de lectura por hilo (WAL permite leer mientras se escribe), sin esperar a ese lock.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._conn = None
+        self._readers = threading.local()
+        self._epoch = 0 # Se incrementa en `drop`: las conexiones de lectura anteriores se descartan
+
+    def _get_conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS chunks (chunk_id TEXT PRIMARY KEY, document_id INTEGER NOT NULL, length INTEGER NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_chunks_document_id ON chunks (document_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT NOT NULL, chunk_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, chunk_id)) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_postings_chunk_id ON postings (chunk_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE TABLE IF NOT EXISTS stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO stats (key, value) VALUES ('n_chunks', 0), ('total_length', 0)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _read_conn(self) -> sqlite3.Connection:
+        reader = getattr(self._readers, "conn", None)
+        if reader is not None and self._readers.epoch == self._epoch:
+            return reader
+        if reader is not None:
+            reader.close()
+        with self._lock:
+            self._get_conn() # Crea el archivo y las tablas si aún no existen
+            epoch = self._epoch
+        reader = sqlite3.connect(self.path, timeout=30)
+        reader.execute("PRAGMA journal_mode=WAL")
+        self._readers.conn, self._readers.epoch = reader, epoch
+        return reader
+
+    def add(self, chunks: Sequence[Tuple[str, int, str]]):
+        """
+        Añade chunks (chunk_id, document_id, texto). Es idempotente: los IDs ya indexados se omiten,
+        y como el ID depende del contenido, un mismo ID implica el mismo texto.
+        """
+        if not chunks:
+            return
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = list({chunk_id for chunk_id, _, _ in chunks})
+                present = set()
+                for start in range(0, len(ids), 500):
+                    block = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(block))
+                    present.update(r[0] for r in conn.execute(f"SELECT chunk_id FROM chunks WHERE chunk_id IN ({placeholders})", block))
+
+                chunk_rows, posting_rows, df = [], [], Counter()
+                for chunk_id, document_id, text in chunks:
+                    if chunk_id in present:
+                        continue
+                    present.add(chunk_id)
+                    tf = Counter(tokenize(text))
+                    length = sum(tf.values())
+                    chunk_rows.append((chunk_id, document_id, length))
+                    posting_rows.extend((term, chunk_id, count) for term, count in tf.items())
+                    df.update(tf.keys())
+                if chunk_rows:
+                    conn.executemany("INSERT INTO chunks (chunk_id, document_id, length) VALUES (?, ?, ?)", chunk_rows)
+                    conn.executemany("INSERT INTO postings (term, chunk_id, tf) VALUES (?, ?, ?)", posting_rows)
+                    conn.executemany("INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df", df.items())
+                    conn.execute("UPDATE stats SET value = value + ? WHERE key = 'n_chunks'", (len(chunk_rows),))
+                    conn.execute("UPDATE stats SET value = value + ? WHERE key = 'total_length'", (sum(r[2] for r in chunk_rows),))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _remove_where(self, conn: sqlite3.Connection, chunk_ids: List[str]):
+        for start in range(0, len(chunk_ids), 500):
+            block = chunk_ids[start:start + 500]
+            placeholders = ",".join("?" * len(block))
+            rows = conn.execute(f"SELECT chunk_id, length FROM chunks WHERE chunk_id IN ({placeholders})", block).fetchall()
+            if not rows:
+                continue
+            found = [r[0] for r in rows]
+            placeholders = ",".join("?" * len(found))
+            df = Counter(r[0] for r in conn.execute(f"SELECT term FROM postings WHERE chunk_id IN ({placeholders})", found))
+            conn.executemany("UPDATE terms SET df = df - ? WHERE term = ?", [(count, term) for term, count in df.items()])
+            conn.execute(f"DELETE FROM postings WHERE chunk_id IN ({placeholders})", found)
+            conn.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", found)
+            conn.execute("UPDATE stats SET value = value - ? WHERE key = 'n_chunks'", (len(rows),))
+            conn.execute("UPDATE stats SET value = value - ? WHERE key = 'total_length'", (sum(r[1] for r in rows),))
+        conn.execute("DELETE FROM terms WHERE df <= 0")
+
+    def remove(self, chunk_ids: Sequence[str]):
+        """Elimina chunks por ID (los que no están indexados se ignoran)."""
+        if not chunk_ids:
+            return
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._remove_where(conn, list(chunk_ids))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def remove_document(self, document_id: int):
+        """Elimina todos los chunks de un documento."""
+        with self._lock:
+            conn = self._get_conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = [r[0] for r in conn.execute("SELECT chunk_id FROM chunks WHERE document_id = ?", (document_id,))]
+                self._remove_where(conn, ids)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def drop(self):
+        """Elimina el índice del disco (versiones del índice retiradas)."""
+        with self._lock:
+            self._epoch += 1
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except FileNotFoundError:
+                    pass
+
+    def search(self, query: str, top_k: int = 10, document_ids: Optional[Collection[int]] = None) -> List[Tuple[str, float]]:
+        """
+        Devuelve hasta `top_k` pares (chunk_id, score BM25) ordenados por score descendente.
+        Con `document_ids`, solo puntúa los chunks de esos documentos (filtros de la consulta).
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or (document_ids is not None and not document_ids):
+            return []
+        conn = self._read_conn()
+        conn.execute("BEGIN") # Estadísticas y postings de la misma instantánea aunque otro proceso escriba
+        try:
+            stats = dict(conn.execute("SELECT key, value FROM stats").fetchall())
+            n_chunks = stats.get("n_chunks", 0)
+            if n_chunks <= 0:
+                return []
+            avg_length = stats.get("total_length", 0) / n_chunks or 1.0
+            placeholders = ",".join("?" * len(terms))
+            df = conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", terms).fetchall()
+            if not df:
+                return []
+            # El IDF de cada término se calcula aquí; la suma por chunk, el filtro y el top-k, en SQLite
+            idf = [(term, math.log(1 + (n_chunks - term_df + 0.5) / (term_df + 0.5))) for term, term_df in df]
+            params = [value for pair in idf for value in pair] + [self.k1 + 1, self.k1 * (1 - self.b), self.k1 * self.b / avg_length]
+            document_filter = ""
+            if document_ids is not None:
+                document_filter = "WHERE c.document_id IN (SELECT value FROM json_each(?))"
+                params.append(json.dumps(sorted(int(document_id) for document_id in document_ids)))
+            return conn.execute(
+                f"""
+                WITH q(term, idf) AS (VALUES {", ".join(["(?, ?)"] * len(idf))}),
+                     k(k1_plus_1, k1_base, k1_length) AS (VALUES (?, ?, ?))
+                SELECT p.chunk_id, SUM(q.idf * p.tf * k.k1_plus_1 / (p.tf + k.k1_base + k.k1_length * c.length)) AS score
+                FROM q CROSS JOIN k JOIN postings p ON p.term = q.term JOIN chunks c ON c.chunk_id = p.chunk_id
+                {document_filter}
+                GROUP BY p.chunk_id
+                ORDER BY score DESC
+                LIMIT ?
+                """,
+                params + [top_k],
+            ).fetchall()
+        finally:
+            conn.rollback()
+
+
+lexical_index = BM25Index(
+    path=settings.LEXICAL_INDEX_PATH,
+    k1=settings.BM25_K1,
+    b=settings.BM25_B,
+)
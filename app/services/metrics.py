@@ -0,0 +1,78 @@
+"""
+Métricas Prometheus de consultas e ingesta, expuestas en `/metrics` (app/main.py).
+
+La ingesta se ejecuta en los procesos worker: para que sus métricas aparezcan en `/metrics`,
+define PROMETHEUS_MULTIPROC_DIR (un directorio vacío y compartido) tanto para la API como
+para `python -m app.worker`; prometheus_client agrega entonces las métricas de todos los procesos.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess
+
+QUERY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+INGESTION_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+QUERY_SECONDS = Histogram(
+    "rag_query_seconds", "Duración total de las consultas RAG.", ["endpoint", "quality_tier"], buckets=QUERY_BUCKETS
+)
+QUERY_STAGE_SECONDS = Histogram(
+    "rag_query_stage_seconds", "Duración de cada etapa de las consultas RAG.", ["stage"], buckets=QUERY_BUCKETS
+)
+INGESTION_STAGE_SECONDS = Histogram(
+    "ingestion_stage_seconds", "Duración de cada etapa del pipeline de ingesta.", ["stage"], buckets=INGESTION_BUCKETS
+)
+INGESTION_DOCUMENTS = Counter("ingestion_documents_total", "Documentos procesados por estado final.", ["status"])
+INGESTION_CHUNKS = Counter("ingestion_chunks_total", "Chunks procesados en la ingesta (total, nuevos indexados, obsoletos eliminados).", ["kind"])
+QUERY_CONTEXT_TOKENS = Histogram(
+    "rag_query_context_tokens", "Tokens del contexto enviado al LLM en las consultas RAG.", buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000)
+)
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens consumidos en OpenAI.", ["model", "kind"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Consultas a las cachés por resultado (hit/miss).", ["cache", "result"])
+
+
+def observe_stage(histogram: Histogram, stage: str, seconds: float, timings: Optional[dict] = None):
+    """Registra la duración de una etapa en `histogram` y, si se pasa, la acumula (ms) en `timings`."""
+    histogram.labels(stage=stage).observe(seconds)
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 1)
+
+
+@contextmanager
+def stage_timer(histogram: Histogram, stage: str, timings: Optional[dict] = None):
+    """Mide la duración del bloque como una etapa (ver `observe_stage`)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(histogram, stage, time.perf_counter() - start, timings)
+
+
+def record_cache(cache: str, hits: int, misses: int):
+    if hits:
+        CACHE_REQUESTS.labels(cache=cache, result="hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache=cache, result="miss").inc(misses)
+
+
+def record_usage(model: str, usage):
+    """Registra el `usage` de una respuesta de OpenAI (chat o embeddings), si viene informado."""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    if prompt_tokens:
+        LLM_TOKENS.labels(model=model, kind="prompt").inc(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.labels(model=model, kind="completion").inc(completion_tokens)
+
+
+def render_metrics():
+    """Devuelve (cuerpo, content type) con las métricas en formato de texto de Prometheus."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
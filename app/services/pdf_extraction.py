@@ -0,0 +1,112 @@
+"""
+Extracción del texto de los PDF, página a página, repartiendo los PDF grandes entre procesos.
+
+PyMuPDF extrae el texto en el propio hilo y con el GIL tomado, así que un informe de cientos de
+páginas ocupa un solo núcleo. Si hay al menos dos núcleos, los PDF con al menos PDF_PARALLEL_MIN_PAGES
+páginas se dividen en rangos
+de PDF_EXTRACTION_PAGES_PER_TASK páginas que extraen los procesos de un pool (cada uno abre el archivo
+por su cuenta); las páginas se devuelven en orden a medida que terminan sus rangos, con pocos rangos
+en curso a la vez para que la memoria no dependa del tamaño del PDF.
+Los procesos se lanzan con "spawn", como los workers de ingesta: el worker ya tiene hilos en marcha
+(heartbeats, etapas del pipeline) y un fork los copiaría a medias.
+"""
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, List, Optional
+
+import fitz  # PyMuPDF
+
+from app.core.config import settings
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _extract_range(file_path: str, start: int, stop: int) -> List[str]:
+    """Texto de las páginas [start, stop) del PDF (se ejecuta en los procesos del pool)."""
+    with fitz.open(file_path, filetype="pdf") as doc:
+        return [doc.load_page(number).get_text() for number in range(start, stop)]
+
+
+def extraction_processes() -> int:
+    """Procesos del pool; 1 (extracción en el hilo) si la máquina tiene un solo núcleo."""
+    cpus = os.cpu_count() or 1
+    if cpus < 2:
+        # Medido: con un núcleo el pool solo añade el coste de abrir el PDF y pasar el texto (x0,6-x0,9)
+        return 1
+    if settings.PDF_EXTRACTION_PROCESSES > 0:
+        return min(settings.PDF_EXTRACTION_PROCESSES, cpus)
+    return max(1, cpus // max(1, settings.INGESTION_WORKERS))
+
+
+def _get_pool(processes: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def iter_page_texts(doc, file_path: str) -> Iterator[str]:
+    """
+    Texto de cada página de `doc` (abierto desde `file_path`), en orden. Los PDF pequeños, o si
+    solo hay un proceso disponible, se extraen aquí mismo con `doc`; los grandes, en el pool.
+    """
+    processes = extraction_processes()
+    if processes < 2 or doc.page_count < settings.PDF_PARALLEL_MIN_PAGES:
+        for page in doc:
+            yield page.get_text()
+        return
+
+    pool = _get_pool(processes)
+    size = settings.PDF_EXTRACTION_PAGES_PER_TASK
+    ranges = iter([(start, min(start + size, doc.page_count)) for start in range(0, doc.page_count, size)])
+    pending = deque()
+    extracted = 0 # Páginas ya devueltas
+    try:
+        # Dos rangos por proceso: los procesos no esperan mientras se consume el rango anterior
+        for start, stop in ranges:
+            pending.append(pool.submit(_extract_range, file_path, start, stop))
+            if len(pending) >= 2 * processes:
+                break
+        while pending:
+            texts = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(_extract_range, file_path, *next_range))
+            for text in texts:
+                extracted += 1
+                yield text
+    except BrokenProcessPool as e:
+        # Un proceso murió (p. ej. sin memoria): el pool ya no sirve. Se descarta para que la
+        # siguiente extracción cree otro y el resto de este PDF se extrae aquí mismo.
+        print(f"PDF EXTRACTION: El pool de extracción dejó de funcionar; se sigue en el hilo del pipeline: {e}")
+        _discard_pool(pool)
+        pending.clear()
+        for number in range(extracted, doc.page_count):
+            yield doc.load_page(number).get_text()
+    finally:
+        # Si el consumidor se detiene (p. ej. por un error al indexar), los rangos pendientes sobran
+        for future in pending:
+            future.cancel()
+
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_extraction_pool():
+    """Detiene los procesos del pool (al parar el worker)."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
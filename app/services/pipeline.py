@@ -1,49 +1,386 @@
 import fitz  # PyMuPDF
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import functools
+import hashlib
+import time
+from bisect import bisect_right
+from collections import deque
+from typing import List, NamedTuple, Optional
 from app.core.config import settings
-import openai
-from pinecone import Pinecone
-import cloudinary
-import cloudinary.uploader
+from app.core.clients import openai_client, cloudinary_uploader, vector_store
 from app.db.session import SessionLocal
-from app.db.crud import update_document_processing_results
-
-# --- Inicialización de Clientes ---
-# Se inicializan una vez cuando el módulo se carga para mayor eficiencia.
-
-# OpenAI
-# La librería de OpenAI lee la variable de entorno OPENAI_API_KEY automáticamente.
-client_openai = openai.OpenAI()
-
-# Pinecone
-pc = Pinecone(api_key=settings.PINECONE_API_KEY)
-# NOTA: Asegúrate de tener un índice en Pinecone llamado 'vigilancia-dev-index'.
-# Si tu índice tiene otro nombre, cámbialo aquí.
-pinecone_index = pc.Index("vigilancia-dev-index")
-
-# Cloudinary
-cloudinary.config(
-    cloud_name=settings.CLOUDINARY_CLOUD_NAME,
-    api_key=settings.CLOUDINARY_API_KEY,
-    api_secret=settings.CLOUDINARY_API_SECRET,
+from app.db.crud import (
+    update_document_processing_results, get_document_chunk_hashes, sync_document_chunks, store_document_chunks, update_document_stage,
+    get_document_chunks, get_document_vector_ids, delete_document_chunks,
 )
+from app.services.embedding_cache import embed_texts
+from app.services.answer_cache import answer_cache
+from app.services.retry import call_with_retries
+from app.services.tokenizer import count_tokens
+from app.services.index_versions import DEFAULT_INDEX, IndexSpec, live_indexes, lexical_index_for
+from app.services.pdf_extraction import iter_page_texts
+from app.services.text_splitter import RecursiveSplitter
+from app.services.upsert_batcher import SharedUpsertBatcher
+from app.services.stage_graph import Stage, run_stage_graph
+from app.services.metrics import INGESTION_STAGE_SECONDS, INGESTION_DOCUMENTS, INGESTION_CHUNKS, stage_timer, observe_stage, record_usage
 
-def process_pdf_pipeline(file_bytes: bytes, document_id: int, user_metadata: dict):
+# Los clientes de OpenAI, Cloudinary y el índice vectorial se crean al primer uso (ver app/core/clients.py).
+
+# --- Parámetros de chunking ---
+# El tamaño y el solapamiento de los chunks dependen de la versión del índice (ver index_versions.py).
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " ", ""]
+# Texto acumulado antes de partir en chunks, en múltiplos del tamaño del chunk; acota la memoria del pipeline.
+CHUNK_WINDOW_FACTOR = 20
+# Palabras del inicio del documento que se envían al LLM para el resumen.
+SUMMARY_MAX_WORDS = 4000
+MIN_TEXT_CHARS = 100
+
+class Chunk(NamedTuple):
+    text: str
+    char_start: Optional[int] # Posición en el texto completo del documento
+    char_end: Optional[int]
+    page_start: Optional[int] # Páginas desde 1
+    page_end: Optional[int]
+
+def _has_enough_text(doc) -> bool:
+    """Comprueba pronto (sin extraer todo el PDF) si el documento tiene texto suficiente."""
+    total = 0
+    for page in doc:
+        total += len(page.get_text().strip())
+        if total >= MIN_TEXT_CHARS:
+            return True
+    return False
+
+def _summary_text(doc) -> str:
+    """Primeras SUMMARY_MAX_WORDS palabras del documento, para el resumen."""
+    words = []
+    for page in doc:
+        words.extend(page.get_text().split()[:SUMMARY_MAX_WORDS - len(words)])
+        if len(words) >= SUMMARY_MAX_WORDS:
+            break
+    return " ".join(words)
+
+def _text_splitter(spec: IndexSpec) -> RecursiveSplitter:
+    return RecursiveSplitter(chunk_size=spec.chunk_size, chunk_overlap=spec.chunk_overlap, separators=CHUNK_SEPARATORS)
+
+def _iter_chunks(pages, text_splitter: RecursiveSplitter, window_chars: int):
+    """
+    Recorre el texto de las páginas (`pages`, en orden) y genera los chunks (`Chunk`, con su posición
+    y páginas) de forma incremental. Solo se mantiene en memoria una ventana de ~`window_chars` caracteres:
+    al superarla se parte, se emiten todos los chunks salvo el último y se conserva el texto
+    desde el inicio de ese último chunk, de modo que el solapamiento entre chunks consecutivos se mantiene.
+    """
+    buffer = ""
+    buffer_offset = 0 # Posición del inicio de `buffer` en el texto completo
+    page_starts = [] # Posición en el texto completo donde empieza cada página
+
+    def to_chunk(span):
+        # El splitter da la posición de cada chunk en el buffer; las páginas salen de page_starts
+        start, end = buffer_offset + span[0], buffer_offset + span[1]
+        return Chunk(buffer[span[0]:span[1]], start, end, bisect_right(page_starts, start), bisect_right(page_starts, end - 1))
+
+    for page_text in pages:
+        page_starts.append(buffer_offset + len(buffer))
+        buffer += page_text
+        if len(buffer) < window_chars:
+            continue
+        spans = text_splitter.split_spans(buffer)
+        if len(spans) < 2:
+            continue
+        for span in spans[:-1]:
+            yield to_chunk(span)
+        tail_start = spans[-1][0]
+        buffer_offset += tail_start
+        buffer = buffer[tail_start:]
+    for span in text_splitter.split_spans(buffer):
+        yield to_chunk(span)
+
+def _select_new_chunks(chunks, document_id: int, existing_hashes: set, chunk_records: list, spec: IndexSpec):
+    """
+    Numera y calcula el hash de cada chunk, los registra todos en `chunk_records` (sin el texto)
+    y emite (índice, hash, chunk) solo para los que aún no están indexados. Los chunks repetidos
+    dentro del mismo documento comparten vector y se indexan una sola vez; la posición de cada
+    repetición queda en `repeats` del registro, para poder reconstruir el texto completo.
+    """
+    records = {} # hash -> registro de su primera aparición
+    for index, chunk in enumerate(chunks):
+        chunk_hash = hashlib.sha256(chunk.text.encode("utf-8")).hexdigest()
+        record = records.get(chunk_hash)
+        if record is not None:
+            record["repeats"] = (record["repeats"] or []) + [[index, chunk.char_start, chunk.char_end, chunk.page_start, chunk.page_end]]
+            continue
+        record = records[chunk_hash] = {
+            "vector_id": spec.vector_id(document_id, chunk_hash),
+            "chunk_index": index,
+            "chunk_hash": chunk_hash,
+            "page_start": chunk.page_start,
+            "page_end": chunk.page_end,
+            "char_start": chunk.char_start,
+            "char_end": chunk.char_end,
+            "repeats": None,
+        }
+        chunk_records.append(record)
+        if chunk_hash not in existing_hashes:
+            yield index, chunk_hash, chunk
+
+def _index_lexically(chunks, document_id: int, spec: IndexSpec, batch_size: int = 500):
+    """
+    Deja pasar los chunks sin cambios y, de paso, los añade por lotes al índice BM25 de la versión.
+    Se aplica a todos los chunks (no solo a los nuevos) para que los documentos ingeridos antes
+    de existir el índice léxico se incorporen en su siguiente re-ingesta; los ya presentes se omiten.
+    """
+    lexical = lexical_index_for(spec)
+    pending = []
+    for chunk in chunks:
+        chunk_hash = hashlib.sha256(chunk.text.encode("utf-8")).hexdigest()
+        pending.append((spec.vector_id(document_id, chunk_hash), document_id, chunk.text))
+        if len(pending) >= batch_size:
+            lexical.add(pending)
+            pending = []
+        yield chunk
+    if pending:
+        lexical.add(pending)
+
+def _iter_batches(chunks, max_tokens: int, max_items: int):
+    """
+    Agrupa los chunks (índice, hash, chunk) en lotes acotados por tokens y por número de elementos.
+    Emite (lote, tokens del lote).
+    """
+    batch, batch_tokens = [], 0
+    for chunk in chunks:
+        tokens = count_tokens(chunk[2].text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch, batch_tokens
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch, batch_tokens
+
+def _embed_and_upsert(entries: list):
+    """
+    Genera los embeddings de un grupo de lotes de chunks (versión del índice, document_id, metadatos
+    del vector, lote), posiblemente de varios documentos, con una sola llamada al batcher de
+    embeddings por versión; los sube a su namespace del índice vectorial (solo con los metadatos
+    filtrables) y guarda el texto y la ubicación de cada chunk en la tabla de chunks.
+    """
+    by_spec = {}
+    for spec, document_id, vector_metadata, batch in entries:
+        by_spec.setdefault(spec, []).extend((document_id, vector_metadata, index, chunk_hash, chunk) for index, chunk_hash, chunk in batch)
+    for spec, items in by_spec.items():
+        _embed_and_upsert_items(spec, items)
+
+def _embed_and_upsert_items(spec: IndexSpec, items: list):
+    # Los reintentos ante 429/5xx los gestiona el EmbeddingBatcher dentro de embed_texts.
+    embeddings = embed_texts(openai_client(), [chunk.text for *_, chunk in items], model=spec.embedding_model)
+    vectors = [
+        {
+            "id": spec.vector_id(document_id, chunk_hash),
+            "values": embedding,
+            "metadata": vector_metadata
+        }
+        for (document_id, vector_metadata, _, chunk_hash, _), embedding in zip(items, embeddings)
+    ]
+    call_with_retries(vector_store().upsert, vectors=vectors, namespace=spec.namespace, stage="vector_upsert")
+    # El texto se registra después del vector: un chunk con texto en la tabla siempre tiene vector.
+    rows_by_document = {}
+    for document_id, _, index, chunk_hash, chunk in items:
+        rows_by_document.setdefault(document_id, []).append({
+            "vector_id": spec.vector_id(document_id, chunk_hash),
+            "chunk_index": index,
+            "chunk_hash": chunk_hash,
+            "text": chunk.text,
+            "page_start": chunk.page_start,
+            "page_end": chunk.page_end,
+            "char_start": chunk.char_start,
+            "char_end": chunk.char_end,
+        })
+    db = SessionLocal()
+    try:
+        for document_id, rows in rows_by_document.items():
+            store_document_chunks(db, document_id, rows, index_version_id=spec.version_id)
+    finally:
+        db.close()
+
+# Lotes de embeddings/subida compartidos por todos los documentos que se ingieren a la vez en el proceso
+shared_upserts = SharedUpsertBatcher(
+    handler=_embed_and_upsert,
+    max_tokens=settings.EMBEDDING_BATCH_MAX_TOKENS,
+    max_items=100,
+    linger_seconds=settings.INGESTION_SHARED_BATCH_LINGER_SECONDS,
+    concurrency=settings.INGESTION_UPSERT_CONCURRENCY,
+)
+
+def _index_chunks(chunks, document_id: int, vector_metadata: dict, spec: IndexSpec) -> int:
+    """
+    Embebe y sube los chunks por lotes. Mientras un lote está en vuelo (OpenAI + Pinecone),
+    el hilo principal sigue extrayendo y partiendo el siguiente; el número de lotes en vuelo
+    está acotado para limitar la memoria. Los lotes incompletos (el último de cada documento,
+    o el único de un documento pequeño) se combinan con los de otros documentos en curso.
+    Devuelve el número de chunks indexados.
+    """
+    total = 0
+    in_flight = deque()
+    try:
+        for batch_number, (batch, batch_tokens) in enumerate(_iter_batches(chunks, settings.EMBEDDING_BATCH_MAX_TOKENS, 100), start=1):
+            while len(in_flight) >= settings.INGESTION_MAX_BATCHES_IN_FLIGHT:
+                in_flight.popleft().result()  # Propaga el error si el lote falló
+            print(f"BACKGROUND TASK: Enviando lote {batch_number} ({len(batch)} chunks) a OpenAI/Pinecone...")
+            in_flight.append(shared_upserts.submit((spec, document_id, vector_metadata, batch), tokens=batch_tokens, items=len(batch)))
+            total += len(batch)
+        while in_flight:
+            in_flight.popleft().result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+    return total
+
+def _vector_metadata(document_id: int, publication_year: Optional[int], language: Optional[str]) -> dict:
+    # Metadatos de los vectores: solo el documento y los campos filtrables. El texto de cada chunk
+    # va a la tabla de chunks y los datos de cita (título, editor, URL) se leen del documento.
+    vector_metadata = {"document_id": document_id}
+    if publication_year is not None:
+        vector_metadata["publication_year"] = publication_year
+    if language:
+        vector_metadata["language"] = language
+    return vector_metadata
+
+def _delete_vectors(vector_ids: list, spec: IndexSpec):
+    """Elimina vectores de una versión del índice (vectorial y BM25)."""
+    if vector_ids:
+        call_with_retries(vector_store().delete, vector_ids, namespace=spec.namespace, stage="vector_delete")
+        lexical_index_for(spec).remove(vector_ids)
+
+def _delete_untracked_vectors(document_id: int, spec: IndexSpec):
+    """
+    Elimina los vectores del documento que no figuran en la tabla de chunks (documentos ingeridos
+    antes de existir esa tabla, con IDs por posición, o restos de un intento fallido).
+    """
+    try:
+        call_with_retries(vector_store().delete_by_document, document_id, namespace=spec.namespace, stage="vector_delete")
+        lexical_index_for(spec).remove_document(document_id)
+    except Exception as e:
+        print(f"BACKGROUND TASK: No se pudieron eliminar los vectores previos del documento ID {document_id}: {e}")
+
+def _report_stage(db, document_id: int, stage: str):
+    """Registra la etapa en curso para que la API la publique (ver status_cache.py); un fallo aquí no detiene la ingesta."""
+    try:
+        update_document_stage(db, document_id, stage)
+    except Exception as e:
+        db.rollback()
+        print(f"BACKGROUND TASK: No se pudo registrar la etapa '{stage}' del documento ID {document_id}: {e}")
+
+def _upload_preview(image_bytes: bytes, document_id: int) -> str:
+    """Sube la imagen de la primera página a Cloudinary y devuelve su URL."""
+    with stage_timer(INGESTION_STAGE_SECONDS, "preview"):
+        cloudinary_response = call_with_retries(
+            cloudinary_uploader().upload,
+            image_bytes,
+            stage="preview_upload",
+            public_id=f"doc_preview_{document_id}",
+            overwrite=True,
+            folder="rag_previews"  # Opcional: para organizar en Cloudinary
+        )
+    return cloudinary_response['secure_url']
+
+def _index_pages(db, pages, document_id: int, vector_metadata: dict, spec: IndexSpec):
+    """
+    Chunking incremental, índice BM25, embeddings con OpenAI y subida al índice vectorial de una
+    versión, solapados por lotes. Devuelve (registros de todos los chunks vigentes, número de chunks nuevos indexados).
+    """
+    # En una re-ingesta solo se embeben y suben los chunks cuyo contenido cambió
+    existing_hashes = get_document_chunk_hashes(db, document_id, spec.version_id)
+    if not existing_hashes:
+        _delete_untracked_vectors(document_id, spec)
+
+    chunk_records = []
+    chunks = _iter_chunks(pages, _text_splitter(spec), CHUNK_WINDOW_FACTOR * spec.chunk_size)
+    chunks = _select_new_chunks(_index_lexically(chunks, document_id, spec), document_id, set(existing_hashes), chunk_records, spec)
+    # Los chunks repetidos (cabeceras, avisos legales, re-subidas) se sirven desde la caché de embeddings.
+    new_chunks = _index_chunks(chunks, document_id, vector_metadata, spec)
+    return chunk_records, new_chunks
+
+def _index_document(db, doc, file_path: str, document_id: int, vector_metadata: dict):
+    """
+    Indexa el documento en todas las versiones vivas del índice: la activa y, mientras se construye
+    una nueva, también en ella. Devuelve [(versión, registros de los chunks vigentes, chunks nuevos indexados)].
+    El texto de los PDF grandes se extrae en paralelo por rangos de páginas (ver pdf_extraction.py).
+    """
+    _report_stage(db, document_id, "index")
+    indexed = []
+    # La etapa incluye la extracción y el chunking, que se solapan con los embeddings y la subida.
+    with stage_timer(INGESTION_STAGE_SECONDS, "index"):
+        for spec in live_indexes():
+            pages = iter_page_texts(doc, file_path)
+            indexed.append((spec, *_index_pages(db, pages, document_id, vector_metadata, spec)))
+    return indexed
+
+def _sync_version_chunks(db, document_id: int, spec: IndexSpec, chunk_records: list, new_chunks: int):
+    """Registra los chunks vigentes de una versión y elimina de ella los que ya no existen."""
+    stale_ids = sync_document_chunks(db, document_id, chunk_records, spec.version_id)
+    _delete_vectors(stale_ids, spec)
+    INGESTION_CHUNKS.labels(kind="total").inc(len(chunk_records))
+    INGESTION_CHUNKS.labels(kind="indexed").inc(new_chunks)
+    INGESTION_CHUNKS.labels(kind="stale").inc(len(stale_ids))
+    print(f"BACKGROUND TASK: Documento ID {document_id} ({spec.namespace}): {len(chunk_records)} chunks, {new_chunks} nuevos indexados, {len(stale_ids)} obsoletos eliminados.")
+
+def _sync_chunks(db, document_id: int, indexed: list):
+    """Registra los chunks vigentes y elimina del índice los que ya no existen, en cada versión indexada."""
+    _report_stage(db, document_id, "sync_chunks")
+    with stage_timer(INGESTION_STAGE_SECONDS, "sync_chunks"):
+        for spec, chunk_records, new_chunks in indexed:
+            _sync_version_chunks(db, document_id, spec, chunk_records, new_chunks)
+
+def _summarize(text_for_summary: str):
+    """Genera el resumen y las palabras clave con OpenAI. Devuelve (resumen, palabras clave)."""
+    with stage_timer(INGESTION_STAGE_SECONDS, "summary"):
+        summary_response = call_with_retries(
+            openai_client().chat.completions.create,
+            stage="summary",
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "Eres un asistente experto en analizar documentos. Genera un resumen conciso (máximo 150 palabras) y después, en una nueva línea, escribe 'Palabras clave:' seguido de 10 palabras clave relevantes separadas por comas, para estas palabras toma como base el listado de tesauros homologados de la UNESCO, no incluyas nombres própios ni de organizaciones, solo información referente al contenido del texto base."},
+                {"role": "user", "content": f"Analiza el siguiente texto:\n\n{text_for_summary}"}
+            ],
+            temperature=0.2,
+        )
+    record_usage("gpt-3.5-turbo", getattr(summary_response, "usage", None))
+    content = summary_response.choices[0].message.content
+    parts = content.split("Palabras clave:")
+    summary = parts[0].replace("Resumen:", "").strip()
+    keywords_str = parts[1].strip() if len(parts) > 1 else ""
+    keywords = [k.strip() for k in keywords_str.split(',') if k.strip()]
+    return summary, keywords
+
+def process_pdf_pipeline(file_path: str, document_id: int, user_metadata: dict, raise_on_error: bool = False):
     """
     Función que orquesta el pipeline de procesamiento.
     Diseñada para ejecutarse en segundo plano, por lo que gestiona su propia sesión de DB.
+    El PDF se abre desde `file_path`: MuPDF lee del archivo las páginas a medida que se procesan,
+    sin cargar el documento entero en memoria.
+    Con `raise_on_error=True` los errores se propagan sin marcar el documento como 'failed',
+    para que el worker de la cola pueda reintentar el trabajo. Devuelve el estado final.
     """
     print(f"BACKGROUND TASK: Starting processing for document ID {document_id}")
     db = SessionLocal()
     final_results = {}
+    doc = None
+    pipeline_start = time.perf_counter()
     try:
-        # 1. Abrir PDF y extraer texto
-        doc = fitz.open(stream=file_bytes, filetype="pdf")
-        full_text = "".join(page.get_text() for page in doc)
-        pdf_metadata = doc.metadata
+        # 1. Abrir PDF desde disco (el texto se extrae página a página más adelante)
+        _report_stage(db, document_id, "open")
+        with stage_timer(INGESTION_STAGE_SECONDS, "open"):
+            doc = fitz.open(file_path, filetype="pdf")
+            pdf_metadata = doc.metadata
+
+            if not _has_enough_text(doc):
+                raise ValueError("El PDF parece estar basado en imágenes o tiene muy poco texto.")
 
-        if len(full_text.strip()) < 100:
-            raise ValueError("El PDF parece estar basado en imágenes o tiene muy poco texto.")
+            # La imagen de la primera página y el texto del resumen se leen antes de lanzar las etapas:
+            # un documento de PyMuPDF no admite varios hilos a la vez, así que después solo lo usa el indexado.
+            pix = doc.load_page(0).get_pixmap(dpi=150)  # Aumentamos un poco la resolución
+            image_bytes = pix.tobytes("png")
+            # Usamos solo una parte del texto (las primeras palabras) para no exceder el límite de tokens del LLM
+            text_for_summary = _summary_text(doc)
 
         # Lógica de Cascada para Metadatos
         # Prioridad 1: Datos del usuario. Prioridad 2: Datos del PDF.
@@ -62,78 +399,19 @@ def process_pdf_pipeline(file_bytes: bytes, document_id: int, user_metadata: dic
         final_publication_year = user_metadata.get("publication_year") or pdf_year
         final_source_url = user_metadata.get("source_url")
 
-        # 2. Generar y subir imagen de la primera página a Cloudinary
-        first_page = doc.load_page(0)
-        pix = first_page.get_pixmap(dpi=150)  # Aumentamos un poco la resolución
-        image_bytes = pix.tobytes("png")
-        
-        cloudinary_response = cloudinary.uploader.upload(
-            image_bytes,
-            public_id=f"doc_preview_{document_id}",
-            overwrite=True,
-            folder="rag_previews"  # Opcional: para organizar en Cloudinary
-        )
-        preview_image_url = cloudinary_response['secure_url']
+        vector_metadata = _vector_metadata(document_id, final_publication_year, user_metadata.get("language"))
 
-        # 3. Chunking del texto
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            separators=["\n\n", "\n", ". ", " ", ""]
-        )
-        chunks = text_splitter.split_text(full_text)
-
-        # 4. Generar Embeddings con OpenAI y subirlos a Pinecone
-        response = client_openai.embeddings.create(
-            input=chunks,
-            model="text-embedding-3-small"  # Modelo económico y eficiente
-        )
-        embeddings = [item.embedding for item in response.data]
-
-        vectors_to_upsert = []
-
-        # Preparamos los metadatos para RAG/Pinecone
-        pinecone_metadata = {
-            "document_id": document_id,
-            "title": final_title,
-            "publisher": final_publisher,
-            "publication_year": final_publication_year,
-            "source_url": final_source_url
-        }
-
-        for i, chunk in enumerate(chunks):
-            vector_id = f"doc_{document_id}_chunk_{i}"
-            vectors_to_upsert.append({
-                "id": vector_id,
-                "values": embeddings[i],
-                "metadata": {**pinecone_metadata, "text": chunk} # Combinamos metadatos de cita con el texto del chunk
-            })
-        
-        # Subir a Pinecone en lotes para evitar errores de tamaño de petición
-        batch_size = 100  # Un tamaño de lote seguro para Pinecone
-        for i in range(0, len(vectors_to_upsert), batch_size):
-            batch = vectors_to_upsert[i:i + batch_size]
-            print(f"BACKGROUND TASK: Subiendo lote {i//batch_size + 1} a Pinecone...")
-            pinecone_index.upsert(vectors=batch, namespace="default")
-
-
-        # 5. Generar Resumen y Keywords con OpenAI
-        # Usamos solo una parte del texto para no exceder el límite de tokens del LLM
-        text_for_summary = " ".join(full_text.split()[:4000])
-        
-        summary_response = client_openai.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "Eres un asistente experto en analizar documentos. Genera un resumen conciso (máximo 150 palabras) y después, en una nueva línea, escribe 'Palabras clave:' seguido de 10 palabras clave relevantes separadas por comas, para estas palabras toma como base el listado de tesauros homologados de la UNESCO, no incluyas nombres própios ni de organizaciones, solo información referente al contenido del texto base."},
-                {"role": "user", "content": f"Analiza el siguiente texto:\n\n{text_for_summary}"}
-            ],
-            temperature=0.2,
-        )
-        content = summary_response.choices[0].message.content
-        parts = content.split("Palabras clave:")
-        summary = parts[0].replace("Resumen:", "").strip()
-        keywords_str = parts[1].strip() if len(parts) > 1 else ""
-        keywords = [k.strip() for k in keywords_str.split(',') if k.strip()]
+        # 2 a 5. Vista previa en Cloudinary, indexado (chunks, BM25, embeddings, índice vectorial) y
+        # resumen con OpenAI son independientes y corren a la vez. La vista previa y el resumen son
+        # opcionales: si fallan, el documento se completa sin ellos y se conserva lo ya indexado.
+        graph = run_stage_graph([
+            Stage("preview", functools.partial(_upload_preview, image_bytes, document_id), optional=True),
+            Stage("index", functools.partial(_index_document, db, doc, file_path, document_id, vector_metadata)),
+            Stage("sync_chunks", lambda index: _sync_chunks(db, document_id, index), after=("index",)),
+            Stage("summary", functools.partial(_summarize, text_for_summary), optional=True),
+        ])
+        for stage, error in graph.errors.items():
+            print(f"BACKGROUND TASK: La etapa '{stage}' del documento ID {document_id} falló; se completa sin ella: {error}")
 
         # Consolidar todos los resultados para la actualización de la base de datos
         final_results = {
@@ -143,20 +421,160 @@ def process_pdf_pipeline(file_bytes: bytes, document_id: int, user_metadata: dic
             "publication_year": final_publication_year,
             "source_url": final_source_url,
             "status": "completed",
-            "summary": summary,
-            "keywords": keywords,
-            "preview_image_url": preview_image_url,
-            "language": user_metadata.get("language") # Mantenemos el idioma que el usuario seleccionó
+            "language": user_metadata.get("language"), # Mantenemos el idioma que el usuario seleccionó
+            "ingestion_stages": graph.statuses,
         }
+        # Una etapa opcional fallida no borra el resultado de una ingesta anterior
+        if graph.statuses["preview"] == "completed":
+            final_results["preview_image_url"] = graph.results["preview"]
+        if graph.statuses["summary"] == "completed":
+            final_results["summary"], final_results["keywords"] = graph.results["summary"]
 
     except Exception as e:
         print(f"BACKGROUND TASK ERROR: Error processing document ID {document_id}: {e}")
+        if raise_on_error:
+            raise
         final_results = {"status": "failed"}
     finally:
+        if doc is not None:
+            doc.close() # Libera el archivo antes de que el worker lo borre
         # Actualizar la base de datos con el estado final y todos los resultados
         if final_results:
             update_document_processing_results(db=db, document_id=document_id, results=final_results)
+        if final_results.get("status") == "completed":
+            # El corpus cambió: las respuestas cacheadas de /query/ ya no son válidas.
+            answer_cache.invalidate()
         db.close()
+        observe_stage(INGESTION_STAGE_SECONDS, "total", time.perf_counter() - pipeline_start)
+        INGESTION_DOCUMENTS.labels(status=final_results.get("status") or "retry").inc()
         print(f"BACKGROUND TASK: Finished processing for document ID {document_id}. Final status: {final_results.get('status')}")
+    return final_results.get("status")
+
+# --- Versiones del índice: reconstrucción y borrado por documento ---
+
+def _overlap(text: str, following: str, limit: int) -> int:
+    """Longitud del mayor final de `text` (hasta `limit`) con el que empieza `following`."""
+    for size in range(min(len(text), len(following), limit), 0, -1):
+        if text.endswith(following[:size]):
+            return size
+    return 0
+
+def _pages_from_chunks(chunks: List[Chunk], max_overlap: int) -> List[str]:
+    """
+    Reconstruye el texto del documento, por páginas, a partir de sus chunks guardados (el PDF se
+    borra al terminar la ingesta). Los chunks con posición se colocan en su sitio y los huecos entre
+    ellos (espacios que el splitter recorta en los bordes) se rellenan con saltos de línea; cada
+    página empieza donde empieza el primer chunk que comienza en ella, así que las páginas de los
+    chunks nuevos son aproximadas en los bordes. Los chunks antiguos sin posición se concatenan en
+    orden quitando el solapamiento con el anterior, en una sola página.
+    """
+    chunks = [chunk for chunk in chunks if chunk.text]
+    if chunks and all(chunk.char_start is not None for chunk in chunks):
+        parts, end, page_starts = [], 0, {}
+        for chunk in sorted(chunks, key=lambda c: c.char_start):
+            if chunk.char_start > end:
+                gap = chunk.char_start - end
+                parts.append(" " if gap == 1 else "\n" * gap)
+                end = chunk.char_start
+            if chunk.char_end > end:
+                parts.append(chunk.text[end - chunk.char_start:])
+                end = chunk.char_end
+            if chunk.page_start is not None:
+                page_starts.setdefault(chunk.page_start, chunk.char_start)
+        text = "".join(parts)
+        boundaries, start = [], 0
+        for page in range(1, max(page_starts, default=1) + 1):
+            start = max(start, page_starts.get(page, start)) if page > 1 else 0
+            boundaries.append(start)
+        return [text[start:end] for start, end in zip(boundaries, boundaries[1:] + [len(text)])]
+
+    text = ""
+    for chunk in chunks:
+        overlap = _overlap(text, chunk.text, max_overlap)
+        text += chunk.text[overlap:] if overlap else ("\n\n" if text else "") + chunk.text
+    return [text] if text else []
+
+def _legacy_vector_order(vector_id: str):
+    # Los IDs antiguos son posicionales (doc_{id}_chunk_{i}); los demás, al final
+    suffix = vector_id.rsplit("_", 1)[-1]
+    return (0, int(suffix), "") if suffix.isdigit() else (1, 0, vector_id)
+
+def _chunks_from_vectors(document_id: int, spec: IndexSpec) -> List[Chunk]:
+    """
+    Chunks de un documento ingerido antes de existir la tabla de chunks: sus vectores se listan por
+    el prefijo `doc_{id}_` y el texto sale de sus metadatos, en el orden de los IDs posicionales.
+    """
+    vector_ids = call_with_retries(vector_store().list_ids, f"doc_{document_id}_", namespace=spec.namespace, stage="vector_list")
+    vectors = call_with_retries(vector_store().fetch, vector_ids, namespace=spec.namespace, stage="vector_fetch") if vector_ids else {}
+    return [
+        Chunk(vectors[vector_id].metadata.get("text"), None, None, None, None)
+        for vector_id in sorted(vectors, key=_legacy_vector_order)
+    ]
 
+def _check_chunk_sequence(rows, spec: IndexSpec):
+    """
+    Comprueba que los chunks guardados (con sus repeticiones) cubren todo el documento: los índices
+    deben ir de 0 a N-1 sin saltos. Los registrados antes de guardar las repeticiones no las tienen,
+    y reconstruir con ese hueco perdería texto en silencio; esos documentos deben volver a ingerirse.
+    """
+    indexes = {row.chunk_index for row in rows}
+    for row in rows:
+        indexes.update(occurrence[0] for occurrence in row.repeats or [])
+    missing = len(set(range(max(indexes) + 1)) - indexes)
+    if missing:
+        raise ValueError(f"Faltan {missing} chunks repetidos del documento en el índice '{spec.namespace}'; vuelva a ingerir el PDF para reconstruirlo.")
 
+def reindex_document(document, source: IndexSpec, target: IndexSpec) -> int:
+    """
+    Indexa un documento ya ingerido (id, publication_year, language) en la versión `target` a partir
+    de sus chunks en la versión `source`: re-chunking y re-embedding sin volver a leer el PDF.
+    Los documentos ingeridos antes de existir la tabla de chunks se reconstruyen con el texto que
+    guardan los metadatos de sus vectores en el índice original.
+    Es incremental como una re-ingesta: si se repite, los chunks ya indexados no se vuelven a embeber.
+    Devuelve el número de chunks nuevos indexados.
+    """
+    db = SessionLocal()
+    try:
+        rows = get_document_chunks(db, document.id, source.version_id)
+        if rows:
+            _check_chunk_sequence(rows, source)
+            # Chunks ingeridos con el texto en los metadatos del vector: se leen del índice
+            legacy_ids = [row.vector_id for row in rows if row.text is None]
+            legacy = vector_store().fetch(legacy_ids, namespace=source.namespace) if legacy_ids else {}
+            numbered = []
+            for row in rows:
+                text = row.text or (legacy[row.vector_id].metadata.get("text") if row.vector_id in legacy else None)
+                numbered.append((row.chunk_index, Chunk(text, row.char_start, row.char_end, row.page_start, row.page_end)))
+                numbered += [(occurrence[0], Chunk(text, *occurrence[1:])) for occurrence in row.repeats or []]
+            chunks = [chunk for _, chunk in sorted(numbered, key=lambda item: item[0])]
+            max_overlap = source.chunk_overlap
+        else:
+            chunks = _chunks_from_vectors(document.id, DEFAULT_INDEX)
+            max_overlap = DEFAULT_INDEX.chunk_overlap
+        pages = _pages_from_chunks(chunks, max_overlap=max_overlap)
+        if not pages:
+            raise ValueError(f"El documento no tiene chunks con texto en el índice '{source.namespace}'.")
+        vector_metadata = _vector_metadata(document.id, document.publication_year, document.language)
+        chunk_records, new_chunks = _index_pages(db, pages, document.id, vector_metadata, target)
+        _sync_version_chunks(db, document.id, target, chunk_records, new_chunks)
+        return new_chunks
+    finally:
+        db.close()
+
+def delete_document_vectors(document_id: int):
+    """
+    Elimina los vectores y los chunks de un documento en todas las versiones vivas del índice.
+    Los IDs se leen de la tabla de chunks y se borran por ID (lotes de 1000), sin listar el índice
+    vectorial; solo si el documento no tiene chunks registrados (ingestas antiguas) se borra por documento.
+    """
+    db = SessionLocal()
+    try:
+        for spec in live_indexes():
+            vector_ids = get_document_vector_ids(db, document_id, spec.version_id)
+            if vector_ids:
+                _delete_vectors(vector_ids, spec)
+            else:
+                _delete_untracked_vectors(document_id, spec)
+            delete_document_chunks(db, document_id, spec.version_id)
+    finally:
+        db.close()
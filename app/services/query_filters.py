@@ -0,0 +1,107 @@
+"""
+Filtros de metadatos de las consultas RAG (`filters` en /query/, /query/stream y /query/batch).
+
+Los filtros reducen los candidatos en el propio índice vectorial, antes del re-ranking, en lugar de
+buscar en todo el corpus y dejar que Cohere descarte los documentos que no interesan:
+  - El idioma y el año de publicación van en los metadatos de cada vector (ver `process_pdf_pipeline`)
+    y se pasan tal cual al filtro del índice, junto con los IDs de documento indicados.
+  - El editor y las palabras clave no están en los vectores (las palabras clave se generan a la vez
+    que se indexa): se resuelven a IDs de documento en la base de datos y el índice filtra por
+    `document_id $in`.
+En los modos híbridos, la búsqueda BM25 se restringe a los documentos que cumplen todos los filtros,
+también resueltos en la base de datos.
+"""
+import json
+from typing import FrozenSet, NamedTuple, Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.crud import get_document_ids
+
+FILTER_FIELDS = ("document_ids", "publisher", "year_from", "year_to", "language", "keywords")
+# Campos que no están en los metadatos de los vectores y se resuelven a IDs de documento
+DATABASE_FIELDS = ("publisher", "keywords")
+
+
+class QueryFilter(NamedTuple):
+    vector_filter: dict # Filtro de metadatos del índice vectorial (sintaxis de Pinecone)
+    document_ids: Optional[FrozenSet[int]] # Documentos que cumplen todos los filtros (None si no hizo falta calcularlos)
+    description: str # Para las decisiones del QueryPlan
+    cache_scope: str # Las respuestas de la caché solo se reutilizan entre consultas con los mismos filtros
+
+    @property
+    def empty(self) -> bool:
+        """True si ningún documento cumple los filtros (no hace falta buscar)."""
+        return self.document_ids is not None and not self.document_ids
+
+
+def _normalize(filters: Optional[dict]) -> dict:
+    normalized = {}
+    for field, value in (filters or {}).items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Filtro desconocido: {field}")
+        if value is None or value == []:
+            continue
+        if field in ("document_ids", "keywords"):
+            value = sorted(set(value))
+        normalized[field] = value
+    if normalized.get("year_from") is not None and normalized.get("year_to") is not None and normalized["year_from"] > normalized["year_to"]:
+        raise ValueError("year_from no puede ser posterior a year_to.")
+    if len(normalized.get("document_ids", [])) > settings.RAG_FILTER_MAX_DOCUMENT_IDS:
+        raise ValueError(f"Se admiten como máximo {settings.RAG_FILTER_MAX_DOCUMENT_IDS} IDs de documento en los filtros.")
+    return normalized
+
+
+def _resolve_document_ids(filters: dict, limit: Optional[int] = None) -> FrozenSet[int]:
+    db = SessionLocal()
+    try:
+        return frozenset(get_document_ids(db, limit=limit, **filters))
+    finally:
+        db.close()
+
+
+def build_query_filter(filters: Optional[dict], lexical: bool = False) -> Optional[QueryFilter]:
+    """
+    Traduce los filtros de la petición (document_ids, publisher, year_from, year_to, language,
+    keywords; los ausentes o None se ignoran) a un `QueryFilter`, o devuelve None si no hay ninguno.
+    Con `lexical` (modos híbridos) calcula además los documentos que los cumplen, para BM25.
+    `keywords` selecciona los documentos con al menos una de las palabras clave.
+    """
+    filters = _normalize(filters)
+    if not filters:
+        return None
+
+    document_ids = None
+    needs_database = any(field in filters for field in DATABASE_FIELDS)
+    if needs_database:
+        # Un documento de más basta para saber que se supera el límite del `$in`
+        document_ids = _resolve_document_ids(filters, limit=settings.RAG_FILTER_MAX_DOCUMENT_IDS + 1)
+        if len(document_ids) > settings.RAG_FILTER_MAX_DOCUMENT_IDS:
+            raise ValueError(f"Los filtros seleccionan más de {settings.RAG_FILTER_MAX_DOCUMENT_IDS} documentos; acote el editor o las palabras clave.")
+        # El conjunto ya incluye el resto de filtros: el índice solo necesita los IDs.
+        vector_filter = {"document_id": {"$in": sorted(document_ids)}}
+    else:
+        vector_filter = {}
+        if "document_ids" in filters:
+            vector_filter["document_id"] = {"$in": filters["document_ids"]}
+        if "language" in filters:
+            vector_filter["language"] = {"$eq": filters["language"]}
+        years = {}
+        if "year_from" in filters:
+            years["$gte"] = filters["year_from"]
+        if "year_to" in filters:
+            years["$lte"] = filters["year_to"]
+        if years:
+            vector_filter["publication_year"] = years
+        if lexical and set(filters) != {"document_ids"}:
+            document_ids = _resolve_document_ids(filters)
+        elif "document_ids" in filters:
+            document_ids = frozenset(filters["document_ids"])
+
+    description = ", ".join(
+        f"document_ids=[{len(filters[field])} IDs]" if field == "document_ids" else f"{field}={filters[field]}"
+        for field in FILTER_FIELDS if field in filters
+    )
+    if document_ids is not None:
+        description += f" ({len(document_ids)} documentos)"
+    return QueryFilter(vector_filter, document_ids, description, json.dumps(filters, sort_keys=True, ensure_ascii=False))
@@ -1,26 +1,279 @@
-import openai
-from pinecone import Pinecone
-import cohere
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
 from app.core.config import settings
+from app.core.clients import openai_client, cohere_client, vector_store
+from app.services.embedding_cache import embed_texts
+from app.services.answer_cache import answer_cache
+from app.services.index_versions import IndexSpec, active_index, lexical_index_for
+from app.services.chunk_store import chunk_store, get_document_citations
+from app.services.context_builder import pack_context
+from app.services.query_filters import QueryFilter, build_query_filter
+from app.services.vector_store import VectorMatch
+from app.services.metrics import QUERY_SECONDS, QUERY_STAGE_SECONDS, QUERY_CONTEXT_TOKENS, stage_timer, observe_stage, record_cache, record_usage
 
-# --- Inicialización de Clientes ---
-client_openai = openai.OpenAI()
-pc = Pinecone(api_key=settings.PINECONE_API_KEY)
-co_client = cohere.Client(settings.COHERE_API_KEY)
-pinecone_index = pc.Index("vigilancia-dev-index")
+# Los clientes de OpenAI, Cohere y el índice vectorial se crean al primer uso (ver app/core/clients.py).
 
-def perform_rag_query(query: str):
+
+def _reciprocal_rank_fusion(rankings, k: int = 60):
     """
-    Orquesta el proceso de Retrieval-Augmented Generation (RAG).
+    Fusiona varias listas de IDs ordenadas por relevancia: cada ID suma 1 / (k + posición)
+    por cada lista en la que aparece. Devuelve los IDs ordenados por score fusionado.
     """
-    print("\n--- RAG DEBUG START ---")
-    print(f"Query: '{query}'")
+    scores = {}
+    for ranking in rankings:
+        for position, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + position)
+    return sorted(scores, key=scores.get, reverse=True)
+
+def _fuse_candidates(dense_rankings, lexical_rankings, limit: int, namespace: str = "default"):
+    """
+    Fusiona con RRF las listas de la búsqueda vectorial (una por consulta) y, en los modos
+    híbridos, las de BM25, y devuelve los mejores `limit` candidatos con su texto, hidratado
+    en bloque desde la tabla de chunks. Los vectores antiguos, con el texto aún en sus metadatos
+    y sin texto en la tabla, se resuelven con esos metadatos (o con un fetch al índice si solo los encontró BM25).
+    """
+    matches_by_id = {match.id: match for ranking in dense_rankings for match in ranking}
+    fused_ids = _reciprocal_rank_fusion(
+        [[match.id for match in ranking] for ranking in dense_rankings]
+        + [[chunk_id for chunk_id, _ in ranking] for ranking in lexical_rankings],
+        k=settings.RRF_K,
+    )[:limit]
+
+    chunks = chunk_store.get_many(fused_ids)
+    legacy = [chunk_id for chunk_id in fused_ids if chunk_id not in chunks and chunk_id not in matches_by_id]
+    if legacy:
+        matches_by_id.update(vector_store().fetch(legacy, namespace=namespace))
+
+    candidates = []
+    for chunk_id in fused_ids:
+        match = matches_by_id.get(chunk_id)
+        chunk = chunks.get(chunk_id)
+        if chunk is not None:
+            candidates.append(VectorMatch(id=chunk_id, score=match.score if match else 0.0, metadata={**(match.metadata if match else {}), **chunk}))
+        elif match is not None and match.metadata.get("text"):
+            candidates.append(match)
+    return candidates
+
+RETRIEVAL_MODES = ("dense", "hybrid", "hybrid_fast")
+
+# Niveles de calidad de /query/. expansion: "always" | "adaptive" (solo si la primera búsqueda
+# no es concluyente) | "never"; rerank: "always" | "adaptive" (se omite si los scores ya separan
+# claramente los chunks del contexto del resto). rerank_candidates=None usa RAG_RERANK_CANDIDATES.
+QUALITY_TIERS = {
+    "fast": {"expansion": "never", "top_k": 5, "rerank": "adaptive", "rerank_candidates": 10},
+    "balanced": {"expansion": "adaptive", "top_k": 10, "rerank": "always", "rerank_candidates": 20},
+    "deep": {"expansion": "always", "top_k": 10, "rerank": "always", "rerank_candidates": None},
+}
+
+CONTEXT_CHUNKS = settings.RAG_CONTEXT_CHUNKS # Chunks que pasan al contexto tras el re-ranking
+
+class QueryPlan:
+    """
+    Nivel de calidad y presupuesto de latencia de una consulta. Si solo se indica el presupuesto,
+    el nivel se deduce de él. Cada etapa consulta el plan (y el tiempo restante) para decidir
+    si se ejecuta, y la decisión queda registrada en `decisions` y se devuelve en la respuesta.
+    La versión del índice se fija al crear el plan: una activación a mitad de consulta no la afecta.
+    """
+
+    def __init__(self, quality_tier: str = None, latency_budget_ms: int = None, include_timings: bool = False):
+        if quality_tier is None:
+            if latency_budget_ms is None:
+                quality_tier = settings.RAG_QUALITY_TIER
+            elif latency_budget_ms <= settings.RAG_FAST_BUDGET_MS:
+                quality_tier = "fast"
+            elif latency_budget_ms <= settings.RAG_BALANCED_BUDGET_MS:
+                quality_tier = "balanced"
+            else:
+                quality_tier = "deep"
+        if quality_tier not in QUALITY_TIERS:
+            raise ValueError(f"Nivel de calidad desconocido: {quality_tier}")
+        tier = QUALITY_TIERS[quality_tier]
+        self.quality_tier = quality_tier
+        self.latency_budget_ms = latency_budget_ms
+        self.expansion = tier["expansion"]
+        self.top_k = tier["top_k"]
+        self.rerank = tier["rerank"]
+        self.rerank_candidates = tier["rerank_candidates"] or settings.RAG_RERANK_CANDIDATES
+        self.decisions = {}
+        self.context_tokens = None # Tokens del contexto enviado al LLM
+        self.include_timings = include_timings
+        self.index: IndexSpec = active_index()
+        self.timings = {} # Etapa -> ms, también exportadas como histogramas en /metrics
+        self._started = time.monotonic()
+
+    def elapsed_ms(self) -> float:
+        return (time.monotonic() - self._started) * 1000
+
+    def can_afford(self, cost_ms: float) -> bool:
+        """True si no hay presupuesto o si lo que queda alcanza para una etapa de coste `cost_ms`."""
+        return self.latency_budget_ms is None or self.latency_budget_ms - self.elapsed_ms() >= cost_ms
+
+    def decide(self, stage: str, decision: str):
+        self.decisions[stage] = decision
+        print(f"PLAN ({self.quality_tier}): {stage}: {decision}")
+
+    def stage(self, name: str):
+        """Context manager que mide una etapa de la consulta."""
+        return stage_timer(QUERY_STAGE_SECONDS, name, self.timings)
+
+    def record(self, name: str, seconds: float):
+        observe_stage(QUERY_STAGE_SECONDS, name, seconds, self.timings)
+
+    def summary(self) -> dict:
+        return {
+            "quality_tier": self.quality_tier,
+            "latency_budget_ms": self.latency_budget_ms,
+            "elapsed_ms": round(self.elapsed_ms(), 1),
+            "decisions": dict(self.decisions),
+            "context_tokens": self.context_tokens,
+        }
+
+    def annotate(self, result: dict, endpoint: str) -> dict:
+        """Añade al resultado el resumen del plan (y los tiempos por etapa, si se pidieron) y registra la duración total."""
+        QUERY_SECONDS.labels(endpoint=endpoint, quality_tier=self.quality_tier).observe(self.elapsed_ms() / 1000)
+        result["pipeline"] = self.summary()
+        if self.include_timings:
+            result["timings"] = {**self.timings, "total": round(self.elapsed_ms(), 1)}
+        else:
+            result.pop("timings", None)
+        return result
+
+NOT_FOUND_ANSWER = "La información no se encuentra en la base de conocimiento."
+
+def _lookup_cached_answer(query: str, scope: str = "", embedding_model: str = None):
+    """
+    Busca la consulta en la caché de respuestas (exacta y, si está activada, semántica), entre las
+    respondidas con el mismo nivel, modo y filtros (`scope`), con una sola búsqueda: la coincidencia exacta tiene
+    prioridad dentro de `answer_cache.get`.
+    Devuelve (respuesta cacheada o None, embedding de la consulta o None, versión del corpus).
+    """
+    # La versión se captura antes de buscar y de ejecutar el pipeline: si entretanto se completa
+    # una ingesta, la respuesta no se guarda porque ya no refleja el corpus.
+    version = answer_cache.version
+    query_embedding = None
+    if settings.ANSWER_CACHE_SEMANTIC:
+        # El embedding de la consulta original queda en la caché de embeddings y se reutiliza en la
+        # recuperación; una pregunta repetida lo encuentra ahí sin llamar a OpenAI.
+        query_embedding = embed_texts(openai_client(), [query], model=embedding_model or active_index().embedding_model)[0]
+    cached = answer_cache.get(query, query_embedding, scope=scope)
+    if cached is not None:
+        print(f"ANSWER CACHE: Respuesta reutilizada para '{query}'.")
+    record_cache("answer", hits=int(cached is not None), misses=int(cached is None))
+    return cached, query_embedding, version
+
+def _build_filter(filters: dict, retrieval_mode: str, plan: QueryPlan):
+    """`QueryFilter` de los filtros de la petición (None si no hay); en los modos híbridos incluye los documentos para BM25."""
+    if not filters:
+        return None
+    with plan.stage("filters"):
+        return build_query_filter(filters, lexical=_check_retrieval_mode(retrieval_mode) != "dense")
 
-    # 1. Expansión de Consulta con LLM
-    print("Paso 1: Expansión de consulta con LLM...")
+def _cache_scope(plan: QueryPlan, retrieval_mode: str = None, query_filter: QueryFilter = None) -> str:
+    """
+    Ámbito de la caché de respuestas: una respuesta solo se reutiliza con el mismo nivel de calidad,
+    modo de recuperación y filtros, para no servir a una consulta "deep" la respuesta de una "fast".
+    """
+    filter_scope = query_filter.cache_scope if query_filter is not None else ""
+    return f"{plan.quality_tier}|{_check_retrieval_mode(retrieval_mode)}|{filter_scope}"
+
+def _from_cache(cached: dict, plan: QueryPlan, endpoint: str) -> dict:
+    plan.decide("answer_cache", "hit")
+    return plan.annotate(cached, endpoint)
+
+def perform_rag_query(query: str, retrieval_mode: str = None, quality_tier: str = None, latency_budget_ms: int = None, include_timings: bool = False,
+                      filters: dict = None):
+    """
+    Punto de entrada de las consultas RAG: sirve la respuesta desde la caché cuando la misma
+    pregunta (o una semánticamente equivalente) ya fue respondida con el corpus actual.
+    `retrieval_mode` es uno de RETRIEVAL_MODES (por defecto, RAG_RETRIEVAL_MODE); `quality_tier`
+    (QUALITY_TIERS) y `latency_budget_ms` definen el `QueryPlan` de la consulta. Con `include_timings`
+    la respuesta incluye la duración de cada etapa (ms). `filters` restringe la búsqueda a los
+    documentos que los cumplen (ver query_filters.py).
+    """
+    plan = QueryPlan(quality_tier, latency_budget_ms, include_timings)
+    query_filter = _build_filter(filters, retrieval_mode, plan)
+    scope = _cache_scope(plan, retrieval_mode, query_filter)
+    with plan.stage("answer_cache"):
+        cached, query_embedding, version = _lookup_cached_answer(query, scope, plan.index.embedding_model)
+    if cached is not None:
+        return _from_cache(cached, plan, "query")
+
+    result = _run_rag_pipeline(query, retrieval_mode, plan, query_filter)
+    answer_cache.put(query, result, query_embedding, version=version, scope=scope)
+    return plan.annotate(result, "query")
+
+def _sse_event(event: str, data: dict) -> str:
+    """Formatea un evento Server-Sent Events con payload JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def stream_rag_query(query: str, retrieval_mode: str = None, quality_tier: str = None, latency_budget_ms: int = None, include_timings: bool = False,
+                     filters: dict = None):
+    """
+    Variante en streaming de `perform_rag_query`, pensada para Server-Sent Events.
+    Emite las fuentes en cuanto termina el re-ranking (evento `sources`), después los fragmentos
+    de la respuesta a medida que el LLM los genera (eventos `token`) y, al final, la respuesta
+    completa (evento `done`). Los errores se notifican con un evento `error`.
+    """
     try:
-        expansion_response = client_openai.chat.completions.create(
+        plan = QueryPlan(quality_tier, latency_budget_ms, include_timings)
+        query_filter = _build_filter(filters, retrieval_mode, plan)
+        scope = _cache_scope(plan, retrieval_mode, query_filter)
+        with plan.stage("answer_cache"):
+            cached, query_embedding, version = _lookup_cached_answer(query, scope, plan.index.embedding_model)
+        if cached is not None:
+            cached = _from_cache(cached, plan, "query_stream")
+            yield _sse_event("sources", {"sources": cached["sources"]})
+            yield _sse_event("token", {"text": cached["answer"]})
+            yield _sse_event("done", cached)
+            return
+
+        print("\n--- RAG DEBUG START (stream) ---")
+        print(f"Query: '{query}'")
+        retrieval = _retrieve_context(query, retrieval_mode, plan, query_filter)
+        if retrieval is None:
+            result = {"answer": NOT_FOUND_ANSWER, "sources": []}
+            yield _sse_event("sources", {"sources": []})
+            yield _sse_event("token", {"text": NOT_FOUND_ANSWER})
+        else:
+            yield _sse_event("sources", {"sources": retrieval["sources"]})
+            print("Streaming prompt to LLM...")
+            generation_start = time.perf_counter()
+            stream = openai_client().chat.completions.create(
+                model="gpt-3.5-turbo",
+                messages=[{"role": "system", "content": _build_prompt(query, retrieval)}],
+                temperature=0.1,
+                stream=True,
+                stream_options={"include_usage": True} # El último evento trae el consumo de tokens
+            )
+            answer_parts = []
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    record_usage("gpt-3.5-turbo", chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not answer_parts:
+                        plan.record("first_token", time.perf_counter() - generation_start)
+                    answer_parts.append(delta)
+                    yield _sse_event("token", {"text": delta})
+            plan.record("generation", time.perf_counter() - generation_start)
+            result = {"answer": "".join(answer_parts), "sources": retrieval["sources"]}
+        plan.annotate(result, "query_stream")
+        print("--- RAG DEBUG END (stream) ---\n")
+
+        answer_cache.put(query, result, query_embedding, version=version, scope=scope)
+        yield _sse_event("done", result)
+    except Exception as e:
+        print(f"Error en la consulta en streaming: {e}")
+        yield _sse_event("error", {"detail": f"Error al procesar la consulta: {e}"})
+
+def _expand_query(query: str):
+    """Genera variantes de la consulta con el LLM; devuelve la original más las nuevas."""
+    try:
+        expansion_response = openai_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are an expert at query expansion for vector search. Given a user's query, generate 3 additional, different versions of the query. The new queries should use synonyms, rephrase the question, or explore sub-topics. Return a JSON object with a key 'queries' containing a list of 4 strings: the original query and the 3 new ones."},
@@ -28,102 +281,258 @@ def perform_rag_query(query: str):
             ],
             response_format={"type": "json_object"}
         )
+        record_usage("gpt-3.5-turbo", getattr(expansion_response, "usage", None))
         queries_data = json.loads(expansion_response.choices[0].message.content)
         all_queries = queries_data.get("queries", [query])
         print(f"Consultas expandidas: {all_queries}")
+        return all_queries
     except Exception as e:
         print(f"Error en la expansión de consulta, usando solo la original. Error: {e}")
-        all_queries = [query]
+        return [query]
 
-    # 2. Crear embeddings para todas las preguntas
-    query_embedding_response = client_openai.embeddings.create(
-        input=all_queries,
-        model="text-embedding-3-small"
-    )
-    query_embeddings = [item.embedding for item in query_embedding_response.data]
-
-    # 3. Buscar en Pinecone con todos los embeddings y combinar resultados
-    print("Paso 2: Recuperación amplia de Pinecone con consultas expandidas...")
-    seen_chunk_ids = set()
-    all_matches = []
-    for emb in query_embeddings:
-        search_response = pinecone_index.query(
-            vector=emb,
-            top_k=10,  # Pedimos 10 por cada consulta expandida
-            include_metadata=True,
-            namespace="default"
+def _expand_queries(queries: List[str]) -> List[List[str]]:
+    """
+    Versión por lotes de `_expand_query`: genera las variantes de varias consultas con una sola
+    llamada al LLM. Devuelve, por consulta, la original más las nuevas (solo la original si falla).
+    """
+    if len(queries) == 1:
+        return [_expand_query(queries[0])]
+    try:
+        expansion_response = openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[
+                {"role": "system", "content": "You are an expert at query expansion for vector search. You receive a JSON list of user queries. For each query, generate 3 additional, different versions of it. The new queries should use synonyms, rephrase the question, or explore sub-topics. Return a JSON object with a key 'results' containing one list per input query, in the same order, each with 4 strings: the original query and the 3 new ones."},
+                {"role": "user", "content": json.dumps(queries, ensure_ascii=False)}
+            ],
+            response_format={"type": "json_object"}
         )
-        for match in search_response.matches:
-            if match.id not in seen_chunk_ids:
-                seen_chunk_ids.add(match.id)
-                all_matches.append(match)
-    
-    print(f"Recuperados {len(all_matches)} chunks únicos de Pinecone para re-ranking.")
+        record_usage("gpt-3.5-turbo", getattr(expansion_response, "usage", None))
+        results = json.loads(expansion_response.choices[0].message.content).get("results")
+        if not isinstance(results, list) or len(results) != len(queries):
+            raise ValueError("la respuesta no trae una lista de variantes por consulta")
+        expanded = []
+        for query, variants in zip(queries, results):
+            variants = [variant for variant in variants if isinstance(variant, str)] if isinstance(variants, list) else []
+            expanded.append(variants or [query])
+        return expanded
+    except Exception as e:
+        print(f"Error en la expansión de consultas por lotes, usando solo las originales. Error: {e}")
+        return [[query] for query in queries]
+
+def _plan_expansion(retrieval_mode: str, plan: QueryPlan):
+    """Decide si expandir la consulta antes de la primera búsqueda: True, False o None (adaptativo)."""
+    if retrieval_mode == "hybrid_fast":
+        plan.decide("expansion", "omitida (modo hybrid_fast)")
+        return False
+    if plan.expansion == "never":
+        plan.decide("expansion", f"omitida (nivel {plan.quality_tier})")
+        return False
+    if not plan.can_afford(settings.RAG_EXPANSION_COST_MS):
+        plan.decide("expansion", "omitida (presupuesto de latencia insuficiente)")
+        return False
+    if plan.expansion == "always":
+        plan.decide("expansion", f"aplicada (nivel {plan.quality_tier})")
+        return True
+    return None
+
+def _well_separated(candidates, n: int, dense_ids: set) -> bool:
+    """
+    True si los `n` primeros candidatos, en el orden fusionado (el que se trunca si no se re-rankea),
+    se separan claramente por similitud del resto. Solo los encontrados por la búsqueda vectorial
+    (`dense_ids`) tienen similitud: si alguno de los `n` no la tiene, o no quedan suficientes
+    candidatos con los que comparar, no se puede juzgar y se re-rankea.
+    """
+    if len(candidates) <= n:
+        return False
+    kept = candidates[:n]
+    rest = [match.score for match in candidates[n:] if match.id in dense_ids]
+    if not rest or any(match.id not in dense_ids for match in kept):
+        return False
+    return min(match.score for match in kept) - max(rest) >= settings.RAG_RERANK_SKIP_MARGIN
+
+def _check_retrieval_mode(retrieval_mode: str = None) -> str:
+    retrieval_mode = retrieval_mode or settings.RAG_RETRIEVAL_MODE
+    if retrieval_mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Modo de recuperación desconocido: {retrieval_mode}")
+    return retrieval_mode
+
+def _adaptive_expansion(plan: QueryPlan, first_ranking) -> bool:
+    """Expansión adaptativa: se expande si la primera búsqueda no es concluyente."""
+    top_score = first_ranking[0].score if first_ranking else 0.0
+    expand = top_score < settings.RAG_EXPANSION_SKIP_SCORE
+    comparison = "<" if expand else ">="
+    outcome = "aplicada (primera búsqueda poco concluyente" if expand else "omitida (primera búsqueda concluyente"
+    plan.decide("expansion", f"{outcome}: score {top_score:.2f} {comparison} {settings.RAG_EXPANSION_SKIP_SCORE:.2f})")
+    return expand
+
+def _apply_filter(plan: QueryPlan, query_filter: QueryFilter = None) -> bool:
+    """Registra los filtros en el plan. Devuelve False si ningún documento los cumple (no hay nada que buscar)."""
+    if query_filter is None:
+        return True
+    if query_filter.empty:
+        plan.decide("filters", f"ningún documento cumple los filtros: {query_filter.description}")
+        return False
+    plan.decide("filters", query_filter.description)
+    return True
+
+def _retrieve_context(query: str, retrieval_mode: str = None, plan: QueryPlan = None, query_filter: QueryFilter = None):
+    """
+    Ejecuta la parte de recuperación del RAG (expansión, búsqueda y re-ranking) y construye el contexto.
+    Las etapas opcionales se ejecutan o se omiten según el `QueryPlan`; con `query_filter`, las
+    búsquedas vectoriales y BM25 solo devuelven chunks de los documentos que cumplen los filtros.
+    Devuelve un dict con `context`, `sources` y `source_details`, o None si no hay contexto relevante.
+    """
+    retrieval_mode = _check_retrieval_mode(retrieval_mode)
+    plan = plan or QueryPlan()
+    if not _apply_filter(plan, query_filter):
+        print("Ningún documento cumple los filtros. Returning 'not found' message.")
+        return None
+    vector_filter = query_filter.vector_filter if query_filter is not None else None
+    top_k = plan.top_k
+    plan.decide("top_k", str(top_k))
+
+    # 1. Búsqueda con la consulta original y, según el plan, expansión de consulta con LLM
+    expand = _plan_expansion(retrieval_mode, plan)
+    dense_rankings = []
+    if expand is not True:
+        print("Paso 1: Búsqueda vectorial con la consulta original...")
+        with plan.stage("embedding"):
+            query_embedding = embed_texts(openai_client(), [query], model=plan.index.embedding_model)[0]
+        with plan.stage("vector_search"):
+            dense_rankings.append(vector_store().query(query_embedding, top_k=top_k, namespace=plan.index.namespace, filter=vector_filter))
+        if expand is None:
+            expand = _adaptive_expansion(plan, dense_rankings[0])
+
+    all_queries = [query]
+    if expand:
+        print("Paso 1b: Expansión de consulta con LLM...")
+        with plan.stage("expansion"):
+            all_queries += [q for q in _expand_query(query) if q != query]
+
+    # 2. Crear embeddings para las consultas aún no buscadas y buscarlas todas a la vez
+    pending_queries = all_queries[len(dense_rankings):]
+    if pending_queries:
+        with plan.stage("embedding"):
+            query_embeddings = embed_texts(openai_client(), pending_queries, model=plan.index.embedding_model)
+        print(f"Paso 2: Recuperación del índice vectorial con {len(pending_queries)} consultas...")
+        with plan.stage("vector_search"):
+            dense_rankings += vector_store().query_many(query_embeddings, top_k=top_k, namespace=plan.index.namespace, filter=vector_filter)
+
+    return _rank_and_build_context(query, all_queries, dense_rankings, retrieval_mode, plan, query_filter)
+
+def _rank_and_build_context(query: str, all_queries: list, dense_rankings: list, retrieval_mode: str, plan: QueryPlan,
+                            query_filter: QueryFilter = None):
+    """
+    Segunda mitad de `_retrieve_context`, una vez hechas las búsquedas vectoriales de todas las
+    consultas (`all_queries`, la original primero): BM25, fusión, re-ranking y construcción del contexto.
+    """
+    # 3. En los modos híbridos, BM25 por cada consulta (solo en los documentos filtrados); fusión RRF de todas las listas
+    lexical_rankings = []
+    if retrieval_mode != "dense":
+        document_ids = query_filter.document_ids if query_filter is not None else None
+        with plan.stage("bm25"):
+            lexical_rankings = [lexical_index_for(plan.index).search(q, top_k=plan.top_k, document_ids=document_ids) for q in all_queries]
+        print(f"BM25: {sum(len(r) for r in lexical_rankings)} resultados léxicos para {len(all_queries)} consultas.")
+    with plan.stage("hydration"):
+        all_matches = _fuse_candidates(dense_rankings, lexical_rankings, limit=plan.rerank_candidates, namespace=plan.index.namespace)
+
+    print(f"Recuperados {len(all_matches)} chunks únicos para re-ranking.")
     if not all_matches:
-        print("Context is empty after Pinecone search. Returning 'not found' message.")
-        print("--- RAG DEBUG END ---\n")
-        return {"answer": "La información no se encuentra en la base de conocimiento.", "sources": []}
-
-    # 4. Usar Cohere para re-rankear los resultados combinados
-    print("Paso 3: Re-ranking de precisión con Cohere...")
-    docs_to_rerank = [match.metadata.get('text', '') for match in all_matches]
-   
-    rerank_results = co_client.rerank(
-        #model='rerank-v3.5', # o 'rerank-multilingual-v3.0' si tienes documentos en varios idiomas
-        model='rerank-multilingual-v3.0', # o 'rerank-v3.5' si tenemos documentos solo en inglés
-        query=query,
-        documents=docs_to_rerank,
-        top_n=8 # Nos quedamos con los 8 mejores después del re-ranking
-    )
-    print("Resultados del re-ranking de Cohere recibidos.")
+        print("Context is empty after search. Returning 'not found' message.")
+        return None
+
+    # 4. Usar Cohere para re-rankear los resultados combinados (salvo que el plan lo omita)
+    skip_reason = None
+    dense_ids = {match.id for ranking in dense_rankings for match in ranking}
+    if plan.rerank == "adaptive" and _well_separated(all_matches, CONTEXT_CHUNKS, dense_ids):
+        skip_reason = "scores de similitud bien separados"
+    elif not plan.can_afford(settings.RAG_RERANK_COST_MS):
+        skip_reason = "presupuesto de latencia insuficiente"
+
+    if skip_reason:
+        plan.decide("rerank", f"omitido ({skip_reason}); se usan los {min(CONTEXT_CHUNKS, len(all_matches))} primeros candidatos")
+        ranked = [(index, None) for index in range(min(CONTEXT_CHUNKS, len(all_matches)))]
+    else:
+        plan.decide("rerank", f"aplicado sobre {len(all_matches)} candidatos")
+        print("Paso 3: Re-ranking de precisión con Cohere...")
+        docs_to_rerank = [match.metadata.get('text', '') for match in all_matches]
+
+        with plan.stage("rerank"):
+            rerank_results = cohere_client().rerank(
+                #model='rerank-v3.5', # o 'rerank-multilingual-v3.0' si tienes documentos en varios idiomas
+                model='rerank-multilingual-v3.0', # o 'rerank-v3.5' si tenemos documentos solo en inglés
+                query=query,
+                documents=docs_to_rerank,
+                top_n=CONTEXT_CHUNKS # Nos quedamos con los mejores después del re-ranking
+            )
+        print("Resultados del re-ranking de Cohere recibidos.")
+        ranked = [(rank.index, rank.relevance_score) for rank in rerank_results.results]
 
     # 5. Construir el contexto y recopilar las fuentes a partir de los resultados re-rankeados
     print("Paso 4: Construyendo contexto con los mejores chunks re-rankeados.")
 
-    context = ""
+    # Opcional: Podemos añadir un umbral al score del re-ranker si queremos ser aún más estrictos
+    selected = []
+    for index, relevance_score in ranked:
+        if relevance_score is not None and relevance_score < 0.6:
+            print(f"Descartando chunk con bajo score de re-ranking: {relevance_score:.4f}")
+            continue
+        selected.append(all_matches[index])
+
+    # Fusiona los chunks solapados del mismo documento, quita los pasajes repetidos y llena el presupuesto de tokens
+    with plan.stage("context"):
+        packed = pack_context(selected, max_tokens=settings.RAG_CONTEXT_MAX_TOKENS)
+    context = packed.text
+    plan.context_tokens = packed.tokens
+    QUERY_CONTEXT_TOKENS.observe(packed.tokens)
+    plan.decide(
+        "context",
+        f"{len(packed.passages)} pasajes de {packed.chunks}/{len(selected)} chunks, {packed.tokens}/{settings.RAG_CONTEXT_MAX_TOKENS} tokens"
+        + (" (recortado por el presupuesto)" if packed.truncated else "")
+    )
+
+    # Datos de cita de los documentos que llegaron al contexto, en una sola consulta
+    document_ids = list(dict.fromkeys(passage.document_id for passage in packed.passages))
+    with plan.stage("citations"):
+        citations = get_document_citations(document_ids)
+    metadata_by_document = {}
+    for match in selected:
+        metadata_by_document.setdefault(match.metadata.get('document_id'), match.metadata)
+
     sources = {}
     source_details_for_prompt = ""
+    for doc_id in document_ids:
+        # Los vectores antiguos traen los datos de cita en sus metadatos; el documento tiene prioridad.
+        citation = {**metadata_by_document.get(doc_id, {}), **citations.get(doc_id, {})}
+        publisher = citation.get('publisher') or 'N/A'
+        year = citation.get('publication_year')
+        title = citation.get('title') or 'Título no disponible'
 
-    # Iteramos sobre los resultados de Cohere, que están ordenados por relevancia
-    for rank in rerank_results.results:
-        # Usamos el índice del resultado re-rankeado para encontrar el documento original de la lista combinada
-        original_match = all_matches[rank.index]
-        
-        # Opcional: Podemos añadir un umbral al score del re-ranker si queremos ser aún más estrictos
-        if rank.relevance_score < 0.6:
-            print(f"Descartando chunk con bajo score de re-ranking: {rank.relevance_score:.4f}")
-            continue
+        sources[doc_id] = {
+            "id": doc_id,
+            "title": title,
+            "publisher": publisher,
+            "publication_year": str(year) if year else 's.f.',
+            "source_url": citation.get('source_url')
+        }
+        # Crear una referencia para el prompt
+        year_str = str(year) if year else 's.f.'
+        source_details_for_prompt += f"- {publisher} ({year_str}). *{title}*.\n"
 
-        context += original_match.metadata.get('text', '') + "\n\n"
-        doc_id = original_match.metadata.get('document_id')
-
-        if doc_id not in sources:
-            publisher = original_match.metadata.get('publisher', 'N/A')
-            year = original_match.metadata.get('publication_year')
-            title = original_match.metadata.get('title', 'Título no disponible')
-
-            sources[doc_id] = {
-                "id": doc_id,
-                "title": title,
-                "publisher": publisher,
-                "publication_year": str(year) if year else 's.f.',
-                "source_url": original_match.metadata.get('source_url')
-            }
-            # Crear una referencia para el prompt
-            year_str = str(year) if year else 's.f.'
-            source_details_for_prompt += f"- {publisher} ({year_str}). *{title}*.\n"
-
-    
-    print(f"Constructed context length: {len(context)} characters")
+    print(f"Constructed context: {len(context)} characters, {packed.tokens} tokens")
     print(f"Found {len(sources)} unique sources.")
 
-    # Si el contexto sigue vacío después del bucle, devolvemos la respuesta directamente.
+    # Si el contexto sigue vacío, no hay nada con qué responder.
     if not context:
         print("Context is empty. Returning 'not found' message.")
-        print("--- RAG DEBUG END ---\n")
-        return {"answer": "La información no se encuentra en la base de conocimiento.", "sources": []}
+        return None
 
-    # 6. Construir el prompt para el LLM
+    return {"context": context, "context_tokens": packed.tokens, "sources": list(sources.values()), "source_details": source_details_for_prompt}
+
+def _build_prompt(query: str, retrieval: dict) -> str:
+    """Construye el prompt final para el LLM a partir del contexto recuperado."""
+    context = retrieval["context"]
+    source_details_for_prompt = retrieval["source_details"]
     prompt_template = f"""
     Eres un asistente de investigación experto. Tu tarea es responder a la pregunta del usuario basándote únicamente en el contexto y las fuentes proporcionadas.
     INSTRUCCIONES:
@@ -141,16 +550,148 @@ def perform_rag_query(query: str):
 
     PREGUNTA: {query}
     """
+    return prompt_template
+
+def _run_rag_pipeline(query: str, retrieval_mode: str = None, plan: QueryPlan = None, query_filter: QueryFilter = None):
+    """
+    Orquesta el proceso de Retrieval-Augmented Generation (RAG).
+    """
+    print("\n--- RAG DEBUG START ---")
+    print(f"Query: '{query}'")
 
-    # 7. Generar la respuesta final con el LLM
+    plan = plan or QueryPlan()
+    retrieval = _retrieve_context(query, retrieval_mode, plan, query_filter)
+    if retrieval is None:
+        print("--- RAG DEBUG END ---\n")
+        return {"answer": NOT_FOUND_ANSWER, "sources": []}
+
+    answer = _generate_answer(query, retrieval, plan)
+    print("--- RAG DEBUG END ---\n")
+
+    return {"answer": answer, "sources": retrieval["sources"]}
+
+def _generate_answer(query: str, retrieval: dict, plan: QueryPlan) -> str:
+    """Genera la respuesta final con el LLM a partir del contexto recuperado."""
     print("Sending prompt to LLM...")
-    final_response = client_openai.chat.completions.create(
-        model="gpt-3.5-turbo",
-        messages=[{"role": "system", "content": prompt_template}],
-        temperature=0.1
-    )
+    with plan.stage("generation"):
+        final_response = openai_client().chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=[{"role": "system", "content": _build_prompt(query, retrieval)}],
+            temperature=0.1
+        )
+    record_usage("gpt-3.5-turbo", getattr(final_response, "usage", None))
     answer = final_response.choices[0].message.content
     print(f"LLM Answer: {answer}")
-    print("--- RAG DEBUG END ---\n")
+    return answer
+
+# --- Consultas por lotes (/query/batch) ---
+
+def _record_shared_stage(plans: List[QueryPlan], name: str, started: float):
+    """Registra en cada consulta del lote la duración de una etapa que compartieron."""
+    seconds = time.perf_counter() - started
+    for plan in plans:
+        plan.record(name, seconds)
+
+def _batch_vector_search(pairs: list, plans: List[QueryPlan], dense_rankings: dict, vector_filter: dict = None):
+    """Embebe con una sola llamada las consultas (índice de la pregunta, consulta) de `pairs` y las busca todas a la vez."""
+    if not pairs:
+        return {}
+    involved = [plans[i] for i in dict.fromkeys(i for i, _ in pairs)]
+    started = time.perf_counter()
+    embeddings = embed_texts(openai_client(), [q for _, q in pairs], model=plans[0].index.embedding_model)
+    _record_shared_stage(involved, "embedding", started)
+    started = time.perf_counter()
+    rankings = vector_store().query_many(embeddings, top_k=plans[0].top_k, namespace=plans[0].index.namespace, filter=vector_filter)
+    _record_shared_stage(involved, "vector_search", started)
+    for (i, _), ranking in zip(pairs, rankings):
+        dense_rankings[i].append(ranking)
+    return {i: embedding for (i, _), embedding in zip(pairs, embeddings)}
+
+def perform_rag_batch(queries: List[str], retrieval_mode: str = None, quality_tier: str = None, latency_budget_ms: int = None,
+                      include_timings: bool = False, generate: bool = True, filters: dict = None) -> List[dict]:
+    """
+    Responde varias consultas con las mismas opciones que `perform_rag_query`, compartiendo las
+    llamadas que admiten lotes: los embeddings de todas las consultas (originales y expandidas)
+    se piden juntos, las búsquedas vectoriales se lanzan a la vez, la expansión con el LLM es una
+    sola llamada y el re-ranking y la generación de cada consulta corren en paralelo
+    (RAG_BATCH_CONCURRENCY). Con `generate=False` solo se recupera: cada resultado trae las fuentes
+    y el contexto, sin respuesta. Los `filters` se aplican a todas las consultas del lote. Un error
+    en una consulta se devuelve en su `error` sin afectar al resto.
+    """
+    retrieval_mode = _check_retrieval_mode(retrieval_mode)
+    plans = [QueryPlan(quality_tier, latency_budget_ms, include_timings) for _ in queries]
+    for plan in plans[1:]:
+        plan.index = plans[0].index # Todo el lote busca en la misma versión del índice
+    results = [None] * len(queries)
+    started = time.perf_counter()
+    query_filter = build_query_filter(filters, lexical=retrieval_mode != "dense") if filters else None
+    if query_filter is not None:
+        _record_shared_stage(plans, "filters", started)
+    scope = _cache_scope(plans[0], retrieval_mode, query_filter)
+    vector_filter = query_filter.vector_filter if query_filter is not None else None
+
+    # 0. Las preguntas ya respondidas con el corpus actual se sirven desde la caché de respuestas
+    version = answer_cache.version
+    pending = []
+    for i, query in enumerate(queries):
+        cached = answer_cache.get(query, scope=scope) if generate else None
+        if generate:
+            record_cache("answer", hits=int(cached is not None), misses=int(cached is None))
+        if cached is not None:
+            results[i] = {"query": query, **_from_cache(cached, plans[i], "query_batch")}
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+    print(f"BATCH QUERY: {len(pending)} consultas por resolver ({len(queries) - len(pending)} desde la caché).")
+    if not all([_apply_filter(plans[i], query_filter) for i in pending]):
+        # Ningún documento cumple los filtros: no hay nada que buscar
+        for i in pending:
+            result = {"answer": NOT_FOUND_ANSWER, "sources": []} if generate else {"sources": [], "context": None}
+            results[i] = {"query": queries[i], **plans[i].annotate(result, "query_batch")}
+        return results
+
+    # 1. Primera búsqueda de las consultas originales (salvo las que se expanden siempre)
+    expand = {i: _plan_expansion(retrieval_mode, plans[i]) for i in pending}
+    all_queries = {i: [queries[i]] for i in pending}
+    dense_rankings = {i: [] for i in pending}
+    for i in pending:
+        plans[i].decide("top_k", str(plans[i].top_k))
+    query_embeddings = _batch_vector_search([(i, queries[i]) for i in pending if expand[i] is not True], plans, dense_rankings, vector_filter)
+    for i in pending:
+        if expand[i] is None:
+            expand[i] = _adaptive_expansion(plans[i], dense_rankings[i][0])
+
+    # 2. Expansión de todas las consultas que la necesitan, en una sola llamada al LLM
+    to_expand = [i for i in pending if expand[i]]
+    if to_expand:
+        started = time.perf_counter()
+        for i, variants in zip(to_expand, _expand_queries([queries[i] for i in to_expand])):
+            all_queries[i] += [q for q in variants if q != queries[i]]
+        _record_shared_stage([plans[i] for i in to_expand], "expansion", started)
+
+    # 3. Embeddings y búsquedas de las consultas aún no buscadas, todas juntas
+    _batch_vector_search([(i, q) for i in pending for q in all_queries[i][len(dense_rankings[i]):]], plans, dense_rankings, vector_filter)
+
+    # 4. BM25, fusión, re-ranking, contexto y (opcionalmente) respuesta de cada consulta, en paralelo
+    def finish(i: int) -> dict:
+        query, plan = queries[i], plans[i]
+        try:
+            retrieval = _rank_and_build_context(query, all_queries[i], dense_rankings[i], retrieval_mode, plan, query_filter)
+            if not generate:
+                result = {"sources": retrieval["sources"] if retrieval else [], "context": retrieval["context"] if retrieval else None}
+            elif retrieval is None:
+                result = {"answer": NOT_FOUND_ANSWER, "sources": []}
+            else:
+                result = {"answer": _generate_answer(query, retrieval, plan), "sources": retrieval["sources"]}
+            if generate:
+                answer_cache.put(query, dict(result), query_embeddings.get(i), version=version, scope=scope)
+            return {"query": query, **plan.annotate(result, "query_batch")}
+        except Exception as e:
+            print(f"BATCH QUERY: Error en la consulta '{query}': {e}")
+            return {"query": query, "sources": [], "error": str(e)}
 
-    return {"answer": answer, "sources": list(sources.values())}
+    with ThreadPoolExecutor(max_workers=settings.RAG_BATCH_CONCURRENCY, thread_name_prefix="query-batch") as executor:
+        for i, result in zip(pending, executor.map(finish, pending)):
+            results[i] = result
+    return results
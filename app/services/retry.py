@@ -0,0 +1,47 @@
+import random
+import time
+
+import httpx
+import openai
+
+from app.core.config import settings
+
+# Códigos HTTP que indican un fallo pasajero del servicio: límite de peticiones y errores del servidor
+TRANSIENT_STATUS_CODES = {408, 429}
+
+
+def is_transient_error(error: Exception) -> bool:
+    """
+    Indica si vale la pena reintentar ante `error`: timeouts, errores de conexión, 429 y 5xx.
+    Cubre las excepciones de OpenAI y httpx y, para Pinecone, Cloudinary o Cohere, el código HTTP
+    que adjuntan a la excepción (`status_code`, `status` o `http_code`).
+    """
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError, httpx.TimeoutException, httpx.NetworkError)):
+        return True
+    for attribute in ("status_code", "status", "http_code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status in TRANSIENT_STATUS_CODES or status >= 500
+    return False
+
+
+def call_with_retries(fn, *args, stage: str, attempts: int = None, base_delay: float = None, **kwargs):
+    """
+    Ejecuta `fn(*args, **kwargs)` reintentando los fallos transitorios (ver `is_transient_error`) con
+    backoff exponencial y jitter. Pensado para las etapas de red del pipeline (Cloudinary, OpenAI,
+    Pinecone), donde un fallo transitorio no debería hacer fallar todo el documento; cualquier otro
+    error (credenciales, petición inválida, PDF corrupto) se propaga enseguida.
+    """
+    attempts = attempts or settings.STAGE_RETRY_ATTEMPTS
+    base_delay = settings.STAGE_RETRY_BASE_SECONDS if base_delay is None else base_delay
+    for attempt in range(1, attempts + 1):
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            if attempt == attempts or not is_transient_error(e):
+                raise
+            delay = base_delay * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5)
+            print(f"RETRY: Etapa '{stage}' falló (intento {attempt}/{attempts}): {e}. Reintentando en {delay:.1f}s...")
+            time.sleep(delay)
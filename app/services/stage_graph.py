@@ -0,0 +1,64 @@
+"""
+Ejecución de un pipeline como grafo de etapas: cada etapa empieza en cuanto terminan sus
+dependencias, de modo que las etapas independientes (p. ej. las llamadas de red de la ingesta)
+corren a la vez, cada una en su propio hilo.
+"""
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Tuple
+
+
+class Stage(NamedTuple):
+    name: str
+    run: Callable[..., Any] # Recibe los resultados de sus dependencias como argumentos con nombre
+    after: Tuple[str, ...] = ()
+    optional: bool = False # Si falla, el grafo sigue: sus dependientes reciben None
+
+
+class StageGraphResult(NamedTuple):
+    results: Dict[str, Any]
+    statuses: Dict[str, str] # Etapa -> 'completed' | 'failed'
+    errors: Dict[str, Exception] # Errores de las etapas opcionales que fallaron
+
+
+def run_stage_graph(stages: Iterable[Stage]) -> StageGraphResult:
+    """
+    Ejecuta las etapas respetando sus dependencias. Si falla una etapa obligatoria no se inician
+    más etapas, se espera a que terminen las que están en curso y se propaga su excepción.
+    """
+    stages = {stage.name: stage for stage in stages}
+    for stage in stages.values():
+        unknown = [name for name in stage.after if name not in stages]
+        if unknown:
+            raise ValueError(f"La etapa '{stage.name}' depende de etapas inexistentes: {unknown}")
+
+    results, statuses, errors = {}, {}, {}
+    running = {} # Future -> nombre de la etapa
+    error = None
+    with ThreadPoolExecutor(max_workers=max(len(stages), 1), thread_name_prefix="stage") as executor:
+        while True:
+            if error is None:
+                started = set(running.values())
+                for stage in stages.values():
+                    if stage.name in statuses or stage.name in started:
+                        continue
+                    if all(name in statuses for name in stage.after):
+                        running[executor.submit(stage.run, **{name: results.get(name) for name in stage.after})] = stage.name
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    statuses[name] = "completed"
+                except Exception as e:
+                    statuses[name] = "failed"
+                    if stages[name].optional:
+                        errors[name] = e
+                    elif error is None:
+                        error = e
+    if error is not None:
+        raise error
+    if len(statuses) < len(stages):
+        raise ValueError(f"Dependencias circulares entre las etapas: {sorted(set(stages) - set(statuses))}")
+    return StageGraphResult(results, {name: statuses[name] for name in stages}, errors)
@@ -0,0 +1,207 @@
+"""
+Caché en memoria del estado de ingesta de los documentos, para la API.
+
+La ingesta corre en los procesos worker, que registran cada cambio de estado o de etapa en la
+tabla de documentos (`status_updated_at`). En lugar de que cada cliente consulte la base de datos
+por cada documento, un único hilo de la API lee cada STATUS_POLL_SECONDS los cambios recientes
+(una consulta sobre un índice) y:
+  - mantiene la caché con la que se responde `/documents/status?ids=...` y `/documents/{id}/status`,
+  - publica cada transición a los clientes conectados a `/documents/status/stream` (SSE).
+El hilo solo consulta la base de datos mientras hay clientes conectados o documentos en proceso.
+Sin él, una entrada en caché no ve los cambios que hagan otros procesos (reingestas, borrados,
+fallos), así que solo se da por buena durante STATUS_POLL_SECONDS desde que se leyó o desde la
+última consulta de cambios que la cubre; pasado ese tiempo se vuelve a leer.
+"""
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.crud import get_document_statuses, get_document_status_changes
+
+# Margen con el que se vuelven a leer los cambios: un cambio confirmado justo después de una lectura
+# puede llevar una fecha algo anterior a la última vista. Los repetidos se descartan.
+POLL_OVERLAP = timedelta(seconds=5)
+
+
+def _entry(row) -> dict:
+    updated_at = row.status_updated_at
+    return {
+        "id": row.id,
+        "status": row.status,
+        "stage": row.ingestion_stage,
+        "updated_at": updated_at.isoformat() if updated_at is not None else None,
+    }
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Formatea un evento Server-Sent Events con payload JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class DocumentStatusCache:
+    def __init__(self, poll_seconds: float, max_items: int):
+        self.poll_seconds = poll_seconds
+        self.max_items = max_items
+        self._entries = OrderedDict() # id -> {"id", "status", "stage", "updated_at"}
+        self._lock = threading.Lock()
+        self._subscribers = {} # asyncio.Queue -> (event loop, ids o None para todos)
+        self._processing = set() # Documentos en caché con status 'processing'
+        self._checked_at = {} # id -> instante (monotonic) en que se leyó de la base de datos
+        self._watermark = None # Mayor status_updated_at leído
+        self._synced_since = None # Inicio de la primera consulta de cambios: desde ahí no se pierde ninguno
+        self._polled_at = None # Inicio de la última consulta de cambios correcta
+        self._poller = None
+        self.polls = 0
+
+    def _start(self):
+        # El hilo se crea al primer uso (la caché solo se usa en el proceso de la API).
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, name="status-poller", daemon=True)
+                self._poller.start()
+
+    def _is_fresh(self, document_id: int, now: float) -> bool:
+        # Llamar con el lock tomado
+        confirmed_at = self._checked_at[document_id]
+        if self._synced_since is not None and self._synced_since <= confirmed_at:
+            # Las consultas de cambios cubren todo lo ocurrido desde que se leyó
+            confirmed_at = max(confirmed_at, self._polled_at)
+        return now - confirmed_at <= self.poll_seconds
+
+    def get_many(self, document_ids: Iterable[int]) -> Dict[int, dict]:
+        """
+        Estado de los documentos indicados; los que no están en caché, o cuya entrada ya no está al
+        día, se leen en una sola consulta.
+        """
+        self._start()
+        found, missing = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for document_id in dict.fromkeys(document_ids):
+                entry = self._entries.get(document_id)
+                if entry is None or not self._is_fresh(document_id, now):
+                    missing.append(document_id)
+                else:
+                    self._entries.move_to_end(document_id)
+                    found[document_id] = entry
+        if missing:
+            db = SessionLocal()
+            try:
+                rows = get_document_statuses(db, missing)
+            finally:
+                db.close()
+            read = set()
+            for row in rows:
+                found[row.id] = self.update(_entry(row), checked_at=now)
+                read.add(row.id)
+            for document_id in set(missing) - read:
+                # Ya no existe (p. ej. lo eliminó otro proceso)
+                self.forget(document_id)
+        return found
+
+    def update(self, entry: dict, checked_at: Optional[float] = None) -> dict:
+        """
+        Guarda el estado de un documento, leído de la base de datos en `checked_at` (ahora si se omite),
+        y, si cambió, lo publica a los suscriptores.
+        """
+        with self._lock:
+            previous = self._entries.get(entry["id"])
+            checked_at = time.monotonic() if checked_at is None else checked_at
+            self._checked_at[entry["id"]] = max(checked_at, self._checked_at.get(entry["id"], checked_at))
+            changed = previous is None or (previous["status"], previous["stage"]) != (entry["status"], entry["stage"])
+            if previous is not None and not changed:
+                return previous
+            self._entries[entry["id"]] = entry
+            self._entries.move_to_end(entry["id"])
+            if entry["status"] == "processing":
+                self._processing.add(entry["id"])
+            else:
+                self._processing.discard(entry["id"])
+            while len(self._entries) > self.max_items:
+                evicted, _ = self._entries.popitem(last=False)
+                self._processing.discard(evicted)
+                self._checked_at.pop(evicted, None)
+            subscribers = list(self._subscribers.items())
+        for queue, (loop, document_ids) in subscribers:
+            if document_ids is None or entry["id"] in document_ids:
+                try:
+                    loop.call_soon_threadsafe(queue.put_nowait, entry)
+                except RuntimeError:  # El bucle del cliente ya se cerró
+                    self.unsubscribe(queue)
+        return entry
+
+    def mark_queued(self, document_ids: Iterable[int]):
+        """Registra documentos recién encolados por este proceso, sin esperar a la siguiente lectura."""
+        now = datetime.now(timezone.utc).isoformat()
+        for document_id in document_ids:
+            self.update({"id": document_id, "status": "processing", "stage": "queued", "updated_at": now})
+
+    def forget(self, document_id: int):
+        """Quita de la caché un documento eliminado, para que no se siga respondiendo con su último estado."""
+        with self._lock:
+            self._entries.pop(document_id, None)
+            self._processing.discard(document_id)
+            self._checked_at.pop(document_id, None)
+
+    def subscribe(self, document_ids: Optional[Iterable[int]] = None) -> asyncio.Queue:
+        """Suscribe al bucle de eventos actual a los cambios de `document_ids` (o de todos los documentos)."""
+        self._start()
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[queue] = (asyncio.get_running_loop(), set(document_ids) if document_ids is not None else None)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+    def _should_poll(self) -> bool:
+        with self._lock:
+            return bool(self._subscribers or self._processing)
+
+    def _poll_once(self):
+        # Tras un periodo sin consultas se sigue desde la última marca leída, no desde ahora: así se
+        # recogen también los cambios ocurridos mientras tanto.
+        started, started_wall = time.monotonic(), datetime.now(timezone.utc)
+        since = (self._watermark or started_wall) - POLL_OVERLAP
+        db = SessionLocal()
+        try:
+            rows = get_document_status_changes(db, since)
+        finally:
+            db.close()
+        self.polls += 1
+        for row in rows:
+            self.update(_entry(row), checked_at=started)
+            updated_at = row.status_updated_at
+            if updated_at.tzinfo is None:  # SQLite no guarda la zona horaria; se escribe en UTC (crud._utcnow)
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            if self._watermark is None or updated_at > self._watermark:
+                self._watermark = updated_at
+        if self._watermark is None:
+            # Sin cambios en la primera consulta: la siguiente sigue desde aquí
+            self._watermark = started_wall
+        with self._lock:
+            if self._synced_since is None:
+                self._synced_since = started
+            self._polled_at = started
+
+    def _poll_loop(self):
+        while True:
+            try:
+                if self._should_poll():
+                    self._poll_once()
+            except Exception as e:
+                print(f"STATUS CACHE: Error al consultar los cambios de estado: {e}")
+            time.sleep(self.poll_seconds)
+
+
+status_cache = DocumentStatusCache(
+    poll_seconds=settings.STATUS_POLL_SECONDS,
+    max_items=settings.STATUS_CACHE_MAX_ITEMS,
+)
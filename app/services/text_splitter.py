@@ -0,0 +1,101 @@
+"""
+Splitter recursivo de texto por caracteres que devuelve posiciones en lugar de cadenas.
+
+Reproduce el algoritmo de `RecursiveCharacterTextSplitter` de LangChain con su configuración por
+defecto (separador al inicio de cada trozo, longitud en caracteres, espacios recortados en los
+bordes), así que genera exactamente los mismos chunks (ver benchmarks/chunking.py), pero trabaja
+sobre intervalos (inicio, fin) del texto original: no copia ni concatena cadenas mientras parte y
+fusiona, y la posición de cada chunk sale del propio algoritmo en vez de buscarse después con `find`
+(que, con texto repetido, puede dar con una aparición anterior).
+"""
+import re
+from typing import List, Sequence, Tuple
+
+Span = Tuple[int, int] # (inicio, fin) en el texto
+
+
+class RecursiveSplitter:
+    def __init__(self, chunk_size: int, chunk_overlap: int, separators: Sequence[str]):
+        if chunk_overlap > chunk_size:
+            raise ValueError(f"chunk_overlap ({chunk_overlap}) no puede ser mayor que chunk_size ({chunk_size}).")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators)
+        self._patterns = {separator: re.compile(re.escape(separator)) for separator in self.separators if separator}
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[start:end] for start, end in self.split_spans(text)]
+
+    def split_spans(self, text: str) -> List[Span]:
+        """Intervalos (inicio, fin) de los chunks de `text`, en orden."""
+        spans = []
+        self._split(text, 0, len(text), self.separators, spans)
+        return spans
+
+    def _split(self, text: str, start: int, end: int, separators: List[str], spans: List[Span]):
+        # Primer separador que aparece en el intervalo; "" parte carácter a carácter
+        separator, remaining = separators[-1], []
+        for i, candidate in enumerate(separators):
+            if not candidate:
+                separator = candidate
+                break
+            if self._patterns[candidate].search(text, start, end):
+                separator, remaining = candidate, separators[i + 1:]
+                break
+
+        good = []
+        for piece in self._pieces(text, start, end, separator):
+            if piece[1] - piece[0] < self.chunk_size:
+                good.append(piece)
+                continue
+            if good:
+                self._merge(text, good, spans)
+                good = []
+            if remaining:
+                self._split(text, piece[0], piece[1], remaining, spans)
+            else:
+                spans.append(piece)
+        if good:
+            self._merge(text, good, spans)
+
+    def _pieces(self, text: str, start: int, end: int, separator: str) -> List[Span]:
+        """Trozos contiguos del intervalo; cada uno empieza por el separador que lo precede."""
+        if not separator:
+            return [(i, i + 1) for i in range(start, end)]
+        if separator not in self._patterns:
+            self._patterns[separator] = re.compile(re.escape(separator))
+        pieces, previous = [], start
+        for match in self._patterns[separator].finditer(text, start, end):
+            if match.start() > previous:
+                pieces.append((previous, match.start()))
+            previous = match.start()
+        if end > previous:
+            pieces.append((previous, end))
+        return pieces
+
+    def _merge(self, text: str, pieces: List[Span], spans: List[Span]):
+        """
+        Agrupa trozos contiguos en chunks de hasta chunk_size caracteres; cada chunk nuevo repite
+        los últimos trozos del anterior que caben en chunk_overlap.
+        """
+        first, total = 0, 0 # Trozos del chunk en curso: pieces[first:i]
+        for i, (start, end) in enumerate(pieces):
+            length = end - start
+            if total + length > self.chunk_size and i > first:
+                self._emit(text, pieces[first][0], pieces[i - 1][1], spans)
+                while total > self.chunk_overlap or (total + length > self.chunk_size and total > 0):
+                    total -= pieces[first][1] - pieces[first][0]
+                    first += 1
+            total += length
+        if first < len(pieces):
+            self._emit(text, pieces[first][0], pieces[-1][1], spans)
+
+    @staticmethod
+    def _emit(text: str, start: int, end: int, spans: List[Span]):
+        # Sin los espacios de los bordes; los chunks que solo tienen espacios se descartan
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if end > start:
+            spans.append((start, end))
@@ -0,0 +1,43 @@
+import threading
+
+import tiktoken
+
+# Codificación usada por text-embedding-3-* y por los modelos gpt-3.5/gpt-4.
+ENCODING_NAME = "cl100k_base"
+
+_encoding = None
+_encoding_failed = False
+_lock = threading.Lock()
+
+
+def _get_encoding():
+    """Carga la codificación de tiktoken una sola vez; si no está disponible (p. ej. sin red), devuelve None."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        with _lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    _encoding = tiktoken.get_encoding(ENCODING_NAME)
+                except Exception as e:
+                    print(f"TOKENIZER: No se pudo cargar '{ENCODING_NAME}', se usará una estimación. Error: {e}")
+                    _encoding_failed = True
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Número de tokens de `text` (estimación de ~4 caracteres por token si tiktoken no está disponible)."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta `text` para que no supere `max_tokens` tokens."""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max(max_tokens - 1, 0) * 4] # Coherente con la estimación de `count_tokens`
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -0,0 +1,65 @@
+"""
+Archivos subidos: se copian por bloques a UPLOAD_DIR (calculando el sha256 por el camino), sin
+cargarlos enteros en memoria, y ahí se quedan hasta que su trabajo de ingesta termina; el worker
+abre el PDF directamente desde esa ruta.
+"""
+import hashlib
+import os
+import uuid
+from typing import BinaryIO, NamedTuple
+
+from app.core.config import settings
+
+
+class UploadTooLargeError(ValueError):
+    """El archivo supera UPLOAD_MAX_BYTES."""
+
+
+class SpooledUpload(NamedTuple):
+    path: str
+    content_hash: str # sha256 del contenido
+    size: int
+    head: bytes # Primeros bytes, para reconocer el tipo de archivo (ver `is_pdf`)
+
+
+def is_pdf(head: bytes) -> bool:
+    return head[:5] == b"%PDF-"
+
+
+def remove_upload(file_path: str):
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def spool_fileobj(source: BinaryIO, max_bytes: int = None, suffix: str = ".pdf") -> SpooledUpload:
+    """
+    Copia `source` a un archivo nuevo de UPLOAD_DIR por bloques de UPLOAD_SPOOL_CHUNK_BYTES.
+    Si supera `max_bytes` (por defecto UPLOAD_MAX_BYTES) se borra lo copiado y se lanza UploadTooLargeError.
+    """
+    max_bytes = settings.UPLOAD_MAX_BYTES if max_bytes is None else max_bytes
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    file_path = os.path.join(settings.UPLOAD_DIR, f"{uuid.uuid4().hex}{suffix}")
+    partial_path = file_path + ".part" # Un archivo a medio copiar nunca tiene el nombre definitivo
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        with open(partial_path, "wb") as f:
+            while True:
+                block = source.read(settings.UPLOAD_SPOOL_CHUNK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"El archivo supera el tamaño máximo de {max_bytes / (1024 * 1024):g} MB.")
+                if len(head) < 8:
+                    head += block[:8 - len(head)]
+                digest.update(block)
+                f.write(block)
+        os.replace(partial_path, file_path)
+    except BaseException:
+        remove_upload(partial_path)
+        raise
+    return SpooledUpload(file_path, digest.hexdigest(), size, head)
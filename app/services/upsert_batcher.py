@@ -0,0 +1,85 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List
+
+
+class SharedUpsertBatcher:
+    """
+    Agrupa en lotes compartidos los lotes de chunks de varios documentos que se ingieren a la vez
+    en el mismo proceso (p. ej. los documentos de una subida masiva), para que los documentos
+    pequeños no generen cada uno su propia petición de embeddings y su propia subida al índice.
+
+    `submit` devuelve un Future por lote enviado. Un grupo se envía al `handler` en cuanto alcanza
+    `max_tokens` o `max_items`, o cuando su lote más antiguo lleva `linger_seconds` esperando.
+    El `handler` recibe la lista de lotes del grupo; si falla, fallan todos los Futures del grupo.
+    """
+
+    def __init__(self, handler: Callable[[List[object]], None], max_tokens: int, max_items: int, linger_seconds: float, concurrency: int):
+        self.handler = handler
+        self.max_tokens = max_tokens
+        self.max_items = max_items
+        self.linger_seconds = linger_seconds
+        self.concurrency = concurrency
+        self._pending = [] # (lote, Future)
+        self._pending_tokens = 0
+        self._pending_items = 0
+        self._oldest = None
+        self._cond = threading.Condition()
+        self._executor = None
+        self._flusher = None
+
+    def submit(self, batch: object, tokens: int, items: int) -> Future:
+        future = Future()
+        with self._cond:
+            self._start()
+            if self._pending and (self._pending_tokens + tokens > self.max_tokens or self._pending_items + items > self.max_items):
+                self._flush()
+            self._pending.append((batch, future))
+            self._pending_tokens += tokens
+            self._pending_items += items
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._pending_tokens >= self.max_tokens or self._pending_items >= self.max_items:
+                self._flush()
+            else:
+                self._cond.notify()
+        return future
+
+    def _start(self):
+        # Se crean al primer uso: el módulo se importa también en procesos que no ingieren (la API).
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed-upsert")
+            self._flusher = threading.Thread(target=self._flush_expired, name="upsert-batcher", daemon=True)
+            self._flusher.start()
+
+    def _flush(self):
+        group = self._pending
+        self._pending, self._pending_tokens, self._pending_items, self._oldest = [], 0, 0, None
+        self._executor.submit(self._run, group)
+
+    def _flush_expired(self):
+        with self._cond:
+            while True:
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                remaining = self._oldest + self.linger_seconds - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                else:
+                    self._flush()
+
+    def _run(self, group):
+        # Los lotes cancelados (su documento ya falló) se descartan del grupo.
+        group = [(batch, future) for batch, future in group if future.set_running_or_notify_cancel()]
+        if not group:
+            return
+        try:
+            self.handler([batch for batch, _ in group])
+        except BaseException as e:
+            for _, future in group:
+                future.set_exception(e)
+        else:
+            for _, future in group:
+                future.set_result(None)
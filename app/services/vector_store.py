@@ -0,0 +1,744 @@
+"""
+Abstracción del índice vectorial.
+
+`get_vector_store()` devuelve la implementación configurada en `VECTOR_STORE_BACKEND`:
+  - "pinecone": el índice de Pinecone (`PINECONE_INDEX_NAME`).
+  - "local": vectores en una matriz memory-mapped en disco (float32, float16 o int8 cuantizado)
+    con los metadatos en una tabla SQLite; la búsqueda top-k es un producto matricial vectorizado.
+Ambas exponen la misma interfaz (upsert, query, query_many, fetch, delete, delete_by_document, delete_namespace)
+y devuelven `VectorMatch`, con los mismos atributos (`id`, `score`, `metadata`) que los matches de Pinecone.
+"""
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+
+
+@dataclass
+class VectorMatch:
+    id: str
+    score: float = 0.0
+    metadata: dict = field(default_factory=dict)
+    values: Optional[List[float]] = None
+
+
+def matches_filter(metadata: dict, filter: Optional[dict]) -> bool:
+    """
+    Evalúa un filtro de metadatos con la sintaxis de Pinecone ($eq, $ne, $in, $nin, $gt, $gte,
+    $lt, $lte, $and, $or; un valor simple equivale a $eq). Los campos lista cumplen $eq/$in si
+    alguno de sus elementos coincide.
+    """
+    if not filter:
+        return True
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        values = value if isinstance(value, list) else [value]
+        for op, expected in condition.items():
+            if op == "$eq":
+                ok = expected in values
+            elif op == "$ne":
+                ok = expected not in values
+            elif op == "$in":
+                ok = any(v in expected for v in values)
+            elif op == "$nin":
+                ok = not any(v in expected for v in values)
+            elif op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None or isinstance(value, list):
+                    return False
+                try:
+                    ok = {
+                        "$gt": value > expected,
+                        "$gte": value >= expected,
+                        "$lt": value < expected,
+                        "$lte": value <= expected,
+                    }[op]
+                except TypeError:
+                    return False
+            else:
+                raise ValueError(f"Operador de filtro no soportado: {op}")
+            if not ok:
+                return False
+    return True
+
+
+def _with_sets(filter):
+    """Copia del filtro con las listas de $in/$nin como conjuntos, para evaluarlo fila a fila sin recorrerlas."""
+    if isinstance(filter, dict):
+        return {key: frozenset(value) if key in ("$in", "$nin") else _with_sets(value) for key, value in filter.items()}
+    if isinstance(filter, list):
+        return [_with_sets(sub) for sub in filter]
+    return filter
+
+
+class VectorStore(ABC):
+    """Interfaz común de los índices vectoriales."""
+
+    @abstractmethod
+    def upsert(self, vectors: List[dict], namespace: str = "default"):
+        """Inserta o reemplaza vectores `{"id", "values", "metadata"}`."""
+
+    @abstractmethod
+    def query(self, vector: Sequence[float], top_k: int = 10, namespace: str = "default", filter: Optional[dict] = None) -> List[VectorMatch]:
+        """Devuelve los `top_k` vectores más similares (similitud coseno), con sus metadatos."""
+
+    def query_many(self, vectors: Sequence[Sequence[float]], top_k: int = 10, namespace: str = "default", filter: Optional[dict] = None) -> List[List[VectorMatch]]:
+        """Ejecuta varias búsquedas; por defecto una tras otra."""
+        return [self.query(v, top_k=top_k, namespace=namespace, filter=filter) for v in vectors]
+
+    @abstractmethod
+    def fetch(self, ids: Sequence[str], namespace: str = "default") -> Dict[str, VectorMatch]:
+        """Recupera vectores por id (los que no existen se omiten)."""
+
+    @abstractmethod
+    def list_ids(self, prefix: str, namespace: str = "default") -> List[str]:
+        """IDs de los vectores que empiezan por `prefix` (p. ej. `doc_{id}_`, los de un documento)."""
+
+    @abstractmethod
+    def delete(self, ids: Sequence[str], namespace: str = "default"):
+        """Elimina vectores por id."""
+
+    @abstractmethod
+    def delete_by_document(self, document_id: int, namespace: str = "default"):
+        """Elimina todos los vectores de un documento."""
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str):
+        """Elimina todos los vectores de un namespace (versiones del índice retiradas)."""
+
+
+class PineconeVectorStore(VectorStore):
+    def __init__(self, index_name: str):
+        from pinecone import Pinecone
+
+        self.index_name = index_name
+        self.index = Pinecone(api_key=settings.PINECONE_API_KEY).Index(index_name)
+
+    def upsert(self, vectors: List[dict], namespace: str = "default"):
+        # Subir a Pinecone en lotes para evitar errores de tamaño de petición
+        for i in range(0, len(vectors), 100):
+            self.index.upsert(vectors=vectors[i:i + 100], namespace=namespace)
+
+    def query(self, vector, top_k: int = 10, namespace: str = "default", filter: Optional[dict] = None) -> List[VectorMatch]:
+        kwargs = {"filter": filter} if filter else {}
+        response = self.index.query(vector=list(vector), top_k=top_k, include_metadata=True, namespace=namespace, **kwargs)
+        return [VectorMatch(id=m.id, score=m.score, metadata=dict(m.metadata or {})) for m in response.matches]
+
+    def query_many(self, vectors, top_k: int = 10, namespace: str = "default", filter: Optional[dict] = None) -> List[List[VectorMatch]]:
+        """
+        Lanza todas las búsquedas a la vez (con un tope de concurrencia, RAG_SEARCH_CONCURRENCY).
+        Si alguna falla o excede RAG_SEARCH_TIMEOUT_SECONDS, su resultado es una lista vacía
+        y el resto de búsquedas se devuelven igualmente.
+        """
+        results: List[List[VectorMatch]] = [[] for _ in vectors]
+        if not vectors:
+            return results
+        max_workers = max(1, min(settings.RAG_SEARCH_CONCURRENCY, len(vectors)))
+        # Con un tope menor al número de consultas, las búsquedas se ejecutan en "oleadas";
+        # el tiempo límite total escala con el número de oleadas para respetar el límite por llamada.
+        waves = math.ceil(len(vectors) / max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pinecone-search")
+        futures = {
+            executor.submit(self.query, v, top_k=top_k, namespace=namespace, filter=filter): i
+            for i, v in enumerate(vectors)
+        }
+        try:
+            for future in as_completed(futures, timeout=settings.RAG_SEARCH_TIMEOUT_SECONDS * waves):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as e:
+                    print(f"Búsqueda {futures[future]} falló, se descarta. Error: {e}")
+        except FuturesTimeoutError:
+            pending = sum(1 for f in futures if not f.done())
+            print(f"Tiempo límite excedido: se descartan {pending} búsquedas pendientes.")
+        finally:
+            # No esperamos a las búsquedas lentas: la respuesta continúa con lo que ya llegó.
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def fetch(self, ids, namespace: str = "default") -> Dict[str, VectorMatch]:
+        found = {}
+        for i in range(0, len(ids), 1000):
+            response = self.index.fetch(ids=list(ids[i:i + 1000]), namespace=namespace)
+            for vector_id, vector in (response.vectors or {}).items():
+                found[vector_id] = VectorMatch(id=vector_id, metadata=dict(vector.metadata or {}), values=list(vector.values))
+        return found
+
+    def list_ids(self, prefix: str, namespace: str = "default") -> List[str]:
+        # Listado por prefijo: solo en índices serverless
+        ids = []
+        for page in self.index.list(prefix=prefix, namespace=namespace):
+            ids.extend(page)
+        return ids
+
+    def delete(self, ids, namespace: str = "default"):
+        ids = list(ids)
+        for i in range(0, len(ids), 1000):
+            self.index.delete(ids=ids[i:i + 1000], namespace=namespace)
+
+    def delete_by_document(self, document_id: int, namespace: str = "default"):
+        """
+        Los IDs de los vectores empiezan por `doc_{id}_`, así que en índices serverless se listan
+        por prefijo y se borran por id. En índices basados en pods se borra por filtro de metadatos.
+        """
+        try:
+            for ids in self.index.list(prefix=f"doc_{document_id}_", namespace=namespace):
+                if ids:
+                    self.delete(list(ids), namespace=namespace)
+        except Exception as e:
+            print(f"VECTOR STORE: Listado por prefijo no disponible ({e}); borrando por filtro de metadatos.")
+            self.index.delete(filter={"document_id": document_id}, namespace=namespace)
+
+    def delete_namespace(self, namespace: str):
+        self.index.delete(delete_all=True, namespace=namespace)
+
+
+# Tombstones mínimos para compactar un namespace local (además de LOCAL_VECTOR_STORE_COMPACT_RATIO)
+COMPACT_MIN_TOMBSTONES = 1000
+
+# Campos de metadatos que el almacén local guarda también en columnas numpy para filtrar sin
+# recorrer los metadatos fila a fila: numéricos (NaN si faltan) y códigos de texto (-1 si faltan).
+NUMERIC_FILTER_COLUMNS = ("document_id", "publication_year")
+TEXT_FILTER_COLUMNS = ("language",)
+
+
+class _UnsupportedFilter(Exception):
+    """El filtro no se puede evaluar con las columnas: se evalúa con `matches_filter` fila a fila."""
+
+
+class _LocalNamespace:
+    """
+    Un namespace del almacén local:
+      - `{ns}.vectors`: matriz memory-mapped (filas = vectores normalizados) del dtype configurado.
+      - `{ns}.scales`: escala float32 por fila (solo para int8).
+      - `{ns}.sqlite3`: id, fila, document_id y metadatos JSON de cada vector, más un contador
+        de generación que permite a otros procesos detectar escrituras y recargar.
+    Cada escritura incrementa la generación y la anota en las filas que toca, así que otro proceso
+    solo vuelve a leer las filas con una generación posterior a la suya. Los borrados marcan las
+    filas (tombstones); cuando superan LOCAL_VECTOR_STORE_COMPACT_RATIO de la matriz, `compact`
+    la reescribe sin ellas en ficheros nuevos (`{ns}.{epoch}.vectors`, ...) y los procesos que ven
+    cambiar el epoch recargan todo.
+    Las consultas comprueban la generación como mucho cada LOCAL_VECTOR_STORE_REFRESH_SECONDS y solo
+    si los ficheros de SQLite cambiaron (`refresh_if_stale`), y filtran por document_id,
+    publication_year y language con máscaras vectorizadas sobre columnas numpy.
+    """
+
+    def __init__(self, directory: str, name: str, dtype: str):
+        self.base = os.path.join(directory, name)
+        self.dtype = np.dtype(dtype)
+        self.conn = sqlite3.connect(f"{self.base}.sqlite3", timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS vectors ("
+            " row INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL, document_id INTEGER,"
+            " metadata TEXT NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, generation INTEGER NOT NULL DEFAULT 0)"
+        )
+        columns = {column for _, column, *_ in self.conn.execute("PRAGMA table_info(vectors)")}
+        if "generation" not in columns:  # Almacenes creados antes de la recarga incremental
+            self.conn.execute("ALTER TABLE vectors ADD COLUMN generation INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_vectors_document_id ON vectors (document_id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS ix_vectors_generation ON vectors (generation)")
+        self.conn.commit()
+        self.lock = threading.RLock()
+        self.generation = None
+        self.epoch = 0
+        self.dim = None
+        self.matrix = None
+        self.scales = None
+        self.capacity = 0
+        self.count = 0
+        self.ids: List[str] = []
+        self.row_by_id: Dict[str, int] = {}
+        self.metadata: List[Optional[dict]] = []
+        self.alive = np.zeros(0, dtype=bool)
+        self.columns: Dict[str, np.ndarray] = {}
+        self.text_codes: Dict[str, int] = {}
+        self.irregular = set() # Columnas con algún valor de otro tipo (listas, texto en numéricas...)
+        self._reset_columns()
+        self.checked_at = 0.0
+        self.file_state = None
+
+    def _reset_columns(self):
+        self.columns = {key: np.full(self.count, np.nan) for key in NUMERIC_FILTER_COLUMNS}
+        self.columns.update({key: np.full(self.count, -1, dtype=np.int32) for key in TEXT_FILTER_COLUMNS})
+        self.text_codes, self.irregular = {}, set()
+
+    def _grow_columns(self, count: int):
+        for key, column in self.columns.items():
+            if len(column) < count:
+                grown = np.full(max(count, 2 * len(column)), np.nan if column.dtype.kind == "f" else -1, dtype=column.dtype)
+                grown[:len(column)] = column
+                self.columns[key] = grown
+
+    def _set_columns(self, row: int, metadata: dict):
+        for key in NUMERIC_FILTER_COLUMNS:
+            value = metadata.get(key)
+            numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if value is not None and not numeric:
+                self.irregular.add(key)
+            self.columns[key][row] = value if numeric else np.nan
+        for key in TEXT_FILTER_COLUMNS:
+            value = metadata.get(key)
+            if value is not None and not isinstance(value, str):
+                self.irregular.add(key)
+            self.columns[key][row] = self.text_codes.setdefault(value, len(self.text_codes)) if isinstance(value, str) else -1
+
+    def _meta(self, key: str):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _prefix(self, epoch: int) -> str:
+        # El epoch 0 usa los nombres originales, los de los almacenes anteriores a la compactación
+        return self.base if epoch == 0 else f"{self.base}.{epoch}"
+
+    def _open(self, prefix: str, capacity: int):
+        """Mapea los ficheros de la matriz con prefijo `prefix`, ampliándolos a `capacity` filas si hace falta."""
+        for suffix, dtype, width in ((".vectors", self.dtype, self.dim), (".scales", np.dtype(np.float32), 1)):
+            if suffix == ".scales" and self.dtype != np.int8:
+                continue
+            size = capacity * width * dtype.itemsize
+            with open(prefix + suffix, "ab") as f:
+                if f.tell() < size:
+                    f.truncate(size)
+        matrix = np.memmap(prefix + ".vectors", dtype=self.dtype, mode="r+", shape=(capacity, self.dim))
+        scales = np.memmap(prefix + ".scales", dtype=np.float32, mode="r+", shape=(capacity,)) if self.dtype == np.int8 else None
+        return matrix, scales
+
+    def _map(self, capacity: int):
+        """(Re)mapea los ficheros de la matriz con la capacidad indicada, ampliándolos si hace falta."""
+        self.matrix, self.scales = self._open(self._prefix(self.epoch), capacity)
+        self.capacity = capacity
+
+    def _load(self, rows):
+        """Aplica al estado en memoria las filas (row, id, metadata, deleted) leídas de SQLite."""
+        rows = list(rows)
+        count = max([self.count] + [row + 1 for row, *_ in rows])
+        if count > self.count:
+            self.ids.extend([None] * (count - self.count))
+            self.metadata.extend([None] * (count - self.count))
+            alive = np.zeros(count, dtype=bool)
+            alive[:self.count] = self.alive[:self.count]
+            self.alive = alive
+            self.count = count
+            self._grow_columns(count)
+        for row, vector_id, metadata, deleted in rows:
+            self.ids[row] = vector_id
+            self.row_by_id[vector_id] = row
+            self.alive[row] = not deleted
+            self.metadata[row] = None if deleted else json.loads(metadata)
+            if not deleted:
+                self._set_columns(row, self.metadata[row])
+
+    def refresh(self):
+        """Recarga ids/metadatos si otro proceso escribió desde la última lectura: solo las filas cambiadas."""
+        if self.conn.in_transaction:
+            self._refresh()
+            return
+        # Una transacción de lectura: la generación, el epoch y las filas salen de la misma instantánea
+        self.conn.execute("BEGIN")
+        try:
+            self._refresh()
+        finally:
+            self.conn.rollback()
+
+    def _file_state(self):
+        # Cada escritura de otro proceso cambia el WAL (o la base, tras un checkpoint)
+        state = []
+        for suffix in ("", "-wal"):
+            try:
+                stat = os.stat(f"{self.base}.sqlite3{suffix}")
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def refresh_if_stale(self):
+        """
+        `refresh` para las consultas: como mucho cada LOCAL_VECTOR_STORE_REFRESH_SECONDS, y solo si los
+        ficheros de SQLite cambiaron desde la última lectura (o cambiaron hace menos de un segundo,
+        por la resolución de las fechas de modificación). Las escrituras de este proceso ya están en memoria.
+        """
+        now = time.time()
+        if self.generation is not None and now - self.checked_at < settings.LOCAL_VECTOR_STORE_REFRESH_SECONDS:
+            return
+        self.checked_at = now
+        state = self._file_state()
+        recent = any(entry is not None and now - entry[0] / 1e9 < 1.0 for entry in state)
+        if self.generation is not None and state == self.file_state and not recent:
+            return
+        self.refresh()
+        self.file_state = state
+
+    def _refresh(self):
+        generation = int(self._meta("generation") or 0)
+        if generation == self.generation:
+            return
+        epoch = int(self._meta("epoch") or 0)
+        dim = self._meta("dim")
+        self.dim = int(dim) if dim else None
+        if self.generation is None or epoch != self.epoch:
+            # Primera lectura o matriz compactada: las filas cambiaron de posición
+            self.epoch = epoch
+            self.ids, self.metadata, self.row_by_id = [], [], {}
+            self.alive = np.zeros(0, dtype=bool)
+            self.count = self.capacity = 0
+            self.matrix = self.scales = None
+            self._reset_columns()
+            self._load(self.conn.execute("SELECT row, id, metadata, deleted FROM vectors"))
+        else:
+            self._load(self.conn.execute("SELECT row, id, metadata, deleted FROM vectors WHERE generation > ?", (self.generation,)))
+        if self.dim and (self.matrix is None or self.count > self.capacity):
+            self._map(max(self.count, 1, self.capacity))
+        self.generation = generation
+
+    def _bump_generation(self) -> int:
+        generation = (self.generation or 0) + 1
+        self._set_meta("generation", generation)
+        return generation
+
+    def _encode(self, vectors: np.ndarray):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127
+            scales[scales == 0] = 1
+            return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return vectors.astype(self.dtype), None
+
+    def upsert(self, vectors: List[dict]):
+        with self.lock:
+            # BEGIN IMMEDIATE serializa a los escritores de distintos procesos.
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.refresh()
+                values = np.asarray([v["values"] for v in vectors], dtype=np.float32)
+                if self.dim is None:
+                    self.dim = values.shape[1]
+                    self._set_meta("dim", self.dim)
+                    self._map(max(1024, len(vectors)))
+                if values.shape[1] != self.dim:
+                    raise ValueError(f"Dimensión {values.shape[1]} distinta de la del índice ({self.dim}).")
+                rows = []
+                for v in vectors:
+                    row = self.row_by_id.get(v["id"])
+                    if row is None:
+                        row = self.count
+                        self.count += 1
+                        self.row_by_id[v["id"]] = row
+                        self.ids.append(v["id"])
+                        self.metadata.append(None)
+                    rows.append(row)
+                self._grow_columns(self.count)
+                if self.count > self.capacity:
+                    self._map(max(self.count, self.capacity * 2))
+                encoded, scales = self._encode(values)
+                rows_array = np.asarray(rows)
+                self.matrix[rows_array] = encoded
+                if scales is not None:
+                    self.scales[rows_array] = scales
+                self.matrix.flush()
+                if self.scales is not None:
+                    self.scales.flush()
+                generation = self._bump_generation()
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO vectors (row, id, document_id, metadata, deleted, generation) VALUES (?, ?, ?, ?, 0, ?)",
+                    [
+                        (row, v["id"], (v.get("metadata") or {}).get("document_id"), json.dumps(v.get("metadata") or {}, ensure_ascii=False), generation)
+                        for row, v in zip(rows, vectors)
+                    ],
+                )
+                alive = np.zeros(self.count, dtype=bool)
+                alive[:len(self.alive)] = self.alive
+                alive[rows_array] = True
+                self.alive = alive
+                for row, v in zip(rows, vectors):
+                    self.metadata[row] = dict(v.get("metadata") or {})
+                    self._set_columns(row, self.metadata[row])
+                self.conn.commit()
+                self.generation = generation
+            except Exception:
+                self.conn.rollback()
+                self.generation = None  # Fuerza recarga desde disco
+                raise
+
+    def delete(self, ids: Sequence[str] = None, document_id: int = None):
+        """Marca como borrados los vectores `ids`, o todos los de `document_id`, y compacta si toca."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Las filas se resuelven dentro de la transacción: una compactación las puede haber movido
+                self.refresh()
+                if document_id is not None:
+                    rows = [r for (r,) in self.conn.execute("SELECT row FROM vectors WHERE document_id = ? AND deleted = 0", (document_id,))]
+                else:
+                    rows = [self.row_by_id[i] for i in ids if i in self.row_by_id and self.alive[self.row_by_id[i]]]
+                if not rows:
+                    self.conn.rollback()
+                    return
+                generation = self._bump_generation()
+                self.conn.executemany("UPDATE vectors SET deleted = 1, generation = ? WHERE row = ?", [(generation, r) for r in rows])
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                self.generation = None  # Fuerza recarga desde disco
+                raise
+            self.alive[rows] = False
+            for row in rows:
+                self.metadata[row] = None
+            self.generation = generation
+            tombstones = self.count - int(self.alive.sum())
+            if tombstones >= COMPACT_MIN_TOMBSTONES and tombstones > settings.LOCAL_VECTOR_STORE_COMPACT_RATIO * self.count:
+                self.compact()
+
+    def compact(self):
+        """
+        Reescribe la matriz sin las filas borradas en ficheros de un epoch nuevo. Los del epoch anterior
+        se conservan hasta la siguiente compactación: otro proceso puede estar aún leyéndolos.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            epoch = None
+            try:
+                self.refresh()
+                live = np.flatnonzero(self.alive[:self.count])
+                if self.dim is None or len(live) == self.count:
+                    self.conn.rollback()
+                    return
+                epoch = self.epoch + 1
+                matrix, scales = self._open(self._prefix(epoch), max(1024, len(live)))
+                for start in range(0, len(live), 65536):
+                    block = live[start:start + 65536]
+                    matrix[start:start + len(block)] = self.matrix[block]
+                    if scales is not None:
+                        scales[start:start + len(block)] = self.scales[block]
+                matrix.flush()
+                if scales is not None:
+                    scales.flush()
+                generation = self._bump_generation()
+                self.conn.execute("DELETE FROM vectors WHERE deleted = 1")
+                # En orden ascendente cada fila va a una posición ya libre (new_row <= old_row)
+                self.conn.executemany(
+                    "UPDATE vectors SET row = ?, generation = ? WHERE row = ?",
+                    [(new_row, generation, int(old_row)) for new_row, old_row in enumerate(live) if new_row != old_row],
+                )
+                self._set_meta("epoch", epoch)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                if epoch is not None:
+                    self._remove_files(self._prefix(epoch))
+                raise
+            finally:
+                self.generation = None  # La siguiente lectura recarga todo con las filas nuevas
+            print(f"VECTOR STORE: Namespace '{os.path.basename(self.base)}' compactado: {self.count - len(live)} vectores borrados eliminados, {len(live)} vivos.")
+            if epoch >= 2:
+                self._remove_files(self._prefix(epoch - 2))
+            self.refresh()
+
+    @staticmethod
+    def _remove_files(prefix: str):
+        for suffix in (".vectors", ".scales"):
+            try:
+                os.remove(prefix + suffix)
+            except FileNotFoundError:
+                pass
+
+    def filter_mask(self, filter: dict) -> np.ndarray:
+        """Filas (de las `count` primeras) que cumplen `filter`; con las columnas si se puede, si no fila a fila."""
+        try:
+            return self._column_mask(filter)
+        except _UnsupportedFilter:
+            filter = _with_sets(filter)
+            return np.fromiter((m is not None and matches_filter(m, filter) for m in self.metadata[:self.count]), dtype=bool, count=self.count)
+
+    def _column_mask(self, filter: dict) -> np.ndarray:
+        # Misma semántica que `matches_filter` para valores simples: un campo ausente no cumple
+        # $eq, $in ni las comparaciones, y sí $ne y $nin.
+        mask = np.ones(self.count, dtype=bool)
+        for key, condition in filter.items():
+            if key in ("$and", "$or"):
+                masks = [self._column_mask(sub) for sub in condition]
+                if key == "$and":
+                    mask &= np.logical_and.reduce(masks) if masks else True
+                else:
+                    mask &= np.logical_or.reduce(masks) if masks else False
+                continue
+            if key not in self.columns or key in self.irregular:
+                raise _UnsupportedFilter(key)
+            column = self.columns[key][:self.count]
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, expected in condition.items():
+                if op in ("$eq", "$ne"):
+                    ok = column == self._encode_filter_value(key, expected)
+                    mask &= ok if op == "$eq" else ~ok
+                elif op in ("$in", "$nin"):
+                    ok = np.isin(column, [self._encode_filter_value(key, value) for value in expected])
+                    mask &= ok if op == "$in" else ~ok
+                elif op in ("$gt", "$gte", "$lt", "$lte") and key in NUMERIC_FILTER_COLUMNS:
+                    value = self._encode_filter_value(key, expected)
+                    with np.errstate(invalid="ignore"):
+                        mask &= {"$gt": column > value, "$gte": column >= value, "$lt": column < value, "$lte": column <= value}[op]
+                else:
+                    raise _UnsupportedFilter(op)
+        return mask
+
+    def _encode_filter_value(self, key: str, value):
+        if key in NUMERIC_FILTER_COLUMNS:
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                raise _UnsupportedFilter(key)
+            return float(value)
+        if not isinstance(value, str):
+            raise _UnsupportedFilter(key)
+        return self.text_codes.get(value, -2) # -2: ninguna fila tiene ese texto
+
+    def scores(self, queries: np.ndarray) -> np.ndarray:
+        """Similitud coseno de cada consulta (filas de `queries`) contra todas las filas del índice."""
+        block = 65536
+        out = np.empty((queries.shape[0], self.count), dtype=np.float32)
+        for start in range(0, self.count, block):
+            end = min(start + block, self.count)
+            chunk = np.asarray(self.matrix[start:end], dtype=np.float32)
+            scores = queries @ chunk.T
+            if self.dtype == np.int8:
+                scores *= np.asarray(self.scales[start:end])
+            out[:, start:end] = scores
+        return out
+
+
+class LocalVectorStore(VectorStore):
+    def __init__(self, directory: str, dtype: str = "float32"):
+        if dtype not in ("float32", "float16", "int8"):
+            raise ValueError(f"dtype no soportado para el almacén local: {dtype}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dtype = dtype
+        self._namespaces: Dict[str, _LocalNamespace] = {}
+        self._lock = threading.Lock()
+
+    def _ns(self, namespace: str) -> _LocalNamespace:
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = _LocalNamespace(self.directory, namespace, self.dtype)
+            return self._namespaces[namespace]
+
+    def upsert(self, vectors: List[dict], namespace: str = "default"):
+        if vectors:
+            self._ns(namespace).upsert(vectors)
+
+    def query(self, vector, top_k: int = 10, namespace: str = "default", filter: Optional[dict] = None) -> List[VectorMatch]:
+        return self.query_many([vector], top_k=top_k, namespace=namespace, filter=filter)[0]
+
+    def query_many(self, vectors, top_k: int = 10, namespace: str = "default", filter: Optional[dict] = None) -> List[List[VectorMatch]]:
+        """Todas las consultas se resuelven con un único producto matricial y un top-k vectorizado."""
+        ns = self._ns(namespace)
+        with ns.lock:
+            ns.refresh_if_stale()
+            if not vectors or ns.count == 0:
+                return [[] for _ in vectors]
+            queries = np.asarray(vectors, dtype=np.float32)
+            norms = np.linalg.norm(queries, axis=1, keepdims=True)
+            queries = queries / np.where(norms == 0, 1, norms)
+            scores = ns.scores(queries)
+            mask = ns.alive[:ns.count].copy()
+            if filter:
+                mask &= ns.filter_mask(filter)
+            scores[:, ~mask] = -np.inf
+            k = min(top_k, int(mask.sum()))
+            if k == 0:
+                return [[] for _ in vectors]
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            results = []
+            for q in range(len(queries)):
+                rows = top[q][np.argsort(-scores[q, top[q]])]
+                results.append([
+                    VectorMatch(id=ns.ids[r], score=float(scores[q, r]), metadata=dict(ns.metadata[r]))
+                    for r in rows
+                ])
+            return results
+
+    def fetch(self, ids, namespace: str = "default") -> Dict[str, VectorMatch]:
+        ns = self._ns(namespace)
+        with ns.lock:
+            ns.refresh() # Lecturas por id (reconstrucciones, citas): siempre con las últimas escrituras
+            found = {}
+            for vector_id in ids:
+                row = ns.row_by_id.get(vector_id)
+                if row is None or not ns.alive[row]:
+                    continue
+                values = np.asarray(ns.matrix[row], dtype=np.float32)
+                if ns.dtype == np.int8:
+                    values = values * ns.scales[row]
+                found[vector_id] = VectorMatch(id=vector_id, metadata=dict(ns.metadata[row]), values=values.tolist())
+            return found
+
+    def list_ids(self, prefix: str, namespace: str = "default") -> List[str]:
+        ns = self._ns(namespace)
+        with ns.lock:
+            rows = ns.conn.execute("SELECT id FROM vectors WHERE deleted = 0 AND substr(id, 1, ?) = ? ORDER BY row", (len(prefix), prefix))
+            return [vector_id for (vector_id,) in rows]
+
+    def delete(self, ids, namespace: str = "default"):
+        self._ns(namespace).delete(ids=list(ids))
+
+    def delete_by_document(self, document_id: int, namespace: str = "default"):
+        self._ns(namespace).delete(document_id=document_id)
+
+    def delete_namespace(self, namespace: str):
+        with self._lock:
+            ns = self._namespaces.pop(namespace, None)
+        if ns is not None:
+            with ns.lock:
+                ns.matrix = ns.scales = None
+                ns.conn.close()
+        # Ficheros del namespace, incluidos los de los epochs de las compactaciones ({ns}.{epoch}.vectors)
+        pattern = re.compile(re.escape(namespace) + r"(\.\d+)?\.(vectors|scales)|" + re.escape(namespace) + r"\.sqlite3(-wal|-shm)?")
+        for filename in os.listdir(self.directory):
+            if pattern.fullmatch(filename):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+
+
+_vector_store: Optional[VectorStore] = None
+_vector_store_lock = threading.Lock()
+
+
+def get_vector_store() -> VectorStore:
+    """Devuelve (creándolo la primera vez) el índice vectorial configurado."""
+    global _vector_store
+    if _vector_store is None:
+        with _vector_store_lock:
+            if _vector_store is None:
+                if settings.VECTOR_STORE_BACKEND == "local":
+                    _vector_store = LocalVectorStore(settings.LOCAL_VECTOR_STORE_DIR, dtype=settings.LOCAL_VECTOR_STORE_DTYPE)
+                elif settings.VECTOR_STORE_BACKEND == "pinecone":
+                    _vector_store = PineconeVectorStore(settings.PINECONE_INDEX_NAME)
+                else:
+                    raise ValueError(f"VECTOR_STORE_BACKEND desconocido: {settings.VECTOR_STORE_BACKEND}")
+    return _vector_store
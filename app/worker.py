@@ -0,0 +1,184 @@
+"""
+Worker de la cola de ingesta.
+
+Ejecutar como proceso independiente de la API:
+
+    python -m app.worker
+
+Lanza `INGESTION_WORKERS` procesos que toman trabajos de la tabla `ingestion_jobs`,
+ejecutan `process_pdf_pipeline` y reintentan con backoff los trabajos que fallan por errores
+transitorios (red, límites de la API, base de datos); los demás (PDF corrupto o sin texto) fallan enseguida.
+Al arrancar (y periódicamente) recupera los trabajos huérfanos de workers caídos.
+Entre trabajos, construye también las versiones nuevas del índice (ver app/services/index_builder.py).
+"""
+import multiprocessing
+import os
+import random
+import signal
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from app.core.config import settings
+from app.core.clients import warm_up
+from app.db.migrations import init_db
+from app.db.session import SessionLocal, engine
+from app.services.index_builder import IndexBuildRunner
+from app.services.pdf_extraction import shutdown_extraction_pool
+from app.services.retry import is_transient_error
+from app.services.uploads import remove_upload
+from app.db.crud import (
+    claim_next_ingestion_jobs,
+    touch_ingestion_job,
+    complete_ingestion_job,
+    fail_ingestion_job,
+    recover_orphaned_ingestion_jobs,
+)
+
+_stop = threading.Event()
+
+
+def _heartbeat(job_id: int, done: threading.Event):
+    """Renueva el heartbeat del trabajo mientras se procesa, para que no se considere huérfano."""
+    interval = max(1.0, settings.INGESTION_LEASE_SECONDS / 4)
+    while not done.wait(interval):
+        db = SessionLocal()
+        try:
+            touch_ingestion_job(db, job_id)
+        except Exception as e:
+            print(f"WORKER: No se pudo renovar el heartbeat del trabajo {job_id}: {e}")
+        finally:
+            db.close()
+
+
+def _is_retryable(error: Exception) -> bool:
+    # Además de los fallos transitorios de red y de las APIs, los de la base de datos (conexión
+    # perdida, base bloqueada), que no dependen del PDF
+    return is_transient_error(error) or isinstance(error, OperationalError)
+
+
+def _run_job(job):
+    # Import diferido: los clientes externos se inicializan solo en los procesos worker.
+    from app.services.pipeline import process_pdf_pipeline
+
+    final_attempt = job.attempts >= job.max_attempts
+    done = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job.id, done), daemon=True)
+    heartbeat.start()
+    db = SessionLocal()
+    try:
+        status = process_pdf_pipeline(
+            file_path=job.file_path,
+            document_id=job.document_id,
+            user_metadata=job.user_metadata,
+            raise_on_error=not final_attempt,
+        )
+        if status == "completed":
+            complete_ingestion_job(db, job.id)
+        else:
+            fail_ingestion_job(db, job.id, error="El pipeline terminó con estado 'failed'.")
+        # El trabajo ya no se reintentará: el PDF subido deja de ser necesario.
+        remove_upload(job.file_path)
+    except Exception as e:
+        db.rollback() # El error pudo dejar la sesión en una transacción fallida
+        if final_attempt or not _is_retryable(e):
+            # Un error en el último intento no reencola el trabajo; uno permanente (PDF corrupto o
+            # solo con imágenes, petición inválida) fallaría igual en cada reintento
+            reason = f"en su último intento ({job.attempts}/{job.max_attempts})" if final_attempt else "con un error permanente"
+            print(f"WORKER: Trabajo {job.id} falló {reason}: {e}.")
+            fail_ingestion_job(db, job.id, error=str(e))
+            remove_upload(job.file_path)
+            return
+        delay = settings.INGESTION_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1)) * random.uniform(0.8, 1.2)
+        print(f"WORKER: Trabajo {job.id} falló (intento {job.attempts}/{job.max_attempts}): {e}. Reintento en {delay:.0f}s.")
+        fail_ingestion_job(db, job.id, error=str(e), retry_in_seconds=delay)
+    finally:
+        done.set()
+        db.close()
+
+
+def _run_jobs(jobs):
+    """
+    Procesa a la vez varios trabajos de un mismo lote de subida masiva: sus lotes de embeddings
+    y subidas al índice se combinan en el proceso (ver `shared_upserts` en pipeline.py).
+    """
+    if len(jobs) == 1:
+        _run_job(jobs[0])
+        return
+    threads = [threading.Thread(target=_run_job, args=(job,), name=f"ingestion-job-{job.id}") for job in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_worker_loop(worker_index: int = 0):
+    """Bucle principal de un proceso worker: toma trabajos hasta recibir SIGTERM/SIGINT."""
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+    print(f"WORKER {worker_index}: Iniciado (pid {os.getpid()}).")
+    if settings.CLIENTS_WARM_UP:
+        warm_up("openai", "cloudinary", "vector_store", "tokenizer")
+    last_recovery = 0.0
+    index_builds = IndexBuildRunner(_stop, check_seconds=settings.INDEX_VERSION_CHECK_SECONDS, lease_seconds=settings.INGESTION_LEASE_SECONDS)
+    while not _stop.is_set():
+        index_builds.poll()
+        jobs = []
+        db = SessionLocal()
+        try:
+            now = time.time()
+            if now - last_recovery > settings.INGESTION_LEASE_SECONDS:
+                recovered = recover_orphaned_ingestion_jobs(db, settings.INGESTION_LEASE_SECONDS)
+                if recovered:
+                    print(f"WORKER {worker_index}: Recuperados {recovered} trabajos/documentos huérfanos.")
+                last_recovery = now
+            jobs = claim_next_ingestion_jobs(db, batch_limit=settings.INGESTION_BATCH_PARALLEL_DOCUMENTS)
+        except Exception as e:
+            print(f"WORKER {worker_index}: Error al consultar la cola: {e}")
+        finally:
+            db.close()
+
+        if not jobs:
+            _stop.wait(settings.INGESTION_POLL_SECONDS)
+            continue
+        for job in jobs:
+            print(f"WORKER {worker_index}: Procesando trabajo {job.id} (documento {job.document_id}, intento {job.attempts}).")
+        _run_jobs(jobs)
+    index_builds.join()
+    shutdown_extraction_pool()
+    print(f"WORKER {worker_index}: Detenido.")
+
+
+def main():
+    init_db(engine)
+    engine.dispose()  # Cada proceso hijo abre su propio pool de conexiones
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = {}
+
+    def start(index: int):
+        process = ctx.Process(target=run_worker_loop, args=(index,), name=f"ingestion-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    for i in range(settings.INGESTION_WORKERS):
+        start(i)
+
+    signal.signal(signal.SIGTERM, lambda *_: _stop.set())
+    signal.signal(signal.SIGINT, lambda *_: _stop.set())
+    # Supervisión: si un worker muere inesperadamente, se relanza.
+    while not _stop.wait(5):
+        for index, process in list(processes.items()):
+            if not process.is_alive():
+                print(f"WORKER: El proceso {index} terminó con código {process.exitcode}; relanzando.")
+                start(index)
+
+    for process in processes.values():
+        process.terminate()
+    for process in processes.values():
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
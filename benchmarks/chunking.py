@@ -0,0 +1,200 @@
+"""
+Benchmark de la extracción de texto y el chunking de la ingesta.
+
+Con PDFs sintéticos de distintos tamaños compara:
+  - extracción: página a página en el hilo del pipeline frente a `iter_page_texts` con un pool de
+    `--processes` procesos (ver app/services/pdf_extraction.py);
+  - splitter: `RecursiveCharacterTextSplitter` de LangChain frente a `RecursiveSplitter` sobre el
+    texto completo (ver app/services/text_splitter.py);
+  - chunking del pipeline: el `_iter_chunks` anterior (LangChain y posiciones buscadas con `find`)
+    frente al actual, con la misma ventana.
+En cada comparación comprueba que la salida es idéntica (texto, posiciones y páginas de cada chunk)
+y termina con código 1 si no lo es. No llama a ningún servicio externo. Con un solo núcleo la
+extracción no usa el pool (ver `extraction_processes`) y ambas columnas miden lo mismo.
+
+Uso (desde la raíz del repositorio, con requirements-dev.txt instalado):
+
+    python -m benchmarks.chunking --pages 50,200,800 --processes 4 --repeat 3
+
+El resultado se guarda como JSON en `benchmarks/results/` (prefijo chunking_).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+from benchmarks.run import REPO_ROOT, _parse_ints, git_revision, make_pdf
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de la extracción de texto y el chunking de los PDF.")
+    parser.add_argument("--pages", type=_parse_ints, default=[50, 200, 800], help="Tamaños (páginas) de los PDFs.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="Procesos del pool de extracción.")
+    parser.add_argument("--pages-per-task", type=int, default=32, help="Páginas de cada rango extraído en el pool.")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de cada medida; se guarda la mejor.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir", default=os.path.join(REPO_ROOT, "benchmarks", "results"))
+    parser.add_argument("--label", default="", help="Etiqueta libre que se guarda con el resultado.")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args):
+    """Variables de entorno de la app; deben fijarse antes de importar `app.core.config`."""
+    for key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "PINECONE_ENVIRONMENT", "CLOUDINARY_CLOUD_NAME",
+                "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET", "COHERE_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+    os.environ.setdefault("DATABASE_URL", "sqlite://") # No se usa: el benchmark no toca la base de datos
+    os.environ["PDF_EXTRACTION_PROCESSES"] = str(args.processes)
+    os.environ["PDF_EXTRACTION_PAGES_PER_TASK"] = str(args.pages_per_task)
+    os.environ["PDF_PARALLEL_MIN_PAGES"] = "1" # Todos los PDF del benchmark pasan por el pool
+
+
+def best_of(repeat: int, function):
+    """(resultado, mejor tiempo en ms) de `repeat` ejecuciones."""
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, round(best, 1)
+
+
+def langchain_chunks(pages, text_splitter, window_chars: int):
+    """`_iter_chunks` anterior: chunks de LangChain, situados después en el buffer con `find`."""
+    buffer, buffer_offset, page_starts = "", 0, []
+
+    def locate(pieces):
+        search_from, located = 0, []
+        for piece in pieces:
+            position = buffer.find(piece, search_from)
+            if position == -1:
+                located.append((piece, None))
+                continue
+            search_from = position + 1
+            located.append((piece, buffer_offset + position))
+        return located
+
+    def to_chunk(piece, start):
+        if start is None:
+            return (piece, None, None, None, None)
+        end = start + len(piece)
+        return (piece, start, end, bisect_right(page_starts, start), bisect_right(page_starts, max(start, end - 1)))
+
+    chunks = []
+    for page_text in pages:
+        page_starts.append(buffer_offset + len(buffer))
+        buffer += page_text
+        if len(buffer) < window_chars:
+            continue
+        located = locate(text_splitter.split_text(buffer))
+        if len(located) < 2:
+            continue
+        chunks += [to_chunk(piece, start) for piece, start in located[:-1]]
+        last_piece, last_start = located[-1]
+        tail_start = last_start - buffer_offset if last_start is not None else buffer.rfind(last_piece)
+        if tail_start == -1:
+            buffer_offset += len(buffer) - len(last_piece)
+            buffer = last_piece
+        else:
+            buffer_offset += tail_start
+            buffer = buffer[tail_start:]
+    if buffer.strip():
+        chunks += [to_chunk(piece, start) for piece, start in locate(text_splitter.split_text(buffer))]
+    return chunks
+
+
+def run_document(pdf_path: str, page_count: int, args) -> dict:
+    import fitz
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    from app.services.index_versions import DEFAULT_INDEX
+    from app.services.pdf_extraction import extraction_processes, iter_page_texts
+    from app.services.pipeline import CHUNK_SEPARATORS, CHUNK_WINDOW_FACTOR, _iter_chunks, _text_splitter
+
+    spec = DEFAULT_INDEX._replace(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
+    window_chars = CHUNK_WINDOW_FACTOR * spec.chunk_size
+    with fitz.open(pdf_path, filetype="pdf") as doc:
+        serial_pages, serial_ms = best_of(args.repeat, lambda: [page.get_text() for page in doc])
+        parallel_pages, parallel_ms = best_of(args.repeat, lambda: list(iter_page_texts(doc, pdf_path)))
+    text = "".join(serial_pages)
+
+    langchain = RecursiveCharacterTextSplitter(chunk_size=spec.chunk_size, chunk_overlap=spec.chunk_overlap, separators=CHUNK_SEPARATORS)
+    native = _text_splitter(spec)
+    langchain_split, langchain_split_ms = best_of(args.repeat, lambda: langchain.split_text(text))
+    native_split, native_split_ms = best_of(args.repeat, lambda: native.split_text(text))
+    before, before_ms = best_of(args.repeat, lambda: langchain_chunks(serial_pages, langchain, window_chars))
+    after, after_ms = best_of(args.repeat, lambda: [tuple(chunk) for chunk in _iter_chunks(serial_pages, native, window_chars)])
+
+    return {
+        "pages": page_count,
+        "characters": len(text),
+        "chunks": len(after),
+        "extraction": {"serial_ms": serial_ms, "parallel_ms": parallel_ms, "processes": extraction_processes(), "identical": parallel_pages == serial_pages},
+        "splitter": {"langchain_ms": langchain_split_ms, "native_ms": native_split_ms, "identical": native_split == langchain_split},
+        "pipeline_chunks": {"before_ms": before_ms, "after_ms": after_ms, "identical": after == before},
+    }
+
+
+def _speedup(before: float, after: float) -> str:
+    return f"x{before / after:.2f}" if after else "-"
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    sys.path.insert(0, REPO_ROOT)
+    configure_environment(args)
+    from app.services.pdf_extraction import shutdown_extraction_pool
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="rag-chunking-") as workdir:
+        try:
+            for index, pages in enumerate(args.pages):
+                data, _ = make_pdf(index, pages, rng)
+                pdf_path = os.path.join(workdir, f"{index}.pdf")
+                with open(pdf_path, "wb") as f:
+                    f.write(data)
+                result = run_document(pdf_path, pages, args)
+                results.append(result)
+                extraction, splitter, chunks = result["extraction"], result["splitter"], result["pipeline_chunks"]
+                print(
+                    f"BENCHMARK: {pages} páginas, {result['chunks']} chunks | "
+                    f"extracción {extraction['serial_ms']} -> {extraction['parallel_ms']} ms ({_speedup(extraction['serial_ms'], extraction['parallel_ms'])}, {extraction['processes']} procesos) | "
+                    f"splitter {splitter['langchain_ms']} -> {splitter['native_ms']} ms ({_speedup(splitter['langchain_ms'], splitter['native_ms'])}) | "
+                    f"chunking {chunks['before_ms']} -> {chunks['after_ms']} ms ({_speedup(chunks['before_ms'], chunks['after_ms'])}) | "
+                    f"idénticos: {extraction['identical']}/{splitter['identical']}/{chunks['identical']}"
+                )
+        finally:
+            shutdown_extraction_pool()
+
+    identical = all(r[stage]["identical"] for r in results for stage in ("extraction", "splitter", "pipeline_chunks"))
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k != "output_dir"},
+        "documents": results,
+        "identical": identical,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    name = f"chunking_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{(report['git']['commit'] or 'nogit')[:8]}{'_' + args.label if args.label else ''}.json"
+    output_path = os.path.join(args.output_dir, name)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"BENCHMARK: Resultado guardado en {output_path}")
+    if not identical:
+        print("BENCHMARK: La salida NO es idéntica.")
+        sys.exit(1)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compara dos resultados de `benchmarks.run`:
+
+    python -m benchmarks.compare benchmarks/results/<antes>.json benchmarks/results/<después>.json
+
+Muestra cada métrica de ingesta y de consultas (por nivel de concurrencia) con su variación relativa.
+"""
+import argparse
+import json
+
+# Métrica -> True si un valor mayor es mejor
+INGESTION_METRICS = {"docs_per_minute": True, "pages_per_minute": True, "failed": False, "peak_rss_mb": False}
+QUERY_METRICS = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "mean_ms": False, "qps": True, "errors": False, "peak_rss_mb": False}
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _row(name: str, before, after, higher_is_better: bool) -> str:
+    if before is None or after is None:
+        return f"  {name:<22} {before!s:>12} {after!s:>12}"
+    delta = ""
+    if before:
+        change = (after - before) / before * 100
+        better = change > 0 if higher_is_better else change < 0
+        delta = f"{change:+.1f}%" + ("  (mejor)" if better and abs(change) >= 1 else "  (peor)" if not better and abs(change) >= 1 else "")
+    return f"  {name:<22} {before:>12} {after:>12}   {delta}"
+
+
+def compare(before: dict, after: dict) -> str:
+    lines = [
+        f"Antes:   {before['git'].get('commit', '')[:10]} {before['git'].get('subject', '')} ({before['timestamp']})",
+        f"Después: {after['git'].get('commit', '')[:10]} {after['git'].get('subject', '')} ({after['timestamp']})",
+    ]
+    changed_config = {k: (before["config"].get(k), v) for k, v in after["config"].items() if before["config"].get(k) != v and k != "label"}
+    if changed_config:
+        lines.append(f"AVISO: la configuración difiere: {changed_config}")
+
+    lines.append("\nIngesta")
+    for metric, higher_is_better in INGESTION_METRICS.items():
+        lines.append(_row(metric, before["ingestion"].get(metric), after["ingestion"].get(metric), higher_is_better))
+
+    before_queries = {q["concurrency"]: q for q in before["queries"]}
+    for result in after["queries"]:
+        previous = before_queries.get(result["concurrency"])
+        if previous is None:
+            continue
+        lines.append(f"\nConsultas (concurrencia {result['concurrency']})")
+        for metric, higher_is_better in QUERY_METRICS.items():
+            lines.append(_row(metric, previous.get(metric), result.get(metric), higher_is_better))
+        for stage in sorted(set(previous.get("stages_mean_ms", {})) | set(result.get("stages_mean_ms", {}))):
+            lines.append(_row(f"etapa {stage}", previous.get("stages_mean_ms", {}).get(stage), result.get("stages_mean_ms", {}).get(stage), False))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compara dos resultados de benchmarks.run.")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args(argv)
+    print(compare(_load(args.before), _load(args.after)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Sustitutos locales de OpenAI, Pinecone, Cohere y Cloudinary para los benchmarks.
+
+`install(latencies)` reemplaza los clientes de las librerías reales antes de importar la app,
+de modo que el código de `app/` se ejecuta sin cambios. Cada servicio simula su latencia
+(media en ms, con una variación aleatoria de ±`JITTER`) para que la concurrencia del pipeline
+se mida en condiciones parecidas a las reales.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace as NS
+
+import numpy as np
+
+EMBEDDING_DIM = 1536
+JITTER = 0.3
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _sleep(latency_ms: float):
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000 * random.uniform(1 - JITTER, 1 + JITTER))
+
+
+def _tokens(text: str):
+    return _WORD_RE.findall(text.lower())
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Embedding determinista tipo "bolsa de palabras con hashing": textos con palabras comunes se parecen."""
+    vector = np.zeros(dim, dtype=np.float32)
+    for token in _tokens(text):
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+# --- OpenAI ---
+
+class _Embeddings:
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+
+    def create(self, input, model, **kwargs):
+        _sleep(self.latency_ms)
+        texts = [input] if isinstance(input, str) else list(input)
+        tokens = sum(len(_tokens(t)) for t in texts)
+        return NS(
+            data=[NS(embedding=fake_embedding(t).tolist(), index=i) for i, t in enumerate(texts)],
+            usage=NS(prompt_tokens=tokens, total_tokens=tokens),
+        )
+
+
+class _ChatCompletions:
+    def __init__(self, latency_ms: float, token_latency_ms: float):
+        self.latency_ms = latency_ms
+        self.token_latency_ms = token_latency_ms
+
+    def create(self, model, messages, stream=False, response_format=None, **kwargs):
+        prompt = messages[-1]["content"]
+        prompt_tokens = sum(len(_tokens(m["content"])) for m in messages)
+        if response_format:
+            words = _tokens(prompt)
+            variants = [" ".join(random.sample(words, len(words))) for _ in range(3)] if words else []
+            content = json.dumps({"queries": [prompt] + variants}, ensure_ascii=False)
+        elif prompt.startswith("Analiza el siguiente texto"):
+            words = [w for w in _tokens(prompt) if len(w) > 4][:10] or ["documento"]
+            content = f"Resumen: Documento sintético de prueba.\nPalabras clave: {', '.join(words)}"
+        else:
+            content = "Respuesta sintética basada en el contexto recuperado (Autor, 2024). " * 5
+        completion_tokens = len(_tokens(content))
+        usage = NS(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, total_tokens=prompt_tokens + completion_tokens)
+        _sleep(self.latency_ms)
+        if not stream:
+            return NS(choices=[NS(message=NS(content=content))], usage=usage)
+        return self._stream(content, usage, kwargs.get("stream_options") or {})
+
+    def _stream(self, content, usage, stream_options):
+        for word in content.split(" "):
+            _sleep(self.token_latency_ms)
+            yield NS(choices=[NS(delta=NS(content=word + " "))], usage=None)
+        if stream_options.get("include_usage"):
+            yield NS(choices=[], usage=usage)
+
+
+class FakeOpenAI:
+    latency_ms = 0.0
+    chat_latency_ms = 0.0
+    token_latency_ms = 0.0
+
+    def __init__(self, *args, **kwargs):
+        self.embeddings = _Embeddings(FakeOpenAI.latency_ms)
+        self.chat = NS(completions=_ChatCompletions(FakeOpenAI.chat_latency_ms, FakeOpenAI.token_latency_ms))
+
+
+# --- Pinecone ---
+
+class FakePineconeIndex:
+    """Índice en memoria con la interfaz de `pinecone.Index` que usa `PineconeVectorStore`."""
+
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+        self._namespaces = {}
+        self._matrices = {}
+        self._lock = threading.Lock()
+
+    def _ns(self, namespace):
+        return self._namespaces.setdefault(namespace, {})
+
+    def upsert(self, vectors, namespace="default", **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            ns = self._ns(namespace)
+            for v in vectors:
+                ns[v["id"]] = (np.asarray(v["values"], dtype=np.float32), dict(v.get("metadata") or {}))
+            self._matrices.pop(namespace, None)
+
+    def _matrix(self, namespace):
+        if namespace not in self._matrices:
+            ns = self._ns(namespace)
+            ids = list(ns)
+            matrix = np.vstack([ns[i][0] for i in ids]) if ids else np.zeros((0, 1), dtype=np.float32)
+            self._matrices[namespace] = (ids, matrix)
+        return self._matrices[namespace]
+
+    def query(self, vector, top_k=10, namespace="default", include_metadata=True, filter=None, **kwargs):
+        from app.services.vector_store import matches_filter
+
+        _sleep(self.latency_ms)
+        with self._lock:
+            ids, matrix = self._matrix(namespace)
+            ns = self._ns(namespace)
+            if not ids:
+                return NS(matches=[])
+            scores = matrix @ np.asarray(vector, dtype=np.float32)
+            order = np.argsort(-scores)
+            matches = []
+            for row in order:
+                metadata = ns[ids[row]][1]
+                if filter and not matches_filter(metadata, filter):
+                    continue
+                matches.append(NS(id=ids[row], score=float(scores[row]), metadata=metadata if include_metadata else None))
+                if len(matches) >= top_k:
+                    break
+            return NS(matches=matches)
+
+    def fetch(self, ids, namespace="default", **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            ns = self._ns(namespace)
+            return NS(vectors={i: NS(id=i, values=ns[i][0].tolist(), metadata=ns[i][1]) for i in ids if i in ns})
+
+    def delete(self, ids=None, namespace="default", filter=None, **kwargs):
+        from app.services.vector_store import matches_filter
+
+        _sleep(self.latency_ms)
+        with self._lock:
+            ns = self._ns(namespace)
+            for i in ids or []:
+                ns.pop(i, None)
+            if filter:
+                for i in [i for i, (_, metadata) in ns.items() if matches_filter(metadata, filter)]:
+                    del ns[i]
+            self._matrices.pop(namespace, None)
+
+    def list(self, prefix="", namespace="default", **kwargs):
+        _sleep(self.latency_ms)
+        with self._lock:
+            ids = [i for i in self._ns(namespace) if i.startswith(prefix)]
+        for start in range(0, len(ids), 100):
+            yield ids[start:start + 100]
+
+    def describe_index_stats(self):
+        with self._lock:
+            return NS(total_vector_count=sum(len(ns) for ns in self._namespaces.values()))
+
+
+# --- Cohere ---
+
+class FakeCohereClient:
+    latency_ms = 0.0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def rerank(self, model, query, documents, top_n=None, **kwargs):
+        """
+        Score = raíz de la proporción de términos de la consulta presentes en el documento, de modo
+        que los chunks del tema preguntado superan el umbral de 0.6 de rag_service y el resto no.
+        """
+        from app.services.lexical_index import tokenize
+
+        _sleep(FakeCohereClient.latency_ms)
+        query_words = set(tokenize(query))
+        scored = []
+        for index, document in enumerate(documents):
+            words = set(tokenize(document if isinstance(document, str) else document.get("text", "")))
+            overlap = len(query_words & words) / (len(query_words) or 1)
+            scored.append(NS(index=index, relevance_score=overlap ** 0.5))
+        scored.sort(key=lambda r: r.relevance_score, reverse=True)
+        return NS(results=scored[:top_n] if top_n else scored)
+
+
+def install(openai_ms: float = 0, chat_ms: float = 0, token_ms: float = 0, pinecone_ms: float = 0, cohere_ms: float = 0, cloudinary_ms: float = 0):
+    """Sustituye los clientes externos. Debe llamarse antes de importar cualquier módulo de `app`."""
+    import cloudinary.uploader
+    import cohere
+    import openai
+    import pinecone
+
+    FakeOpenAI.latency_ms = openai_ms
+    FakeOpenAI.chat_latency_ms = chat_ms
+    FakeOpenAI.token_latency_ms = token_ms
+    FakeCohereClient.latency_ms = cohere_ms
+    index = FakePineconeIndex(pinecone_ms)
+
+    openai.OpenAI = FakeOpenAI
+    pinecone.Pinecone = lambda *args, **kwargs: NS(Index=lambda *a, **k: index, list_indexes=lambda: NS(names=lambda: []))
+    cohere.Client = FakeCohereClient
+
+    def upload(file, **kwargs):
+        _sleep(cloudinary_ms)
+        return {"secure_url": f"https://res.cloudinary.example/{kwargs.get('public_id', 'preview')}.png"}
+
+    cloudinary.uploader.upload = upload
+    return index
+
+
+def use_sqlite_arrays():
+    """
+    Permite usar SQLite como base de datos del benchmark: las columnas ARRAY (PostgreSQL)
+    se guardan como JSON. Solo afecta al dialecto sqlite.
+    """
+    from sqlalchemy import ARRAY
+    from sqlalchemy.ext.compiler import compiles
+
+    @compiles(ARRAY, "sqlite")
+    def _compile_array(element, compiler, **kwargs):
+        return "JSON"
+
+    bind_processor, result_processor = ARRAY.bind_processor, ARRAY.result_processor
+
+    def _bind(self, dialect):
+        if dialect.name == "sqlite":
+            return lambda value: None if value is None else json.dumps(value)
+        return bind_processor(self, dialect)
+
+    def _result(self, dialect, coltype):
+        if dialect.name == "sqlite":
+            return lambda value: None if value is None else json.loads(value)
+        return result_processor(self, dialect, coltype)
+
+    ARRAY.bind_processor = _bind
+    ARRAY.result_processor = _result
@@ -0,0 +1,377 @@
+"""
+Benchmark offline de ingesta y consultas.
+
+Arranca la API (uvicorn, en un hilo) con OpenAI, Pinecone, Cohere y Cloudinary sustituidos por
+los dobles locales de `benchmarks/fakes.py`, sube PDFs sintéticos de distintos tamaños, los procesa
+con `app.worker._run_job` y lanza consultas a `/query/` con varios niveles de concurrencia.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.run --docs 20 --pages 2,10,40 --queries 60 --concurrency 1,4,16
+    python -m benchmarks.run --vector-store local --openai-ms 0 --chat-ms 0
+    python -m benchmarks.compare benchmarks/results/<antes>.json benchmarks/results/<después>.json
+
+Por defecto usa una base de datos SQLite temporal; con `--database-url` se puede apuntar a un
+PostgreSQL de pruebas (vacío: el benchmark crea documentos en él).
+El resultado (métricas, configuración y commit) se guarda como JSON en `benchmarks/results/`.
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Vocabulario de los PDFs sintéticos: cada documento trata sobre un tema y las consultas preguntan por ellos.
+TOPICS = {
+    "energia": "energía renovable solar eólica hidrógeno transición almacenamiento baterías red eléctrica emisiones",
+    "agua": "agua potable cuencas saneamiento riego acuíferos sequía calidad tratamiento reutilización",
+    "salud": "salud pública vacunas epidemiología hospitales atención primaria telemedicina prevención enfermedades",
+    "educacion": "educación escuelas docentes aprendizaje digital competencias universidades deserción evaluación",
+    "agricultura": "agricultura cultivos suelos fertilizantes productividad seguridad alimentaria cosechas clima",
+    "movilidad": "movilidad transporte público vehículos eléctricos infraestructura urbana congestión bicicletas",
+    "innovacion": "innovación tecnología investigación patentes startups financiación transferencia conocimiento",
+    "clima": "cambio climático adaptación mitigación carbono riesgos inundaciones biodiversidad resiliencia",
+}
+FILLER = "el informe analiza los resultados del periodo y presenta recomendaciones para la política regional".split()
+
+
+def _parse_ints(value: str):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark offline de ingesta y consultas del sistema RAG.")
+    parser.add_argument("--docs", type=int, default=12, help="Número de PDFs sintéticos a ingerir.")
+    parser.add_argument("--pages", type=_parse_ints, default=[2, 10, 40], help="Tamaños (páginas) de los PDFs, repartidos en ciclo.")
+    parser.add_argument("--workers", type=int, default=2, help="Workers de ingesta (hilos que ejecutan app.worker._run_job).")
+    parser.add_argument("--queries", type=int, default=40, help="Consultas por nivel de concurrencia.")
+    parser.add_argument("--concurrency", type=_parse_ints, default=[1, 4, 16], help="Niveles de concurrencia de las consultas.")
+    parser.add_argument("--retrieval-mode", default=None, help="retrieval_mode de las consultas (por defecto, el configurado).")
+    parser.add_argument("--quality-tier", default=None, help="quality_tier de las consultas (por defecto, el configurado).")
+    parser.add_argument("--vector-store", choices=["pinecone", "local"], default="pinecone", help="'pinecone' usa el índice falso en memoria.")
+    parser.add_argument("--database-url", default=None, help="Base de datos a usar (por defecto, SQLite temporal).")
+    # Latencias simuladas (ms) de cada servicio externo
+    parser.add_argument("--openai-ms", type=float, default=150, help="Latencia de cada petición de embeddings.")
+    parser.add_argument("--chat-ms", type=float, default=600, help="Latencia hasta la respuesta de chat (o el primer token).")
+    parser.add_argument("--token-ms", type=float, default=5, help="Latencia entre tokens en streaming.")
+    parser.add_argument("--pinecone-ms", type=float, default=40, help="Latencia de cada operación de Pinecone.")
+    parser.add_argument("--cohere-ms", type=float, default=150, help="Latencia del re-ranking.")
+    parser.add_argument("--cloudinary-ms", type=float, default=200, help="Latencia de la subida de la vista previa.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir", default=os.path.join(REPO_ROOT, "benchmarks", "results"))
+    parser.add_argument("--label", default="", help="Etiqueta libre que se guarda con el resultado.")
+    return parser.parse_args(argv)
+
+
+def configure_environment(args, workdir: str):
+    """Variables de entorno de la app; deben fijarse antes de importar `app.core.config`."""
+    for key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "PINECONE_ENVIRONMENT", "CLOUDINARY_CLOUD_NAME",
+                "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET", "COHERE_API_KEY"):
+        os.environ[key] = "benchmark"
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ["VECTOR_STORE_BACKEND"] = args.vector_store
+    os.environ["LOCAL_VECTOR_STORE_DIR"] = os.path.join(workdir, "vector_store")
+    os.environ["LEXICAL_INDEX_PATH"] = os.path.join(workdir, "lexical_index.sqlite3")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+    os.environ["INGESTION_RETRY_BASE_SECONDS"] = "0.5"
+    os.environ["STAGE_RETRY_BASE_SECONDS"] = "0.1"
+    # Las consultas son únicas; sin la caché semántica, ninguna se responde desde la caché.
+    os.environ["ANSWER_CACHE_SEMANTIC"] = "false"
+    os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+
+def make_pdf(index: int, pages: int, rng: random.Random):
+    """PDF sintético de `pages` páginas sobre un tema; devuelve (bytes, tema)."""
+    import fitz
+
+    topic = list(TOPICS)[index % len(TOPICS)]
+    words = TOPICS[topic].split()
+    pdf = fitz.open()
+    for page_number in range(pages):
+        page = pdf.new_page()
+        lines = [f"Informe sintético {index} sobre {topic}, página {page_number + 1}."]
+        for _ in range(40):
+            lines.append(" ".join(rng.choice(words if rng.random() < 0.6 else FILLER) for _ in range(12)))
+        page.insert_textbox(fitz.Rect(40, 40, 560, 800), "\n".join(lines), fontsize=8)
+    data = pdf.tobytes()
+    pdf.close()
+    return data, topic
+
+
+def make_query(rng: random.Random, serial: int, topics) -> str:
+    topic = rng.choice(topics)
+    words = rng.sample(TOPICS[topic].split(), 3)
+    # El número de serie hace única cada consulta (sin aciertos en la caché exacta de respuestas).
+    return f"¿Qué dice el informe sobre {' y '.join(words)}? (consulta {serial})"
+
+
+def peak_rss_mb() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return round(usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024, 1)
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(latencies_ms):
+    return {
+        "p50_ms": round(percentile(latencies_ms, 50), 1),
+        "p95_ms": round(percentile(latencies_ms, 95), 1),
+        "p99_ms": round(percentile(latencies_ms, 99), 1),
+        "mean_ms": round(statistics.fmean(latencies_ms), 1) if latencies_ms else 0.0,
+        "max_ms": round(max(latencies_ms), 1) if latencies_ms else 0.0,
+    }
+
+
+def start_server(port: int):
+    import uvicorn
+    from app.main import app
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 30
+    while not server.started:
+        if time.time() > deadline or not thread.is_alive():
+            raise RuntimeError("El servidor de la API no arrancó.")
+        time.sleep(0.05)
+    return server, thread
+
+
+def _free_port() -> int:
+    import socket
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_ingestion(client, args, rng: random.Random):
+    """Sube los PDFs y los procesa con `args.workers` hilos que consumen la cola de ingesta."""
+    from app.db.crud import claim_next_ingestion_job, get_document_status
+    from app.db.session import SessionLocal
+    from app.worker import _run_job
+
+    print(f"BENCHMARK: Generando {args.docs} PDFs ({args.pages} páginas)...")
+    pdfs = [make_pdf(i, args.pages[i % len(args.pages)], rng) for i in range(args.docs)]
+    total_pages = sum(args.pages[i % len(args.pages)] for i in range(args.docs))
+
+    upload_latencies = []
+    document_ids = []
+    upload_start = time.perf_counter()
+    for i, (data, topic) in enumerate(pdfs):
+        start = time.perf_counter()
+        response = client.post(
+            "/upload-document/",
+            files={"file": (f"benchmark_{i}.pdf", data, "application/pdf")},
+            data={"title": f"Informe sintético {i} ({topic})", "publisher": "Benchmark", "publication_year": str(2015 + i % 10)},
+        )
+        response.raise_for_status()
+        upload_latencies.append((time.perf_counter() - start) * 1000)
+        document_ids.append(response.json()["id"])
+    upload_seconds = time.perf_counter() - upload_start
+
+    claim_lock = threading.Lock()  # SQLite no tiene SKIP LOCKED: serializamos la toma de trabajos
+
+    def worker():
+        while True:
+            db = SessionLocal()
+            try:
+                with claim_lock:
+                    job = claim_next_ingestion_job(db)
+            finally:
+                db.close()
+            if job is None:
+                return
+            _run_job(job)
+
+    print(f"BENCHMARK: Ingiriendo {args.docs} documentos con {args.workers} workers...")
+    ingest_start = time.perf_counter()
+    pending = set(document_ids)
+    while pending:
+        threads = [threading.Thread(target=worker) for _ in range(args.workers)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        db = SessionLocal()
+        try:
+            statuses = {doc_id: get_document_status(db, doc_id) for doc_id in pending}
+        finally:
+            db.close()
+        pending = {doc_id for doc_id, status in statuses.items() if status not in (None, "completed", "failed")}
+        if pending:
+            time.sleep(0.5)  # Trabajos reencolados con backoff
+    ingest_seconds = time.perf_counter() - ingest_start
+
+    db = SessionLocal()
+    try:
+        statuses = [get_document_status(db, doc_id) for doc_id in document_ids]
+    finally:
+        db.close()
+    return {
+        "documents": args.docs,
+        "pages": total_pages,
+        "completed": statuses.count("completed"),
+        "failed": statuses.count("failed"),
+        "upload_seconds": round(upload_seconds, 2),
+        "upload_latency": latency_summary(upload_latencies),
+        "ingest_seconds": round(ingest_seconds, 2),
+        "docs_per_minute": round(args.docs / ingest_seconds * 60, 2) if ingest_seconds else None,
+        "pages_per_minute": round(total_pages / ingest_seconds * 60, 2) if ingest_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_queries(base_url: str, args, concurrency: int, rng: random.Random, serial_start: int):
+    """Lanza `args.queries` consultas únicas con `concurrency` clientes simultáneos."""
+    import httpx
+
+    topics = [list(TOPICS)[i % len(TOPICS)] for i in range(min(args.docs, len(TOPICS)))]  # Temas ingeridos
+    queries = [make_query(rng, serial_start + i, topics) for i in range(args.queries)]
+    payload_options = {"include_timings": True}
+    if args.retrieval_mode:
+        payload_options["retrieval_mode"] = args.retrieval_mode
+    if args.quality_tier:
+        payload_options["quality_tier"] = args.quality_tier
+
+    latencies, stage_timings, errors, cache_hits = [], {}, 0, 0
+    lock = threading.Lock()
+
+    def send(client, query):
+        nonlocal errors, cache_hits
+        start = time.perf_counter()
+        try:
+            response = client.post("/query/", json={"query": query, **payload_options})
+            response.raise_for_status()
+            body = response.json()
+        except Exception as e:
+            with lock:
+                errors += 1
+            print(f"BENCHMARK: Error en la consulta: {e}")
+            return
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if (body.get("pipeline") or {}).get("decisions", {}).get("answer_cache") == "hit":
+                cache_hits += 1
+            for stage, ms in (body.get("timings") or {}).items():
+                stage_timings.setdefault(stage, []).append(ms)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    with httpx.Client(base_url=base_url, timeout=120, limits=limits) as client:
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(lambda q: send(client, q), queries))
+        wall_seconds = time.perf_counter() - wall_start
+
+    return {
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "errors": errors,
+        "answer_cache_hits": cache_hits,
+        "wall_seconds": round(wall_seconds, 2),
+        "qps": round(len(latencies) / wall_seconds, 2) if wall_seconds else None,
+        **latency_summary(latencies),
+        "stages_mean_ms": {stage: round(statistics.fmean(v), 1) for stage, v in sorted(stage_timings.items())},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def git_revision():
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], cwd=REPO_ROOT, capture_output=True, text=True, timeout=30).stdout.strip()
+        except Exception:
+            return ""
+
+    return {"commit": git("rev-parse", "HEAD"), "subject": git("log", "-1", "--format=%s"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    os.chdir(REPO_ROOT)  # La app monta app/static y app/templates con rutas relativas
+    sys.path.insert(0, REPO_ROOT)
+    configure_environment(args, workdir)
+
+    from benchmarks import fakes
+
+    fakes.install(
+        openai_ms=args.openai_ms, chat_ms=args.chat_ms, token_ms=args.token_ms,
+        pinecone_ms=args.pinecone_ms, cohere_ms=args.cohere_ms, cloudinary_ms=args.cloudinary_ms,
+    )
+    if os.environ["DATABASE_URL"].startswith("sqlite"):
+        fakes.use_sqlite_arrays()
+
+    import httpx
+
+    baseline_rss = peak_rss_mb()
+    port = _free_port()
+    server, thread = start_server(port)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            ingestion = run_ingestion(client, args, rng)
+        print(f"BENCHMARK: Ingesta: {ingestion['docs_per_minute']} docs/min, {ingestion['failed']} fallidos, RSS pico {ingestion['peak_rss_mb']} MB.")
+
+        query_results = []
+        serial = 0
+        for concurrency in args.concurrency:
+            result = run_queries(base_url, args, concurrency, rng, serial)
+            serial += args.queries
+            query_results.append(result)
+            print(
+                f"BENCHMARK: Consultas x{concurrency}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                f"p99 {result['p99_ms']} ms, {result['qps']} qps, {result['errors']} errores."
+            )
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {k: v for k, v in vars(args).items() if k not in ("output_dir", "database_url")}
+    config["database"] = "postgresql" if args.database_url and "postgres" in args.database_url else "sqlite"
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": sys.version.split()[0],
+        "config": config,
+        "baseline_rss_mb": baseline_rss,
+        "ingestion": ingestion,
+        "queries": query_results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    name = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{(report['git']['commit'] or 'nogit')[:8]}{'_' + args.label if args.label else ''}.json"
+    output_path = os.path.join(args.output_dir, name)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"BENCHMARK: Resultado guardado en {output_path}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
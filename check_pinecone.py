@@ -45,10 +45,18 @@ try:
 
         # 2. (Opcional) Intentar recuperar un vector específico
         # Cambia el ID al de un documento que sepas que has subido.
-        # Por ejemplo, si el último documento tiene ID 5 en PostgreSQL, usa "doc_5_chunk_0".
+        # Los IDs de los vectores tienen la forma "doc_{id}_chunk_{hash}", así que buscamos
+        # el primero del documento por prefijo (requiere un índice serverless).
         if vector_count > 0:
             doc_id_to_check = 4 # <--- CAMBIA ESTE NÚMERO al ID de un documento que exista en tu BD
             vector_id_to_check = f"doc_{doc_id_to_check}_chunk_0"
+            try:
+                for ids in pinecone_index.list(prefix=f"doc_{doc_id_to_check}_chunk_", namespace="default"):
+                    if ids:
+                        vector_id_to_check = ids[0]
+                        break
+            except Exception as e:
+                print(f"[ALERTA] No se pudo listar por prefijo ({e}); se usará '{vector_id_to_check}'.")
             
             print(f"\n2. Intentando recuperar el vector de prueba: '{vector_id_to_check}'...")
             try:
@@ -0,0 +1,35 @@
+"""
+Entorno de los tests: la app se importa con los servicios externos sustituidos por los dobles de
+benchmarks/fakes.py, SQLite como base de datos y el índice vectorial local, todo en un directorio
+temporal. Las variables deben fijarse antes de importar `app.core.config`.
+"""
+import os
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+_workdir = tempfile.mkdtemp(prefix="rag-tests-")
+for key in ("OPENAI_API_KEY", "PINECONE_API_KEY", "PINECONE_ENVIRONMENT", "CLOUDINARY_CLOUD_NAME",
+            "CLOUDINARY_API_KEY", "CLOUDINARY_API_SECRET", "COHERE_API_KEY"):
+    os.environ[key] = "test"
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_workdir, 'tests.db')}"
+os.environ["VECTOR_STORE_BACKEND"] = "local"
+os.environ["LOCAL_VECTOR_STORE_DIR"] = os.path.join(_workdir, "vector_store")
+os.environ["LEXICAL_INDEX_PATH"] = os.path.join(_workdir, "lexical_index.sqlite3")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(_workdir, "embedding_cache.sqlite3")
+os.environ["UPLOAD_DIR"] = os.path.join(_workdir, "uploads")
+os.environ["STAGE_RETRY_BASE_SECONDS"] = "0"
+os.environ["CLIENTS_WARM_UP"] = "false"
+os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+
+from benchmarks import fakes  # noqa: E402
+
+fakes.install()
+fakes.use_sqlite_arrays()
+
+from app.db.migrations import init_db  # noqa: E402
+from app.db.session import engine  # noqa: E402
+
+init_db(engine)
@@ -0,0 +1,23 @@
+"""
+Caché de respuestas de rag_service.py: una respuesta solo se reutiliza con el mismo nivel de
+calidad, modo de recuperación y filtros con que se generó.
+"""
+from app.services.answer_cache import answer_cache
+from app.services.rag_service import perform_rag_batch, perform_rag_query
+
+
+def _from_cache(result: dict) -> bool:
+    return result["pipeline"]["decisions"].get("answer_cache") == "hit"
+
+
+def test_cached_answer_is_scoped_by_tier_and_retrieval_mode():
+    answer_cache.invalidate()
+    query = "¿Qué dice el informe sobre energía solar?"
+    assert not _from_cache(perform_rag_query(query, retrieval_mode="dense", quality_tier="fast"))
+    assert _from_cache(perform_rag_query(query, retrieval_mode="dense", quality_tier="fast"))
+    assert not _from_cache(perform_rag_query(query, retrieval_mode="dense", quality_tier="deep"))
+    assert not _from_cache(perform_rag_query(query, retrieval_mode="hybrid", quality_tier="fast"))
+    (batch,) = perform_rag_batch([query], retrieval_mode="dense", quality_tier="deep")
+    assert _from_cache(batch)
+    (batch,) = perform_rag_batch([query], retrieval_mode="hybrid", quality_tier="deep")
+    assert not _from_cache(batch)
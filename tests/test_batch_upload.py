@@ -0,0 +1,48 @@
+"""
+Límites de las subidas masivas (app/services/batch_upload.py): un ZIP que supera el número de PDF o
+el tamaño total del lote se rechaza mientras se extrae, sin dejar archivos en UPLOAD_DIR.
+"""
+import io
+import os
+import zipfile
+
+import pytest
+
+from app.core.config import settings
+from app.services.batch_upload import BatchLimits, BatchUploadError, expand_upload_all
+from app.services.uploads import spool_fileobj
+
+PDF = b"%PDF-1.4\n" + b"0" * 1000
+
+
+def _spooled_zip(count: int):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(count):
+            archive.writestr(f"informes/informe_{i}.pdf", PDF + str(i).encode())
+    buffer.seek(0)
+    return spool_fileobj(buffer, suffix=".zip")
+
+
+def _upload_dir_files():
+    return os.listdir(settings.UPLOAD_DIR) if os.path.isdir(settings.UPLOAD_DIR) else []
+
+
+@pytest.mark.parametrize("limits", [BatchLimits(max_files=3, max_total_bytes=10 ** 9), BatchLimits(max_files=100, max_total_bytes=3500)])
+def test_zip_over_batch_limits_is_rejected_while_extracting(limits):
+    before = set(_upload_dir_files())
+    with pytest.raises(BatchUploadError):
+        expand_upload_all("lote.zip", _spooled_zip(10), limits)
+    # Se detiene en el primer archivo que no cabe y borra el ZIP y los PDF ya extraídos
+    assert limits.files <= 4
+    assert set(_upload_dir_files()) == before
+
+
+def test_zip_within_batch_limits_is_extracted():
+    limits = BatchLimits(max_files=10, max_total_bytes=10 ** 9)
+    expanded = expand_upload_all("lote.zip", _spooled_zip(10), limits)
+    assert [name for name, _, _ in expanded] == [f"informe_{i}.pdf" for i in range(10)]
+    assert all(pdf is not None and reason is None for _, pdf, reason in expanded)
+    assert limits.files == 10 and limits.total_bytes == sum(pdf.size for _, pdf, _ in expanded)
+    for _, pdf, _ in expanded:
+        os.remove(pdf.path)
@@ -0,0 +1,64 @@
+"""
+Caché de embeddings (app/services/embedding_cache.py): el contador de bytes del nivel persistente
+coincide con sus filas tras inserciones, reemplazos y desalojos, y los aciertos no escriben en
+SQLite hasta el siguiente put o hasta que pasa `touch_flush_seconds`.
+"""
+import sqlite3
+
+from app.services.embedding_cache import EmbeddingCache, _cache_key
+
+MODEL = "text-embedding-3-small"
+VECTOR_BYTES = 16 * 4
+
+
+def _vectors(count: int, offset: float = 0.0):
+    return [[float(i) + offset] * 16 for i in range(count)]
+
+
+def _totals(path: str):
+    with sqlite3.connect(path) as conn:
+        counted = conn.execute("SELECT value FROM stats WHERE key = 'total_bytes'").fetchone()[0]
+        actual = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+    return counted, actual
+
+
+def _last_used(path: str, text: str) -> float:
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT last_used FROM embeddings WHERE key = ?", (_cache_key(MODEL, text),)).fetchone()[0]
+
+
+def test_byte_total_tracks_inserts_replacements_and_evictions(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path, memory_items=5, max_bytes=50 * VECTOR_BYTES)
+    texts = [f"chunk {i}" for i in range(40)]
+    cache.put_many(MODEL, texts, _vectors(40))
+    assert _totals(path) == (40 * VECTOR_BYTES, 40 * VECTOR_BYTES)
+    # Reemplazos (también repetidos en el mismo put) no cuentan dos veces
+    cache.put_many(MODEL, texts[:10] + texts[:3], _vectors(13, offset=0.5))
+    assert _totals(path) == (40 * VECTOR_BYTES, 40 * VECTOR_BYTES)
+    # Superar el límite desaloja hasta el 90 %
+    cache.put_many(MODEL, [f"nuevo {i}" for i in range(20)], _vectors(20))
+    counted, actual = _totals(path)
+    assert counted == actual <= 45 * VECTOR_BYTES
+    # Una caché creada antes del contador lo calcula al abrirse
+    with sqlite3.connect(path) as conn:
+        conn.execute("DROP TABLE stats")
+    reopened = EmbeddingCache(path, memory_items=5, max_bytes=50 * VECTOR_BYTES)
+    reopened.put_many(MODEL, ["otro"], _vectors(1))
+    assert _totals(path) == (actual + VECTOR_BYTES, actual + VECTOR_BYTES)
+
+
+def test_hits_update_last_used_in_batches(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = EmbeddingCache(path, memory_items=1, max_bytes=10 ** 9, touch_flush_seconds=3600)
+    cache.put_many(MODEL, ["a", "b"], _vectors(2))
+    stored = _last_used(path, "a")
+    assert cache.get_many(MODEL, ["a", "b", "c"])[2] is None
+    assert _last_used(path, "a") == stored  # Pendiente en memoria
+    cache.put_many(MODEL, ["c"], _vectors(1))
+    assert _last_used(path, "a") > stored  # Escrito con el put
+
+    cache.touch_flush_seconds = 0
+    stored = _last_used(path, "b")
+    cache.get_many(MODEL, ["b"])
+    assert _last_used(path, "b") > stored
@@ -0,0 +1,117 @@
+"""
+Reconstrucción de una versión del índice (index_builder.py) a partir de los chunks guardados: con
+documentos ingeridos antes de existir la tabla de chunks (solo tienen vectores, con IDs posicionales
+y el texto en los metadatos) y con chunks que se repiten dentro del documento.
+"""
+import threading
+
+import pytest
+
+from app.core.clients import vector_store
+from app.db.crud import claim_index_build, create_index_version, get_document_chunks, get_index_version
+from app.db.session import SessionLocal
+from app.models.document import Document
+from app.models.index_version import IndexVersion
+from app.services.index_builder import build_index_version
+from app.services.index_versions import DEFAULT_INDEX, index_registry, index_spec
+from app.services.pipeline import _index_pages, _sync_version_chunks, _vector_metadata, reindex_document
+from benchmarks.fakes import fake_embedding
+
+LEGACY_CHUNKS = [
+    "Informe de vigilancia tecnológica sobre energía solar y almacenamiento en baterías.",
+    "almacenamiento en baterías. La red eléctrica incorpora hidrógeno verde y eólica marina.",
+    "Conclusiones: la transición energética requiere inversión en transmisión y flexibilidad.",
+]
+
+
+def _legacy_document(db) -> int:
+    document = Document(title="Legado", filename="legado.pdf", status="completed", publication_year=2020, language="es")
+    db.add(document)
+    db.commit()
+    vector_store().upsert(
+        [
+            {
+                "id": f"doc_{document.id}_chunk_{i}",
+                "values": fake_embedding(text).tolist(),
+                "metadata": {"document_id": document.id, "title": "Legado", "text": text},
+            }
+            for i, text in enumerate(LEGACY_CHUNKS)
+        ],
+        namespace="default",
+    )
+    return document.id
+
+
+def _build(db, version_id: int):
+    claimed = claim_index_build(db, lease_seconds=300)
+    assert claimed.id == version_id
+    return build_index_version(version_id, threading.Event())
+
+
+def _retire_versions(db):
+    # Los demás tests usan el índice original
+    db.query(IndexVersion).update({"status": "retired"})
+    db.commit()
+    index_registry.refresh(force=True)
+
+
+def test_rebuild_uses_vector_text_when_document_has_no_chunk_rows():
+    db = SessionLocal()
+    try:
+        document_id = _legacy_document(db)
+        assert get_document_chunks(db, document_id, None) == []
+        version = create_index_version(db, chunk_size=60, chunk_overlap=10, embedding_model="text-embedding-3-small", activate_when_ready=True)
+        assert _build(db, version.id) == 'active'
+
+        db.expire_all()
+        built = get_index_version(db, version.id)
+        assert (built.documents_done, built.documents_failed) == (1, 0)
+        chunks = get_document_chunks(db, document_id, version.id)
+        assert chunks and all(len(chunk.text) <= 60 for chunk in chunks)
+        rebuilt = " ".join(chunk.text for chunk in chunks)
+        for word in ("solar", "hidrógeno", "Conclusiones", "flexibilidad"):
+            assert word in rebuilt
+        # El solapamiento de los chunks antiguos no se duplica en el texto reconstruido
+        assert rebuilt.count("almacenamiento en baterías") <= 2
+        assert vector_store().fetch([chunks[0].vector_id], namespace=built.namespace)
+    finally:
+        _retire_versions(db)
+        db.close()
+
+
+# Párrafos de más de medio chunk (1000 caracteres en el índice original): uno por chunk
+REPEATED = ("Aviso legal: este informe es confidencial y de uso interno. " * 10).strip()
+SOLAR = ("Energía solar en la región andina, con almacenamiento en baterías. " * 9).strip()
+HYDROGEN = ("Hidrógeno verde producido con eólica marina y electrolizadores. " * 9).strip()
+
+
+def test_rebuild_keeps_every_occurrence_of_repeated_chunks():
+    pages = [f"{REPEATED}\n\n{SOLAR}\n\n{REPEATED}", f"\n\n{HYDROGEN}\n\n{REPEATED}"]
+    db = SessionLocal()
+    try:
+        document = Document(title="Repetido", filename="repetido.pdf", status="completed", publication_year=2024, language="es")
+        db.add(document)
+        db.commit()
+        chunk_records, new_chunks = _index_pages(db, pages, document.id, _vector_metadata(document.id, 2024, "es"), DEFAULT_INDEX)
+        _sync_version_chunks(db, document.id, DEFAULT_INDEX, chunk_records, new_chunks)
+        rows = get_document_chunks(db, document.id, None)
+        repeated = [row for row in rows if row.text == REPEATED]
+        # Un solo vector para el texto repetido, con la posición de las otras dos apariciones
+        assert len(rows) == 3 and len(repeated) == 1 and len(repeated[0].repeats) == 2
+
+        version = create_index_version(db, chunk_size=1000, chunk_overlap=200, embedding_model="text-embedding-3-small")
+        assert _build(db, version.id) == 'ready'
+        db.expire_all()
+        rebuilt = [row.text for row in get_document_chunks(db, document.id, version.id)]
+        assert rebuilt.count(REPEATED) == 1
+        assert sum(len(row.repeats or []) for row in get_document_chunks(db, document.id, version.id)) == 2
+        assert SOLAR in rebuilt and HYDROGEN in rebuilt
+
+        # Filas guardadas antes de registrar las repeticiones: se niega a reconstruir con huecos
+        repeated[0].repeats = None
+        db.commit()
+        with pytest.raises(ValueError):
+            reindex_document(document, DEFAULT_INDEX, index_spec(get_index_version(db, version.id)))
+    finally:
+        _retire_versions(db)
+        db.close()
@@ -0,0 +1,82 @@
+"""
+Búsqueda BM25 de app/services/lexical_index.py, que suma y ordena los scores en SQLite: debe dar
+los mismos resultados que la fórmula calculada en Python, con y sin filtro de documentos.
+"""
+import math
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+from app.services.lexical_index import BM25Index, tokenize
+
+WORDS = "energía solar eólica hidrógeno agua salud red batería 2030 ods costo".split()
+
+
+def _reference(chunks, query, top_k, document_ids=None, k1=1.2, b=0.75):
+    tfs = {chunk_id: (document_id, Counter(tokenize(text))) for chunk_id, document_id, text in chunks}
+    avg_length = sum(sum(tf.values()) for _, tf in tfs.values()) / len(tfs)
+    df = Counter(term for _, tf in tfs.values() for term in tf)
+    scores = {}
+    for term in dict.fromkeys(tokenize(query)):
+        if term not in df:
+            continue
+        idf = math.log(1 + (len(tfs) - df[term] + 0.5) / (df[term] + 0.5))
+        for chunk_id, (document_id, tf) in tfs.items():
+            if tf[term] and (document_ids is None or document_id in document_ids):
+                norm = tf[term] * (k1 + 1) / (tf[term] + k1 * (1 - b + b * sum(tf.values()) / avg_length))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * norm
+    return sorted(scores.values(), reverse=True)[:top_k]
+
+
+@pytest.fixture
+def index(tmp_path):
+    rng = random.Random(7)
+    chunks = [(f"c{i}", i % 7, " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 40)))) for i in range(300)]
+    bm25 = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    bm25.add(chunks)
+    bm25.remove(["c5", "c9"])
+    yield bm25, [chunk for chunk in chunks if chunk[0] not in ("c5", "c9")]
+    bm25.drop()
+
+
+@pytest.mark.parametrize("query, document_ids", [
+    ("energía solar e hidrógeno", None),
+    ("agua 2030 ods", {1, 3}),
+    ("red", {6}),
+    ("término inexistente", None),
+])
+def test_search_matches_reference_scores(index, query, document_ids):
+    bm25, chunks = index
+    scores = [score for _, score in bm25.search(query, top_k=10, document_ids=document_ids)]
+    assert scores == pytest.approx(_reference(chunks, query, 10, document_ids))
+
+
+def test_search_with_empty_filter_or_after_drop(index):
+    bm25, _ = index
+    assert bm25.search("solar", document_ids=set()) == []
+    bm25.drop()
+    assert bm25.search("solar") == []
+    bm25.add([("nuevo", 1, "energía solar")])
+    assert [chunk_id for chunk_id, _ in bm25.search("solar")] == ["nuevo"]
+
+
+def test_concurrent_searches_while_writing(index):
+    bm25, _ = index
+    errors = []
+
+    def search():
+        try:
+            for _ in range(30):
+                assert bm25.search("solar red", top_k=5)
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    bm25.add([(f"n{i}", 1, "solar solar red") for i in range(50)])
+    for thread in threads:
+        thread.join()
+    assert errors == []
@@ -0,0 +1,106 @@
+"""
+Almacén vectorial local (app/services/vector_store.py): recarga incremental entre instancias (como
+entre la API y los workers), compactación de los borrados y filtros vectorizados por columnas, que
+deben coincidir con `matches_filter` evaluado fila a fila.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from app.core.config import settings
+from app.services.vector_store import LocalVectorStore, matches_filter
+
+DIM = 8
+LANGUAGES = ["es", "en", "pt"]
+
+
+def _vectors(count: int, seed: int = 0, start: int = 0):
+    rng = random.Random(seed)
+    vectors = []
+    for i in range(start, start + count):
+        metadata = {"document_id": i % 10}
+        if i % 4:
+            metadata["publication_year"] = 2015 + i % 9
+        if i % 5:
+            metadata["language"] = LANGUAGES[i % 3]
+        vectors.append({"id": f"doc_{i % 10}_{i}", "values": [rng.uniform(-1, 1) for _ in range(DIM)], "metadata": metadata})
+    return vectors
+
+
+def _results(store: LocalVectorStore, queries, filter=None):
+    return [[(match.id, round(match.score, 5)) for match in matches] for matches in store.query_many(queries, top_k=15, filter=filter)]
+
+
+@pytest.fixture
+def always_refresh(monkeypatch):
+    # Cada consulta comprueba las escrituras de las demás instancias
+    monkeypatch.setattr(settings, "LOCAL_VECTOR_STORE_REFRESH_SECONDS", 0.0)
+
+
+FILTERS = [
+    {"document_id": {"$in": [1, 3, 5]}},
+    {"document_id": 4},
+    {"language": {"$eq": "es"}},
+    {"language": {"$ne": "en"}},
+    {"language": {"$nin": ["es", "xx"]}},
+    {"publication_year": {"$gte": 2018, "$lte": 2021}},
+    {"publication_year": {"$lt": 2017}, "language": "pt"},
+    {"$or": [{"document_id": {"$in": [2]}}, {"publication_year": {"$gt": 2022}}]},
+    {"$and": [{"language": {"$in": ["es", "pt"]}}, {"document_id": {"$nin": [0, 6]}}]},
+    {"publication_year": {"$gte": "2018"}},  # Tipo distinto: se evalúa fila a fila
+]
+
+
+@pytest.mark.parametrize("filter", FILTERS)
+def test_column_filters_match_row_filters(tmp_path, filter):
+    store = LocalVectorStore(str(tmp_path))
+    store.upsert(_vectors(200))
+    ns = store._ns("default")
+    expected = [m is not None and matches_filter(m, filter) for m in ns.metadata[:ns.count]]
+    assert ns.filter_mask(filter).tolist() == expected
+
+
+def test_irregular_metadata_falls_back_to_row_filters(tmp_path):
+    store = LocalVectorStore(str(tmp_path))
+    vectors = _vectors(20)
+    vectors[3]["metadata"]["language"] = ["es", "en"]  # Campo lista: cumple $eq si alguno coincide
+    store.upsert(vectors)
+    assert "language" in store._ns("default").irregular
+    ids = {match.id for match in store.query(vectors[3]["values"], top_k=20, filter={"language": "en"})}
+    assert vectors[3]["id"] in ids
+
+
+def test_compaction_keeps_ids_scores_and_filters(tmp_path, always_refresh):
+    writer = LocalVectorStore(str(tmp_path))
+    reader = LocalVectorStore(str(tmp_path))  # Otra instancia, como otro proceso
+    vectors = _vectors(60)
+    writer.upsert(vectors)
+    queries = [v["values"] for v in _vectors(3, seed=1)]
+    assert _results(reader, queries) == _results(writer, queries)
+
+    deleted = [v["id"] for v in vectors[::3]]
+    writer.delete(deleted)
+    writer.delete_by_document(7)
+    live = [v for v in vectors if v["id"] not in deleted and v["metadata"]["document_id"] != 7]
+    before = {str(filter): _results(writer, queries, filter) for filter in [None] + FILTERS}
+    assert before[str(None)] == _results(reader, queries)
+
+    ns = writer._ns("default")
+    ns.compact()
+    assert ns.epoch == 1 and ns.count == len(live)
+    for store in (writer, reader, LocalVectorStore(str(tmp_path))):
+        assert store._ns("default").epoch in (0, 1)
+        for filter in [None] + FILTERS:
+            assert _results(store, queries, filter) == before[str(filter)]
+        assert store._ns("default").epoch == 1
+        assert sorted(store.list_ids("doc_")) == sorted(v["id"] for v in live)
+        assert set(store.fetch(deleted)) == set()
+
+    # Las escrituras posteriores a la compactación se ven de forma incremental en la otra instancia
+    added = _vectors(5, seed=2, start=1000)
+    reader.upsert(added)
+    assert set(writer.fetch([v["id"] for v in added])) == {v["id"] for v in added}
+    top = writer.query(added[0]["values"], top_k=1)[0]
+    assert top.id == added[0]["id"] and top.score == pytest.approx(1.0, abs=1e-5)
+    assert np.isclose(writer._ns("default").filter_mask({"document_id": 0}).sum(), reader._ns("default").filter_mask({"document_id": 0}).sum())
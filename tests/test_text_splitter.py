@@ -0,0 +1,57 @@
+"""
+Regresión de `RecursiveSplitter` frente a `RecursiveCharacterTextSplitter` de LangChain, al que
+sustituye en la ingesta: con los mismos parámetros y separadores debe dar exactamente los mismos
+chunks, y cada intervalo debe señalar su chunk en el texto original.
+
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+import random
+
+import pytest
+
+langchain_text_splitters = pytest.importorskip("langchain_text_splitters")
+
+from app.services.pipeline import CHUNK_SEPARATORS  # noqa: E402
+from app.services.text_splitter import RecursiveSplitter  # noqa: E402
+
+# Trozos con los que se arman los textos aleatorios: separadores de todos los niveles, espacios
+# repetidos y palabras más largas que el chunk, que obligan a partir carácter a carácter.
+ALPHABET = ["a", "b", " ", "\n", "\n\n", ".", ". ", "  ", "\t", "x" * 50, "palabra"]
+
+
+def _assert_same_chunks(text: str, chunk_size: int, chunk_overlap: int):
+    expected = langchain_text_splitters.RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, separators=CHUNK_SEPARATORS
+    ).split_text(text)
+    splitter = RecursiveSplitter(chunk_size, chunk_overlap, CHUNK_SEPARATORS)
+    spans = splitter.split_spans(text)
+    assert [text[start:end] for start, end in spans] == expected
+    assert splitter.split_text(text) == expected
+    assert [start for start, _ in spans] == sorted(start for start, _ in spans)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_langchain_on_random_text(seed):
+    rng = random.Random(seed)
+    for _ in range(300):
+        text = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(0, 400)))
+        chunk_size = rng.randint(1, 60)
+        _assert_same_chunks(text, chunk_size, rng.randint(0, chunk_size))
+
+
+def test_matches_langchain_with_pipeline_settings():
+    rng = random.Random(42)
+    words = "vigilancia tecnológica inteligencia competitiva energía agua salud educación informe".split()
+    paragraphs = []
+    for _ in range(200):
+        sentences = [" ".join(rng.choice(words) for _ in range(rng.randint(3, 30))) for _ in range(rng.randint(1, 8))]
+        paragraphs.append(". ".join(sentences) + ".")
+    text = "\n\n".join(paragraph.replace(". ", ".\n", 1) for paragraph in paragraphs)
+    _assert_same_chunks(text, 1000, 200)
+    _assert_same_chunks(text, 400, 50)
+
+
+def test_rejects_overlap_larger_than_chunk():
+    with pytest.raises(ValueError):
+        RecursiveSplitter(10, 11, CHUNK_SEPARATORS)
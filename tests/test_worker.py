@@ -0,0 +1,69 @@
+"""
+Reintentos de la cola de ingesta (app/worker.py): los errores permanentes del pipeline fallan el
+trabajo en el primer intento; los transitorios lo devuelven a la cola.
+"""
+import os
+
+import pytest
+
+import app.services.pipeline as pipeline
+from app import worker
+from app.core.config import settings
+from app.db.crud import claim_next_ingestion_job, create_document_with_ingestion_job
+from app.db.session import SessionLocal
+from app.models.document import Document
+from app.models.ingestion_job import IngestionJob
+
+
+def _queued_job(db, tmp_path, name: str, content: bytes):
+    file_path = str(tmp_path / name)
+    with open(file_path, "wb") as f:
+        f.write(content)
+    document = create_document_with_ingestion_job(db, {"filename": name, "language": "es"}, file_path, max_attempts=3)
+    job = claim_next_ingestion_job(db)
+    assert job.document_id == document.id
+    return job
+
+
+def test_permanent_error_fails_the_job_without_retrying(tmp_path):
+    db = SessionLocal()
+    try:
+        job = _queued_job(db, tmp_path, "corrupto.pdf", b"esto no es un PDF")
+        worker._run_job(job)
+        db.expire_all()
+        failed = db.get(IngestionJob, job.id)
+        assert (failed.status, failed.attempts) == ("failed", 1)
+        assert db.get(Document, job.document_id).status == "failed"
+        assert not os.path.exists(job.file_path)
+    finally:
+        db.close()
+
+
+def test_transient_error_requeues_the_job(tmp_path, monkeypatch):
+    def timeout(**kwargs):
+        raise TimeoutError("OpenAI no respondió")
+
+    monkeypatch.setattr(pipeline, "process_pdf_pipeline", timeout)
+    monkeypatch.setattr(settings, "INGESTION_RETRY_BASE_SECONDS", 0)
+    db = SessionLocal()
+    try:
+        job = _queued_job(db, tmp_path, "informe.pdf", b"%PDF-1.4\n")
+        worker._run_job(job)
+        db.expire_all()
+        queued = db.get(IngestionJob, job.id)
+        assert (queued.status, queued.last_error) == ("queued", "OpenAI no respondió")
+        assert db.get(Document, job.document_id).status == "processing"
+        assert os.path.exists(job.file_path)
+    finally:
+        db.query(IngestionJob).filter(IngestionJob.status == "queued").update({"status": "failed"})
+        db.commit()
+        db.close()
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (ValueError("El PDF parece estar basado en imágenes o tiene muy poco texto."), False),
+    (RuntimeError("cannot open broken document"), False),
+    (ConnectionError("reset"), True),
+])
+def test_retryable_errors(error, retryable):
+    assert worker._is_retryable(error) is retryable